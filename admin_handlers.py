@@ -3,25 +3,91 @@
 from telebot import TeleBot
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from config import ADMIN_ID, PLANES, PLANES_PRECIOS
-from storage import load_users, save_users
-from utils import generate_qr_code, delete_conf
+from storage import get_user, get_user_version, insert_user, pop_user, update_user, find_user_by_ip, find_user_by_public_key
+from utils import delete_conf, release_ip
+from qr_service import qr_image
+from wgconf import cached_config, conf_document, discard_artifacts
 from generator import generar_configuracion
+from bulk import parse_lista, provisionar_lote
+from listing import VER, ELIMINAR, render_page, render_busqueda, render_confirmacion, parse_callback_pagina, parse_callback_eliminar
+from scheduler import schedule_client, cancel_client, parse_vencimiento
+from wg_sync import request_sync
+from stats import get_stats, formato_panel
+from telemetry import get_telemetry, formato_bytes, formato_handshake
+from metrics import resumen, get_profiler
+from backup import create_backup, restore_backup
+from reclaim import get_reclaimer
+from quota import get_quota_engine, cuota_plan
+from client_handlers import create_link_code
 from datetime import datetime, timedelta
 import os
+from io import BytesIO
 
-ADMIN_FLOW = {}  # Flujo activo por administrador
+class AdminFlow:
+    """
+    Paso del flujo activo de cada administrador ({'step': ..., datos}).
+
+    No usa locks: el dispatcher atiende a cada usuario en un solo hilo a la
+    vez (ver KeyedWorkerPool en dispatcher.py), así que cada entrada tiene
+    un único escritor y las operaciones de dict son atómicas.
+    """
+
+    def __init__(self):
+        self._flujos = {}
+
+    def step(self, user_id):
+        return self._flujos.get(user_id, {}).get('step')
+
+    def start(self, user_id, step, **datos):
+        self._flujos[user_id] = dict(datos, step=step)
+
+    def data(self, user_id):
+        """Datos del flujo activo (se pueden modificar mientras dure el paso)."""
+        return self._flujos.get(user_id)
+
+    def take(self, user_id, step):
+        """Quita y devuelve el flujo si está en `step` (None si no)."""
+        flujo = self._flujos.get(user_id)
+        if flujo is None or flujo.get('step') != step:
+            return None
+        return self._flujos.pop(user_id, None)
+
+    def clear(self, user_id):
+        self._flujos.pop(user_id, None)
+
+
+ADMIN_FLOW = AdminFlow()  # Flujo activo por administrador
+
+# Botones del menú principal (siguen en pantalla durante los pasos con teclado en línea)
+MENU_ADMIN = (
+    "📦 Crear configuración",
+    "🗑 Eliminar configuración",
+    "📄 Ver configuraciones activas",
+    "🔎 Buscar cliente",
+    "📊 Ver estadísticas",
+    "📁 Respaldar datos",
+    "🔙 Salir",
+)
+
+
+def es_menu(texto) -> bool:
+    """True si el texto es un botón del menú principal o un comando."""
+    return texto in MENU_ADMIN or (texto or "").startswith("/")
 
 def is_admin(user_id):
     return user_id == ADMIN_ID
 
 def register_admin_handlers(bot: TeleBot):
 
-    @bot.message_handler(commands=['admin', 'start'])
+    # El /start de los clientes lo atiende el portal (ver client_handlers.py)
+    @bot.message_handler(commands=['admin', 'start'], func=lambda m: is_admin(m.from_user.id))
     def handle_admin(message):
-        if is_admin(message.from_user.id):
-            show_admin_menu(bot, message.chat.id)
-        else:
-            bot.reply_to(message, "⛔️ No tienes permisos para acceder a este panel.")
+        ADMIN_FLOW.clear(message.from_user.id)
+        show_admin_menu(bot, message.chat.id)
+
+    @bot.message_handler(commands=['admin'])
+    def sin_permisos(message):
+        bot.reply_to(message, "⛔️ No tienes permisos para acceder a este panel.")
 
     @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📦 Crear configuración")
     def start_create_config(message):
@@ -30,22 +96,18 @@ def register_admin_handlers(bot: TeleBot):
             "🧾 Escribe un *nombre único* para el cliente (sin espacios ni símbolos):",
             parse_mode="Markdown"
         )
-        ADMIN_FLOW[message.from_user.id] = {'step': 'awaiting_name'}
+        ADMIN_FLOW.start(message.from_user.id, 'awaiting_name')
 
-    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and ADMIN_FLOW.get(m.from_user.id, {}).get('step') == 'awaiting_name')
+    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and ADMIN_FLOW.step(m.from_user.id) == 'awaiting_name')
     def ask_plan(message):
         client_name = message.text.strip()
         if " " in client_name or not client_name.isalnum():
             return bot.reply_to(message, "⚠️ Nombre inválido. Usa solo letras y números.")
 
-        users = load_users()
-        if client_name in users:
+        if get_user(client_name) is not None:
             return bot.reply_to(message, "❗ Este nombre ya está en uso. Elige otro diferente.")
 
-        ADMIN_FLOW[message.from_user.id] = {
-            'step': 'awaiting_plan',
-            'client_name': client_name
-        }
+        ADMIN_FLOW.start(message.from_user.id, 'awaiting_plan', client_name=client_name)
 
         kb = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
         for plan in PLANES:
@@ -59,17 +121,19 @@ def register_admin_handlers(bot: TeleBot):
             reply_markup=kb
         )
 
-    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and ADMIN_FLOW.get(m.from_user.id, {}).get('step') == 'awaiting_plan')
+    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and ADMIN_FLOW.step(m.from_user.id) == 'awaiting_plan')
     def generate_configuration(message):
         if message.text == "🔙 Volver":
-            ADMIN_FLOW.pop(message.from_user.id, None)
+            ADMIN_FLOW.clear(message.from_user.id)
             return show_admin_menu(bot, message.chat.id)
 
         plan = message.text.replace("💼", "").replace("🎁", "").replace("🕐", "").strip()
         if plan not in PLANES_PRECIOS:
             return bot.reply_to(message, "❌ Plan inválido. Usa los botones del teclado.")
 
-        data = ADMIN_FLOW.pop(message.from_user.id)
+        data = ADMIN_FLOW.take(message.from_user.id, 'awaiting_plan')
+        if data is None:
+            return
         client_name = data['client_name']
         dias = PLANES_PRECIOS[plan].get('dias', 0)
         horas = PLANES_PRECIOS[plan].get('horas', 0)
@@ -85,14 +149,22 @@ def register_admin_handlers(bot: TeleBot):
                 "private_key": result["private_key"],
                 "public_key": result["public_key"],
                 "ip": result["ip"],
+                "interfaz": result["interfaz"],
                 "conf_path": result["conf_path"],
                 "vencimiento": vencimiento.strftime('%Y-%m-%d %H:%M:%S'),
                 "plan": plan
             }
 
-            users = load_users()
-            users[client_name] = client_data
-            save_users(users)
+            # Solo si el nombre sigue libre (otro alta o un lote pudo tomarlo mientras tanto)
+            if not insert_user(client_name, client_data):
+                release_ip(result["ip"])
+                if os.path.exists(result["conf_path"]):
+                    os.remove(result["conf_path"])
+                return bot.send_message(message.chat.id, "❗ Este nombre ya está en uso. Elige otro diferente.")
+
+            schedule_client(client_name, client_data)
+            get_stats().on_create(client_name, client_data)
+            request_sync()
 
             bot.send_message(
                 message.chat.id,
@@ -101,81 +173,475 @@ def register_admin_handlers(bot: TeleBot):
                 reply_markup=ReplyKeyboardRemove()
             )
 
-            with open(result["conf_path"], "rb") as f:
-                bot.send_document(message.chat.id, f)
-
-            qr_img = generate_qr_code(result["conf_path"])
+            bot.send_document(message.chat.id, conf_document(client_name, result["config_text"]))
+            qr_img = qr_image(result["config_text"])
             bot.send_photo(message.chat.id, qr_img, caption="📲 Escanea este código QR con WireGuard")
 
         except Exception as e:
             bot.send_message(message.chat.id, f"🚫 Error inesperado: {str(e)}")
 
+    @bot.message_handler(commands=['conf'])
+    def reenviar_configuracion(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        if len(partes) < 2:
+            return bot.reply_to(message, "✍️ Uso: /conf <nombre>")
+        datos = get_user(partes[1])
+        if datos is None:
+            return bot.reply_to(message, "⚠️ Cliente no encontrado.")
+
+        if datos.get("suspendido"):
+            return bot.reply_to(message, f"💤 Cliente suspendido por inactividad. Reactívalo con /reanudar {partes[1]}")
+
+        config_text = cached_config(datos["private_key"], datos["ip"])
+        bot.send_document(message.chat.id, conf_document(partes[1], config_text))
+        bot.send_photo(message.chat.id, qr_image(config_text), caption="📲 Escanea este código QR con WireGuard")
+
+    @bot.message_handler(commands=['lote'])
+    def start_bulk(message):
+        if not is_admin(message.from_user.id):
+            return
+        bot.send_message(
+            message.chat.id,
+            "📥 Envía un archivo .csv/.txt (o pega el texto) con una línea por cliente:\n"
+            "<code>nombre,plan</code>\n\n"
+            f"Planes: {', '.join(PLANES)}",
+            parse_mode="HTML"
+        )
+        ADMIN_FLOW.start(message.from_user.id, 'awaiting_bulk')
+
+    @bot.message_handler(
+        content_types=['document', 'text'],
+        func=lambda m: is_admin(m.from_user.id) and ADMIN_FLOW.step(m.from_user.id) == 'awaiting_bulk'
+    )
+    def generate_bulk(message):
+        ADMIN_FLOW.clear(message.from_user.id)
+        if message.content_type == 'document':
+            archivo = bot.get_file(message.document.file_id)
+            texto = bot.download_file(archivo.file_path).decode("utf-8-sig")
+        else:
+            texto = message.text
+
+        try:
+            resultado = provisionar_lote(parse_lista(texto))
+        except ValueError as e:
+            return bot.send_message(message.chat.id, f"⚠️ Lista inválida:\n{e}")
+        except Exception as e:
+            return bot.send_message(message.chat.id, f"🚫 Error inesperado: {str(e)}")
+
+        archivo_zip = BytesIO(resultado["zip"])
+        archivo_zip.name = f"lote_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
+        bot.send_document(
+            message.chat.id,
+            archivo_zip,
+            caption=f"✅ {len(resultado['clientes'])} configuraciones generadas"
+        )
+
+    def eliminar_cliente(client_name, version=None):
+        """
+        Elimina un cliente y libera sus recursos. Devuelve sus datos o None.
+        Con `version`, solo si no cambió desde que se mostró al administrador.
+        """
+        datos = pop_user(client_name, version)
+        if datos is None:
+            return None
+        cancel_client(client_name)
+        get_stats().on_delete(client_name)
+        delete_conf(client_name)
+        discard_artifacts(client_name, datos.get("private_key"), datos.get("ip"))
+        release_ip(datos.get("ip"))
+        request_sync([datos.get("public_key")])
+        return datos
+
     @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "🗑 Eliminar configuración")
     def eliminar_config_prompt(message):
-        users = load_users()
-        if not users:
+        texto, kb = render_page(ELIMINAR)
+        if kb is None:
             return bot.send_message(message.chat.id, "ℹ️ No hay configuraciones registradas.")
 
-        kb = ReplyKeyboardMarkup(resize_keyboard=True)
-        for name in users:
-            kb.add(KeyboardButton(name))
-        bot.send_message(message.chat.id, "❌ Selecciona una configuración para eliminar:", reply_markup=kb)
-        ADMIN_FLOW[message.from_user.id] = {'step': 'awaiting_delete'}
+        bot.send_message(message.chat.id, texto + "\n✍️ También puedes escribir el nombre.", reply_markup=kb, parse_mode="HTML")
+        ADMIN_FLOW.start(message.from_user.id, 'awaiting_delete')
 
-    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and ADMIN_FLOW.get(m.from_user.id, {}).get('step') == 'awaiting_delete')
-    def eliminar_config(message):
-        client_name = message.text.strip()
-        users = load_users()
-        if client_name not in users:
-            return bot.reply_to(message, "⚠️ Nombre inválido.")
+    def esperando_nombre_a_eliminar(m) -> bool:
+        if not is_admin(m.from_user.id) or ADMIN_FLOW.step(m.from_user.id) != 'awaiting_delete':
+            return False
+        if es_menu(m.text):
+            # El menú principal sigue en pantalla: otro botón o comando cancela el paso y sigue de largo
+            ADMIN_FLOW.clear(m.from_user.id)
+            return False
+        return True
 
-        delete_conf(client_name)
-        users.pop(client_name)
-        save_users(users)
+    @bot.message_handler(func=esperando_nombre_a_eliminar)
+    def eliminar_config(message):
+        ADMIN_FLOW.clear(message.from_user.id)
+        client_name = (message.text or "").strip()
+        if eliminar_cliente(client_name) is None:
+            return bot.reply_to(message, "⚠️ Nombre inválido. Vuelve a «🗑 Eliminar configuración» para intentarlo de nuevo.")
 
         bot.send_message(
             message.chat.id,
             f"✅ Configuración <b>{client_name}</b> eliminada correctamente.",
-            parse_mode="HTML",
-            reply_markup=ReplyKeyboardRemove()
+            parse_mode="HTML"
         )
-        ADMIN_FLOW.pop(message.from_user.id, None)
 
     @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📄 Ver configuraciones activas")
     def ver_configuraciones(message):
-        users = load_users()
-        if not users:
-            return bot.send_message(message.chat.id, "ℹ️ No hay configuraciones activas.")
+        texto, kb = render_page(VER)
+        bot.send_message(message.chat.id, texto, reply_markup=kb, parse_mode="HTML")
+
+    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "🔎 Buscar cliente")
+    def buscar_prompt(message):
+        bot.send_message(message.chat.id, "🔎 Escribe el inicio del nombre o la IP del cliente:")
+        ADMIN_FLOW.start(message.from_user.id, 'awaiting_search')
+
+    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and ADMIN_FLOW.step(m.from_user.id) == 'awaiting_search')
+    def buscar_cliente(message):
+        ADMIN_FLOW.clear(message.from_user.id)
+        texto, kb = render_busqueda(message.text)
+        bot.send_message(message.chat.id, texto, reply_markup=kb, parse_mode="HTML")
+
+    @bot.callback_query_handler(func=lambda c: is_admin(c.from_user.id) and c.data.startswith("lst:"))
+    def cambiar_pagina(call):
+        texto, kb = render_page(*parse_callback_pagina(call.data))
+        bot.edit_message_text(texto, call.message.chat.id, call.message.message_id, reply_markup=kb, parse_mode="HTML")
+        bot.answer_callback_query(call.id)
+
+    @bot.callback_query_handler(func=lambda c: is_admin(c.from_user.id) and c.data.startswith("del:"))
+    def confirmar_eliminacion(call):
+        encontrado = find_user_by_ip(call.data.split(":", 1)[1])
+        actual = get_user_version(encontrado[0]) if encontrado else None
+        if actual is None:
+            return bot.answer_callback_query(call.id, "⚠️ El cliente ya no existe.")
+        texto, kb = render_confirmacion(encontrado[0], *actual)
+        bot.edit_message_text(texto, call.message.chat.id, call.message.message_id, reply_markup=kb, parse_mode="HTML")
+        bot.answer_callback_query(call.id)
+
+    @bot.callback_query_handler(func=lambda c: is_admin(c.from_user.id) and c.data.startswith("delok:"))
+    def eliminar_desde_boton(call):
+        ip, version, clave = parse_callback_eliminar(call.data)
+        encontrado = find_user_by_ip(ip)
+        if encontrado is not None and not (encontrado[1].get("public_key") or "").startswith(clave):
+            encontrado = None  # la IP ya es de otro cliente
+        # Solo se borra la versión que vio el administrador
+        if encontrado is None or eliminar_cliente(encontrado[0], version) is None:
+            return bot.answer_callback_query(call.id, "⚠️ El cliente cambió o ya no existe. Vuelve a intentarlo.")
+
+        ADMIN_FLOW.clear(call.from_user.id)
+        bot.edit_message_text(
+            f"✅ Configuración <b>{encontrado[0]}</b> eliminada correctamente.",
+            call.message.chat.id,
+            call.message.message_id,
+            parse_mode="HTML"
+        )
+        bot.answer_callback_query(call.id)
 
-        texto = "<b>📋 Configuraciones activas:</b>\n"
-        for nombre, datos in users.items():
-            texto += f"\n🔸 <b>{nombre}</b> — IP: {datos['ip']}\n⏳ Vence: {datos['vencimiento']}\n"
+    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📊 Ver estadísticas")
+    def ver_estadisticas(message):
+        bot.send_message(message.chat.id, formato_panel(get_stats().snapshot()), parse_mode="HTML")
+
+    def nombre_de(public_key):
+        encontrado = find_user_by_public_key(public_key)
+        return encontrado[0] if encontrado else f"{public_key[:8]}… (desconocido)"
+
+    @bot.message_handler(commands=['top'])
+    def ver_top(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        horas = int(partes[1]) if len(partes) > 1 and partes[1].isdigit() else 24
+        top = get_telemetry().top_talkers(horas * 3600)
+        if not top:
+            return bot.send_message(message.chat.id, f"ℹ️ Sin tráfico registrado en las últimas {horas} h.")
+
+        texto = f"📈 <b>Más tráfico (últimas {horas} h):</b>\n"
+        for i, (clave, rx, tx) in enumerate(top, 1):
+            texto += f"\n{i}. <b>{nombre_de(clave)}</b> — ⬇️ {formato_bytes(tx)} ⬆️ {formato_bytes(rx)}"
+        bot.send_message(message.chat.id, texto, parse_mode="HTML")
 
+    @bot.message_handler(commands=['inactivos'])
+    def ver_inactivos(message):
+        if not is_admin(message.from_user.id):
+            return
+        inactivos = get_telemetry().idle_peers()
+        if not inactivos:
+            return bot.send_message(message.chat.id, "✅ Todos los peers se conectaron recientemente.")
+
+        texto = f"💤 <b>Peers inactivos: {len(inactivos)}</b>\n"
+        for clave, handshake in inactivos[:30]:
+            texto += f"\n🔸 <b>{nombre_de(clave)}</b> — último handshake: {formato_handshake(handshake)}"
+        if len(inactivos) > 30:
+            texto += f"\n\n… y {len(inactivos) - 30} más."
         bot.send_message(message.chat.id, texto, parse_mode="HTML")
 
-    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📊 Ver estadísticas")
-    def ver_estadisticas(message):
-        users = load_users()
-        total = len(users)
-        planes = {}
-        for datos in users.values():
-            plan = datos.get('plan', 'Desconocido')
-            planes[plan] = planes.get(plan, 0) + 1
+    @bot.message_handler(commands=['recuperar'])
+    def recuperar_ips(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        recuperador = get_reclaimer()
+        candidatos = recuperador.scan()
+        if not candidatos:
+            return bot.send_message(message.chat.id, "✅ Ningún cliente superó el tiempo sin conexión de su plan.")
+
+        if len(partes) > 1 and partes[1] == "si":
+            suspendidos = recuperador.suspend(candidatos)
+            return bot.send_message(
+                message.chat.id,
+                f"💤 {len(suspendidos)} clientes suspendidos, sus IPs quedaron libres.\n▶️ /reanudar &lt;nombre&gt; para reactivar.",
+                parse_mode="HTML"
+            )
 
-        texto = f"📊 <b>Estadísticas:</b>\n\n👥 Total de clientes: <b>{total}</b>\n"
-        for plan, count in planes.items():
-            texto += f"🔹 {plan}: {count}\n"
+        texto = f"💤 <b>Clientes a suspender: {len(candidatos)}</b>\n"
+        for c in candidatos[:30]:
+            texto += f"\n🔸 <b>{c.nombre}</b> ({c.ip}) — último handshake: {formato_handshake(c.handshake)}"
+        if len(candidatos) > 30:
+            texto += f"\n\n… y {len(candidatos) - 30} más."
+        texto += "\n\nSe quitan de la interfaz y se liberan sus IPs (el registro se conserva). Confirma con /recuperar si"
+        bot.send_message(message.chat.id, texto, parse_mode="HTML")
 
+    @bot.message_handler(commands=['reanudar'])
+    def reanudar_cliente(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        if len(partes) < 2:
+            return bot.reply_to(message, "✍️ Uso: /reanudar <nombre>")
+        try:
+            datos = get_reclaimer().resume(partes[1])
+        except ValueError as e:
+            return bot.reply_to(message, str(e))
+        except Exception as e:
+            return bot.send_message(message.chat.id, f"🚫 Error inesperado: {str(e)}")
+
+        avisar_reanudado(message.chat.id, partes[1], datos)
+
+    def avisar_reanudado(chat_id, nombre, datos):
+        """Confirma la reactivación; con una IP nueva también envía el .conf y el QR."""
+        if not datos["ip_cambiada"]:
+            return bot.send_message(chat_id, f"▶️ <b>{nombre}</b> reactivado con su IP anterior ({datos['ip']}).", parse_mode="HTML")
+        config_text = cached_config(datos["private_key"], datos["ip"])
+        bot.send_message(chat_id, f"▶️ <b>{nombre}</b> reactivado con una IP nueva ({datos['ip']}): envíale este .conf.", parse_mode="HTML")
+        bot.send_document(chat_id, conf_document(nombre, config_text))
+        bot.send_photo(chat_id, qr_image(config_text), caption="📲 Escanea este código QR con WireGuard")
+
+    @bot.message_handler(commands=['vincular'])
+    def vincular_cliente(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        if len(partes) < 2:
+            return bot.reply_to(message, "✍️ Uso: /vincular <nombre>")
+        if get_user(partes[1]) is None:
+            return bot.reply_to(message, "⚠️ Cliente no encontrado.")
+
+        codigo = create_link_code(partes[1])
+        bot.send_message(
+            message.chat.id,
+            f"🔗 Enlace de acceso para <b>{partes[1]}</b> (un solo uso):\n"
+            f"https://t.me/{bot.get_me().username}?start={codigo}\n\n"
+            f"O que le escriba al bot: <code>/start {codigo}</code>",
+            parse_mode="HTML"
+        )
+
+    @bot.message_handler(commands=['renovar'])
+    def renovar_cliente(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split(maxsplit=2)
+        if len(partes) < 2:
+            return bot.reply_to(message, "✍️ Uso: /renovar <nombre> [plan]")
+        actual = get_user(partes[1])
+        if actual is None:
+            return bot.reply_to(message, "⚠️ Cliente no encontrado.")
+        plan = partes[2] if len(partes) > 2 else actual.get("plan")
+        if plan not in PLANES_PRECIOS:
+            return bot.reply_to(message, f"❌ Plan inválido. Planes: {', '.join(PLANES)}")
+
+        def renovar(datos):
+            # Se suma al tiempo que le queda (o desde ahora si ya venció)
+            desde = max(datetime.utcnow(), datetime.utcfromtimestamp(parse_vencimiento(datos["vencimiento"])))
+            duracion = timedelta(days=PLANES_PRECIOS[plan].get('dias', 0), hours=PLANES_PRECIOS[plan].get('horas', 0))
+            datos["vencimiento"] = (desde + duracion).strftime('%Y-%m-%d %H:%M:%S')
+            datos["plan"] = plan
+            datos.pop("avisos_enviados", None)
+            datos.pop("renovacion_solicitada", None)
+            return datos
+
+        datos = update_user(partes[1], renovar)
+        if datos is None:
+            return bot.reply_to(message, "⚠️ Cliente no encontrado.")
+        schedule_client(partes[1], datos)
+        get_stats().on_create(partes[1], datos)
+        get_quota_engine().reset(datos.get("public_key"))
+
+        texto = f"🔄 <b>{partes[1]}</b> renovado ({plan}).\n📅 Vence: <b>{datos['vencimiento'][:16]} UTC</b>"
+        if not datos.get("suspendido"):
+            return bot.send_message(message.chat.id, texto, parse_mode="HTML")
+        # Renovar a un suspendido (p. ej. tras «Solicitar renovación») también lo reactiva
+        try:
+            reanudado = get_reclaimer().resume(partes[1])
+        except ValueError:
+            return bot.send_message(message.chat.id, texto, parse_mode="HTML")
+        except Exception as e:
+            texto += f"\n🚫 No se pudo reactivar: {str(e)}. Reintenta con /reanudar {partes[1]}"
+            return bot.send_message(message.chat.id, texto, parse_mode="HTML")
+        bot.send_message(message.chat.id, texto, parse_mode="HTML")
+        avisar_reanudado(message.chat.id, partes[1], reanudado)
+
+    @bot.message_handler(commands=['cuota'])
+    def ver_cuota(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        reiniciar = len(partes) > 2 and partes[1] == "reset"
+        nombre = partes[2] if reiniciar else (partes[1] if len(partes) > 1 else None)
+        if nombre is None:
+            return bot.reply_to(message, "✍️ Uso: /cuota <nombre> o /cuota reset <nombre>")
+        datos = get_user(nombre)
+        if datos is None:
+            return bot.reply_to(message, "⚠️ Cliente no encontrado.")
+
+        cuotas = get_quota_engine()
+        if reiniciar:
+            cuotas.reset(datos.get("public_key"))
+        usado = cuotas.usage(datos.get("public_key"))
+        cuota = cuota_plan(datos.get("plan"))
+        texto = f"📶 <b>Cuota de {nombre}</b> ({datos.get('plan')})\n"
+        if cuota is None:
+            texto += f"Usado: {formato_bytes(usado)} (plan sin límite)"
+        else:
+            texto += f"Usado: {formato_bytes(usado)} de {formato_bytes(cuota)} ({usado * 100 / cuota:.0f}%)"
+        if datos.get("ip") in cuotas.limitados():
+            texto += "\n🐢 Velocidad limitada"
+        if reiniciar:
+            texto += "\n\n🔄 Uso reiniciado."
         bot.send_message(message.chat.id, texto, parse_mode="HTML")
 
-    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📁 Respaldar datos (.json)")
-    def enviar_respaldo(message):
-        path = "clientes.json"
-        if not os.path.exists(path):
-            return bot.send_message(message.chat.id, "⚠️ Archivo de respaldo no encontrado.")
+    @bot.message_handler(commands=['uso'])
+    def ver_uso(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        if len(partes) < 2:
+            return bot.reply_to(message, "✍️ Uso: /uso <nombre>")
+        datos = get_user(partes[1])
+        if datos is None:
+            return bot.reply_to(message, "⚠️ Cliente no encontrado.")
+
+        telemetria = get_telemetry()
+        clave = datos.get("public_key")
+        if telemetria.usage(clave, 3600) is None:
+            return bot.reply_to(message, "ℹ️ Aún no hay datos de tráfico para este cliente.")
+
+        texto = f"📶 <b>Uso de {partes[1]}</b>\n🤝 Último handshake: {formato_handshake(telemetria.handshake(clave))}\n"
+        for titulo, segundos in (("1 hora", 3600), ("24 horas", 86400), ("7 días", 7 * 86400), ("30 días", 30 * 86400)):
+            rx, tx = telemetria.usage(clave, segundos)
+            texto += f"\n🕐 {titulo}: ⬇️ {formato_bytes(tx)} ⬆️ {formato_bytes(rx)}"
+        bot.send_message(message.chat.id, texto, parse_mode="HTML")
 
-        with open(path, "rb") as f:
-            bot.send_document(message.chat.id, f, caption="📁 Respaldo de clientes")
+    @bot.message_handler(commands=['metrics'])
+    def ver_metricas(message):
+        if not is_admin(message.from_user.id):
+            return
+        bot.send_message(message.chat.id, resumen(), parse_mode="HTML")
+
+    @bot.message_handler(commands=['perfil'])
+    def perfilador(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        accion = partes[1] if len(partes) > 1 else "ver"
+        perfil = get_profiler()
+
+        if accion == "on":
+            perfil.start()
+            return bot.send_message(message.chat.id, "🔬 Perfilador activado. Usa /perfil ver para los resultados.")
+        if accion == "off":
+            perfil.stop()
+            return bot.send_message(message.chat.id, "⏹ Perfilador desactivado.")
+
+        top = perfil.top()
+        if not top:
+            return bot.send_message(message.chat.id, "ℹ️ Sin muestras. Actívalo con /perfil on.")
+        estado = "activo" if perfil.activo else "detenido"
+        texto = f"🔬 <b>Perfil ({estado})</b>\n"
+        for lugar, porcentaje in top:
+            texto += f"\n{porcentaje:5.1f}% <code>{lugar}</code>"
+        bot.send_message(message.chat.id, texto, parse_mode="HTML")
+
+    def enviar_respaldo(chat_id, incremental=False):
+        def enviar(nombre, datos):
+            archivo = BytesIO(datos)
+            archivo.name = nombre
+            bot.send_document(chat_id, archivo)
+
+        bot.send_message(chat_id, "⏳ Generando respaldo...")
+        try:
+            resultado = create_backup(enviar, incremental)
+        except Exception as e:
+            return bot.send_message(chat_id, f"🚫 Error al generar el respaldo: {str(e)}")
+        clientes = resultado["registros"].get("users", 0)
+        eliminados = len(resultado["eliminados"].get("users", []))
+        bot.send_message(
+            chat_id,
+            f"📁 <b>Respaldo {resultado['tipo']}</b> ({resultado['partes']} parte(s), {formato_bytes(resultado['bytes'])})\n"
+            f"👥 Clientes: {clientes}" + (f" · 🗑 eliminados: {eliminados}" if resultado["tipo"] == "incremental" else "") +
+            f"\n📄 Archivos: {resultado['archivos']}\n\n"
+            "Para restaurar: /restaurar y envía las partes.",
+            parse_mode="HTML"
+        )
+
+    @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "📁 Respaldar datos")
+    def respaldo_completo(message):
+        enviar_respaldo(message.chat.id)
+
+    @bot.message_handler(commands=['respaldo'])
+    def respaldo(message):
+        if not is_admin(message.from_user.id):
+            return
+        partes = message.text.split()
+        enviar_respaldo(message.chat.id, incremental=len(partes) > 1 and partes[1] == "incremental")
+
+    @bot.message_handler(commands=['restaurar'])
+    def start_restore(message):
+        if not is_admin(message.from_user.id):
+            return
+        bot.send_message(
+            message.chat.id,
+            "♻️ Envía las partes del respaldo completo y de los incrementales que le siguen "
+            "(en cualquier orden) y luego escribe /listo.\n\n"
+            "⚠️ La base actual se reemplaza. /cancelar para salir."
+        )
+        ADMIN_FLOW.start(message.from_user.id, 'awaiting_restore', partes=[])
+
+    @bot.message_handler(
+        content_types=['document', 'text'],
+        func=lambda m: is_admin(m.from_user.id) and ADMIN_FLOW.step(m.from_user.id) == 'awaiting_restore'
+    )
+    def restore(message):
+        if message.content_type == 'document':
+            archivo = bot.get_file(message.document.file_id)
+            ADMIN_FLOW.data(message.from_user.id)['partes'].append(
+                (message.document.file_name, bot.download_file(archivo.file_path))
+            )
+            return
+        if message.text == "/cancelar":
+            ADMIN_FLOW.clear(message.from_user.id)
+            return bot.send_message(message.chat.id, "❎ Restauración cancelada.")
+        if message.text != "/listo":
+            return bot.send_message(message.chat.id, "📎 Envía las partes del respaldo o escribe /listo.")
+
+        partes = ADMIN_FLOW.take(message.from_user.id, 'awaiting_restore')['partes']
+        bot.send_message(message.chat.id, f"⏳ Restaurando {len(partes)} parte(s)...")
+        try:
+            resultado = restore_backup(partes)
+        except Exception as e:
+            return bot.send_message(message.chat.id, f"🚫 Error al restaurar: {str(e)}")
+        bot.send_message(
+            message.chat.id,
+            f"✅ Restaurado: {', '.join(resultado['archivos'])}\n👥 Clientes: {resultado['clientes']}"
+        )
 
     @bot.message_handler(func=lambda m: is_admin(m.from_user.id) and m.text == "🔙 Salir")
     def salir_panel(message):
@@ -183,12 +649,8 @@ def register_admin_handlers(bot: TeleBot):
 
 def show_admin_menu(bot: TeleBot, chat_id: int):
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.add(KeyboardButton("📦 Crear configuración"))
-    kb.add(KeyboardButton("🗑 Eliminar configuración"))
-    kb.add(KeyboardButton("📄 Ver configuraciones activas"))
-    kb.add(KeyboardButton("📊 Ver estadísticas"))
-    kb.add(KeyboardButton("📁 Respaldar datos (.json)"))
-    kb.add(KeyboardButton("🔙 Salir"))
+    for boton in MENU_ADMIN:
+        kb.add(KeyboardButton(boton))
 
     bot.send_message(
         chat_id,
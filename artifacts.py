@@ -0,0 +1,163 @@
+# artifacts.py
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from config import ARTEFACTOS_MEMORIA_BYTES, ARTEFACTOS_DIR, ARTEFACTOS_DISCO_BYTES
+from metrics import counter
+
+# Tipos de artefacto que nunca se escriben en disco (el .conf es la clave privada en texto plano)
+SOLO_MEMORIA = ("conf-",)
+
+
+def content_key(tipo: str, *partes) -> str:
+    """
+    Clave por contenido: sha256 del tipo de artefacto y de sus entradas.
+    """
+    h = hashlib.sha256(tipo.encode())
+    for parte in partes:
+        h.update(b"\0")
+        h.update(parte if isinstance(parte, bytes) else str(parte).encode())
+    return f"{tipo}-{h.hexdigest()}"
+
+
+class ArtifactCache:
+    """
+    Caché de artefactos (.conf, PNG de QR, .zip) direccionada por contenido.
+
+    Primer nivel en memoria con LRU limitado en bytes; segundo nivel
+    opcional en disco (un archivo por clave) con su propio límite, que
+    desaloja primero los archivos menos usados. Como la clave depende del
+    contenido, un artefacto nunca queda desactualizado: solo se desaloja,
+    o se descarta con discard() cuando su cliente se elimina.
+    """
+
+    def __init__(self, max_memoria=ARTEFACTOS_MEMORIA_BYTES, directorio=ARTEFACTOS_DIR, max_disco=ARTEFACTOS_DISCO_BYTES):
+        self.max_memoria = max_memoria
+        self.directorio = directorio
+        self.max_disco = max_disco
+        self._memoria = OrderedDict()  # clave -> bytes
+        self._bytes_memoria = 0
+        self._disco = OrderedDict()    # clave -> tamaño (orden de uso)
+        self._bytes_disco = 0
+        self._lock = threading.Lock()
+        if directorio:
+            self._cargar_disco()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave)
+
+    def _cargar_disco(self):
+        # Los QR llevan claves privadas: solo el usuario del bot los lee (makedirs no cambia una carpeta existente)
+        os.makedirs(self.directorio, mode=0o700, exist_ok=True)
+        os.chmod(self.directorio, 0o700)
+        entradas = sorted(os.scandir(self.directorio), key=lambda e: e.stat().st_mtime)
+        for entrada in entradas:
+            if entrada.is_file() and entrada.name.startswith(SOLO_MEMORIA):
+                # .conf guardados por versiones anteriores: no deben quedar en disco
+                os.remove(entrada.path)
+            elif entrada.is_file():
+                os.chmod(entrada.path, 0o600)  # los guardados por versiones anteriores con la umask
+                self._disco[entrada.name] = entrada.stat().st_size
+                self._bytes_disco += entrada.stat().st_size
+
+    def _guardar_memoria(self, clave, datos):
+        if len(datos) > self.max_memoria:
+            return
+        anterior = self._memoria.pop(clave, None)
+        if anterior is not None:
+            self._bytes_memoria -= len(anterior)
+        self._memoria[clave] = datos
+        self._bytes_memoria += len(datos)
+        while self._bytes_memoria > self.max_memoria:
+            _, viejo = self._memoria.popitem(last=False)
+            self._bytes_memoria -= len(viejo)
+
+    def _guardar_disco(self, clave, datos):
+        if not self.directorio or clave in self._disco or len(datos) > self.max_disco:
+            return
+        temporal = self._ruta(clave) + ".tmp"
+        with os.fdopen(os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(datos)
+        os.replace(temporal, self._ruta(clave))
+        self._disco[clave] = len(datos)
+        self._bytes_disco += len(datos)
+        while self._bytes_disco > self.max_disco:
+            viejo, tamano = self._disco.popitem(last=False)
+            self._bytes_disco -= tamano
+            try:
+                os.remove(self._ruta(viejo))
+            except FileNotFoundError:
+                pass
+
+    def get(self, clave: str):
+        """Devuelve los bytes del artefacto o None (sube a memoria lo leído de disco)."""
+        with self._lock:
+            datos = self._memoria.get(clave)
+            if datos is not None:
+                self._memoria.move_to_end(clave)
+                counter("artefactos_cache_total", "Consultas a la caché de artefactos").inc(nivel="memoria")
+                return datos
+            if clave in self._disco:
+                try:
+                    with open(self._ruta(clave), "rb") as f:
+                        datos = f.read()
+                except FileNotFoundError:
+                    self._bytes_disco -= self._disco.pop(clave)
+                else:
+                    self._disco.move_to_end(clave)
+                    self._guardar_memoria(clave, datos)
+                    counter("artefactos_cache_total", "Consultas a la caché de artefactos").inc(nivel="disco")
+                    return datos
+        counter("artefactos_cache_total", "Consultas a la caché de artefactos").inc(nivel="fallo")
+        return None
+
+    def put(self, clave: str, datos: bytes):
+        with self._lock:
+            self._guardar_memoria(clave, datos)
+            if clave.startswith(SOLO_MEMORIA):
+                return
+            try:
+                self._guardar_disco(clave, datos)
+            except OSError as e:
+                print(f"⚠️ No se pudo guardar el artefacto en disco: {e}")
+
+    def discard(self, clave: str):
+        """Quita un artefacto de los dos niveles (no falla si no estaba)."""
+        with self._lock:
+            datos = self._memoria.pop(clave, None)
+            if datos is not None:
+                self._bytes_memoria -= len(datos)
+            if clave in self._disco:
+                self._bytes_disco -= self._disco.pop(clave)
+                try:
+                    os.remove(self._ruta(clave))
+                except FileNotFoundError:
+                    pass
+
+    def get_or_create(self, clave: str, crear) -> bytes:
+        """Devuelve el artefacto de la caché o lo crea con crear() y lo guarda."""
+        datos = self.get(clave)
+        if datos is None:
+            datos = crear()
+            self.put(clave, datos)
+        return datos
+
+    def __contains__(self, clave):
+        with self._lock:
+            return clave in self._memoria or clave in self._disco
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_artifact_cache() -> ArtifactCache:
+    """Caché global de artefactos (se crea en el primer uso)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArtifactCache()
+    return _cache
@@ -0,0 +1,353 @@
+# backup.py
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+from datetime import datetime
+
+from config import WG_CONFIG_DIR, ARTEFACTOS_DIR, RESPALDO_PARTE_BYTES
+from storage import (
+    TABLES,
+    read_snapshot,
+    iter_snapshot,
+    iter_snapshot_state,
+    iter_snapshot_history,
+    transaction,
+    get_state,
+    set_state,
+    save_json,
+    upsert_many,
+    delete_many,
+    add_stats_snapshot,
+    load_users,
+)
+from metrics import medido
+
+# Claves de estado que no se respaldan (propias del respaldo)
+ESTADO_EXCLUIDO = ("respaldo_ultimo",)
+
+COMPLETO = "completo"
+INCREMENTAL = "incremental"
+
+
+def _huella(datos) -> str:
+    return hashlib.blake2b(json.dumps(datos, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+class PartWriter:
+    """
+    Archivo de solo escritura que corta lo escrito en partes de hasta
+    `tamano` bytes y entrega cada una con enviar(indice, datos) apenas se
+    llena. En memoria nunca hay más de una parte.
+    """
+
+    def __init__(self, enviar, tamano=RESPALDO_PARTE_BYTES):
+        self.enviar = enviar
+        self.tamano = tamano
+        self.partes = 0
+        self.bytes = 0
+        self._buffer = bytearray()
+
+    def write(self, datos) -> int:
+        self._buffer += datos
+        self.bytes += len(datos)
+        while len(self._buffer) >= self.tamano:
+            self._emitir(bytes(self._buffer[:self.tamano]))
+            del self._buffer[:self.tamano]
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer or not self.partes:
+            self._emitir(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _emitir(self, datos):
+        self.partes += 1
+        self.enviar(self.partes, datos)
+
+
+class _PartReader(io.RawIOBase):
+    """Lee varias partes (bytes) como si fueran un solo archivo."""
+
+    def __init__(self, partes):
+        self._partes = list(partes)
+        self._actual = io.BytesIO(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while True:
+            n = self._actual.readinto(b)
+            if n or not self._partes:
+                return n
+            self._actual = io.BytesIO(self._partes.pop(0))
+
+
+def _agregar(tar, nombre, archivo, mtime):
+    """Agrega un archivo abierto (posición al final) al tar en streaming."""
+    info = tarfile.TarInfo(nombre)
+    info.size = archivo.tell()
+    info.mtime = mtime
+    archivo.seek(0)
+    tar.addfile(info, archivo)
+
+
+def _agregar_jsonl(tar, nombre, filas, mtime) -> int:
+    """Escribe las filas como JSON por línea (en un temporal, no en memoria) y las agrega al tar."""
+    n = 0
+    with tempfile.TemporaryFile() as tmp:
+        for fila in filas:
+            tmp.write((json.dumps(fila, ensure_ascii=False) + "\n").encode())
+            n += 1
+        _agregar(tar, nombre, tmp, mtime)
+    return n
+
+
+def _archivos(directorio, desde):
+    """(nombre, ruta) de los archivos de `directorio` modificados desde `desde`."""
+    if not directorio or not os.path.isdir(directorio):
+        return
+    for entrada in os.scandir(directorio):
+        if entrada.is_file() and not entrada.name.endswith(".tmp") and entrada.stat().st_mtime >= desde:
+            yield entrada.name, entrada.path
+
+
+@medido("respaldo_segundos", "Duración de los respaldos", op="crear")
+def create_backup(enviar, incremental=False, tamano_parte=RESPALDO_PARTE_BYTES) -> dict:
+    """
+    Genera un respaldo .tar.gz de la base (en un instante consistente, sin
+    bloquear escrituras), los .conf y la caché de artefactos, y lo entrega en
+    partes con enviar(nombre_parte, datos) mientras se comprime.
+
+    Con incremental=True solo incluye los registros que cambiaron o se
+    eliminaron desde el último respaldo (si no hay uno previo, es completo).
+    Devuelve el manifiesto.
+    """
+    previo = get_state("respaldo_ultimo") if incremental else None
+    tipo = INCREMENTAL if previo else COMPLETO
+    ahora = time.time()
+    desde = previo["ts"] if previo else 0
+    archivo = f"respaldo_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{tipo}.tar.gz"
+
+    manifiesto = {
+        "formato": 1,
+        "archivo": archivo,
+        "tipo": tipo,
+        "base": previo["archivo"] if previo else None,
+        "fecha": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "registros": {},
+        "eliminados": {},
+        "archivos": 0,
+    }
+    huellas = {}
+    salida = PartWriter(lambda i, datos: enviar(f"{archivo}.{i:03d}", datos), tamano_parte)
+
+    with tarfile.open(fileobj=salida, mode="w|gz") as tar:
+        with read_snapshot() as conn:
+            for name in TABLES:
+                anteriores = previo["huellas"].get(name, {}) if previo else {}
+                actuales = huellas[name] = {}
+
+                def cambiados():
+                    for nombre, datos in iter_snapshot(conn, name):
+                        actuales[nombre] = huella = _huella(datos)
+                        if anteriores.get(nombre) != huella:
+                            yield {"nombre": nombre, "datos": datos}
+
+                manifiesto["registros"][name] = _agregar_jsonl(tar, f"{name}.jsonl", cambiados(), ahora)
+                manifiesto["eliminados"][name] = sorted(set(anteriores) - set(actuales))
+
+            estado = ({"clave": c, "valor": v} for c, v in iter_snapshot_state(conn) if c not in ESTADO_EXCLUIDO)
+            _agregar_jsonl(tar, "estado.jsonl", estado, ahora)
+            historial = ({"ts": ts, "datos": d} for ts, d in iter_snapshot_history(conn, int(desde)))
+            _agregar_jsonl(tar, "stats_historial.jsonl", historial, ahora)
+
+        for carpeta, directorio in (("configs", WG_CONFIG_DIR), ("artefactos", ARTEFACTOS_DIR)):
+            for nombre, ruta in _archivos(directorio, desde):
+                try:
+                    tar.add(ruta, arcname=f"{carpeta}/{nombre}", recursive=False)
+                    manifiesto["archivos"] += 1
+                except OSError:
+                    pass  # borrado mientras se respaldaba
+
+        cuerpo = json.dumps(manifiesto, ensure_ascii=False, indent=2).encode()
+        info = tarfile.TarInfo("manifest.json")
+        info.size, info.mtime = len(cuerpo), ahora
+        tar.addfile(info, io.BytesIO(cuerpo))
+    salida.close()
+
+    set_state("respaldo_ultimo", {"archivo": archivo, "ts": ahora, "huellas": huellas})
+    manifiesto["partes"] = salida.partes
+    manifiesto["bytes"] = salida.bytes
+    return manifiesto
+
+
+def _leer_archivo(partes) -> dict:
+    """
+    Lee un respaldo (sus partes en orden) en streaming. Los .conf y
+    artefactos quedan en "archivos" hasta que se restaure la base (ver
+    _escribir_archivos).
+    """
+    contenido = {"manifest": None, "jsonl": {}, "archivos": []}
+    with tarfile.open(fileobj=_PartReader(partes), mode="r|gz") as tar:
+        for miembro in tar:
+            if not miembro.isfile():
+                continue
+            carpeta, _, nombre = miembro.name.rpartition("/")
+            # Solo nombres simples: nada de rutas absolutas ni ".."
+            if not nombre or nombre.startswith(".") or carpeta not in ("", "configs", "artefactos"):
+                continue
+            datos = tar.extractfile(miembro).read()
+
+            if carpeta:
+                contenido["archivos"].append((carpeta, nombre, datos))
+            elif nombre == "manifest.json":
+                contenido["manifest"] = json.loads(datos)
+            elif nombre.endswith(".jsonl"):
+                contenido["jsonl"][nombre[:-len(".jsonl")]] = [json.loads(l) for l in datos.decode().splitlines() if l]
+    if contenido["manifest"] is None:
+        raise ValueError("❌ El archivo no es un respaldo válido (falta manifest.json).")
+    return contenido
+
+
+def _escribir_archivos(contenido):
+    """Escribe los .conf y artefactos de un respaldo en su destino."""
+    from artifacts import get_artifact_cache  # importación local: solo al restaurar
+
+    for carpeta, nombre, datos in contenido["archivos"]:
+        if carpeta == "configs":
+            os.makedirs(WG_CONFIG_DIR, exist_ok=True)
+            with open(os.path.join(WG_CONFIG_DIR, nombre), "wb") as f:
+                f.write(datos)
+        else:
+            get_artifact_cache().put(nombre, datos)
+
+
+def _validar_cadena(archivos):
+    """
+    Verifica que los respaldos formen una cadena: el primero completo y
+    cada incremental hecho sobre el anterior. Lanza ValueError si no.
+    """
+    anterior = None
+    for archivo, contenido in archivos:
+        manifiesto = contenido["manifest"]
+        if anterior is None:
+            if manifiesto["tipo"] != COMPLETO:
+                raise ValueError(f"❌ {archivo} es incremental: la restauración debe empezar por un respaldo completo.")
+        elif manifiesto["tipo"] != COMPLETO and manifiesto.get("base") != anterior:
+            raise ValueError(f"❌ {archivo} no sigue a {anterior} (su base es {manifiesto.get('base')}). Falta un respaldo de la cadena.")
+        anterior = manifiesto.get("archivo", archivo)
+
+
+def group_parts(partes) -> list:
+    """
+    Agrupa [(nombre_parte, datos)] por respaldo y los ordena por fecha.
+    Devuelve [(archivo, [datos de cada parte en orden])].
+    """
+    grupos = {}
+    for nombre, datos in partes:
+        archivo, _, indice = nombre.rpartition(".")
+        if not indice.isdigit():
+            archivo, indice = nombre, "0"
+        grupos.setdefault(archivo, []).append((int(indice), datos))
+    return [(archivo, [d for _, d in sorted(grupos[archivo])]) for archivo in sorted(grupos)]
+
+
+@medido("respaldo_segundos", "Duración de los respaldos", op="restaurar")
+def restore_backup(partes) -> dict:
+    """
+    Restaura uno o más respaldos a partir de sus partes [(nombre_parte, datos)]:
+    un completo y los incrementales que le siguen, en cadena (si falta uno
+    o sobra otro no se aplica nada). Todos los registros se aplican en una
+    sola transacción; después se recargan los
+    asignadores de IPs, el planificador y las estadísticas, y se reconcilian
+    las interfaces una sola vez.
+    Devuelve {"archivos": [...], "clientes": n}.
+    """
+    archivos = [(archivo, _leer_archivo(datos)) for archivo, datos in group_parts(partes)]
+    if not archivos:
+        raise ValueError("❌ No se recibió ningún respaldo.")
+    _validar_cadena(archivos)
+
+    anteriores = {d.get("public_key") for d in load_users().values()}
+    with transaction():
+        for _, contenido in archivos:
+            manifiesto, jsonl = contenido["manifest"], contenido["jsonl"]
+            for name in TABLES:
+                registros = {r["nombre"]: r["datos"] for r in jsonl.get(name, [])}
+                if manifiesto["tipo"] == COMPLETO:
+                    save_json(name, registros)
+                else:
+                    upsert_many(name, registros)
+                    delete_many(name, manifiesto["eliminados"].get(name, []))
+            for fila in jsonl.get("estado", []):
+                if fila["clave"] not in ESTADO_EXCLUIDO:
+                    set_state(fila["clave"], fila["valor"])
+            for fila in jsonl.get("stats_historial", []):
+                add_stats_snapshot(fila["ts"], fila["datos"])
+        # La base ya no coincide con la cadena de respaldos: el próximo incremental será completo
+        set_state("respaldo_ultimo", None)
+
+    # Los archivos se escriben solo si la base se restauró (si falla, los dos quedan como estaban)
+    for _, contenido in archivos:
+        _escribir_archivos(contenido)
+    usuarios = load_users()
+    _recargar(anteriores - {d.get("public_key") for d in usuarios.values()})
+    return {"archivos": [a for a, _ in archivos], "clientes": len(usuarios)}
+
+
+def _recargar(bajas=()):
+    """
+    Vuelve a calcular todo lo que se deriva de la base y sincroniza las
+    interfaces (`bajas`: claves de los clientes que el respaldo no tiene).
+    """
+    from ip_allocator import reset_allocators
+    from scheduler import get_scheduler
+    from stats import get_stats
+    from wg_sync import queue_removals, reconcile_all
+
+    reset_allocators()
+    get_scheduler().reload()
+    get_stats().load()
+    queue_removals(bajas)
+    reconcile_all()
+
+
+if __name__ == "__main__":
+    # Respaldo y restauración desde la terminal:
+    #   python backup.py crear [--incremental] [-d carpeta]
+    #   python backup.py restaurar respaldo_*.tar.gz.*
+    import argparse
+    from storage import ensure_storage
+
+    parser = argparse.ArgumentParser(description="Respaldo de la base de clientes WireGuard.")
+    sub = parser.add_subparsers(dest="accion", required=True)
+    crear = sub.add_parser("crear")
+    crear.add_argument("--incremental", action="store_true")
+    crear.add_argument("-d", "--destino", default=".")
+    restaurar = sub.add_parser("restaurar")
+    restaurar.add_argument("partes", nargs="+")
+    args = parser.parse_args()
+
+    ensure_storage()
+    if args.accion == "crear":
+        def guardar(nombre, datos):
+            with open(os.path.join(args.destino, nombre), "wb") as f:
+                f.write(datos)
+        resultado = create_backup(guardar, args.incremental)
+        print(f"✅ {resultado['archivo']}: {resultado['partes']} parte(s), {resultado['bytes']} bytes.")
+    else:
+        partes = []
+        for ruta in args.partes:
+            with open(ruta, "rb") as f:
+                partes.append((os.path.basename(ruta), f.read()))
+        resultado = restore_backup(partes)
+        print(f"✅ Restaurado: {', '.join(resultado['archivos'])} ({resultado['clientes']} clientes).")
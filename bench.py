@@ -0,0 +1,316 @@
+# bench.py
+
+"""
+Benchmarks de los caminos críticos del bot, sin red ni WireGuard real.
+
+Usa un binario `wg` falso (script temporal) y un TeleBot falso, crea
+poblaciones sintéticas de clientes en una base temporal y mide, por
+operación: rendimiento (ops/s), latencia p50/p99 y memoria pico.
+
+    python bench.py                               # 10, 1000 y 50000 clientes
+    python bench.py -n 1000 -o antes.json
+    python bench.py -n 1000 -o despues.json --comparar antes.json
+    python bench.py -n 1000 --interfaces 4        # clientes repartidos en wg0..wg3
+"""
+
+import argparse
+import base64
+import ipaddress
+import json
+import os
+import platform
+import resource
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+TAMANOS = (10, 1000, 50000)
+
+# Subred amplia para que quepan las poblaciones grandes (se divide entre las interfaces)
+SUBRED = "10.0.0.0/12"
+
+WG_STUB = """#!/bin/sh
+# wg falso: `show <if> dump` devuelve WG_STUB_DIR/<if>.dump, el resto no hace nada
+if [ "$1" = "show" ]; then
+    cat "$WG_STUB_DIR/$2.dump" 2>/dev/null || printf 'priv\\tpub\\t51820\\toff\\n'
+fi
+exit 0
+"""
+
+
+class FakeBot:
+    """TeleBot falso: solo cuenta los mensajes enviados."""
+
+    def __init__(self):
+        self.enviados = 0
+
+    def send_message(self, *args, **kwargs):
+        self.enviados += 1
+
+    send_document = send_photo = reply_to = send_message
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    return orden[min(int(len(orden) * p / 100), len(orden) - 1)]
+
+
+def medir(nombre, funcion, repeticiones, memoria=False):
+    """
+    Ejecuta funcion(i) `repeticiones` veces y devuelve las métricas.
+    Con memoria=True se mide el pico con tracemalloc (agrega sobrecarga a los tiempos).
+    """
+    if memoria:
+        tracemalloc.start()
+    tiempos = []
+    inicio = time.perf_counter()
+    for i in range(repeticiones):
+        t = time.perf_counter()
+        funcion(i)
+        tiempos.append(time.perf_counter() - t)
+    total = time.perf_counter() - inicio
+    resultado = {
+        "n": repeticiones,
+        "total_s": round(total, 6),
+        "ops_s": round(repeticiones / total, 2) if total else None,
+        "p50_ms": round(percentil(tiempos, 50) * 1000, 4),
+        "p99_ms": round(percentil(tiempos, 99) * 1000, 4),
+    }
+    if memoria:
+        resultado["pico_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    print(f"   {nombre:<24} {resultado['ops_s'] or 0:>12.1f} ops/s  "
+          f"p50 {resultado['p50_ms']:>9.3f} ms  p99 {resultado['p99_ms']:>9.3f} ms")
+    return resultado
+
+
+def clave_falsa(i: int) -> str:
+    return base64.b64encode(i.to_bytes(32, "little")).decode()
+
+
+def servidores_falsos(cantidad):
+    """SERVIDORES con `cantidad` interfaces (wg0, wg1...) que se reparten SUBRED."""
+    bits = max(cantidad - 1, 0).bit_length()
+    subredes = list(ipaddress.ip_network(SUBRED).subnets(prefixlen_diff=bits))[:cantidad]
+    return [
+        {"interfaz": f"wg{i}", "clave_publica": clave_falsa(999_999_999 - i), "endpoint": "127.0.0.1",
+         "puerto": 51820 + i, "subred": str(subred), "capacidad": None}
+        for i, subred in enumerate(subredes)
+    ]
+
+
+def preparar_entorno(directorio, interfaces=1):
+    """
+    Apunta la base de datos, los .conf y `wg` a `directorio` e importa los módulos.
+    """
+    stub = os.path.join(directorio, "wg")
+    with open(stub, "w") as f:
+        f.write(WG_STUB)
+    os.chmod(stub, os.stat(stub).st_mode | stat.S_IEXEC)
+    os.environ["WG_STUB_DIR"] = directorio
+
+    import config
+    config.SERVIDORES = servidores_falsos(interfaces)
+    config.WG_CONFIG_DIR = os.path.join(directorio, "configs")
+    os.makedirs(config.WG_CONFIG_DIR, exist_ok=True)
+
+    import storage
+    import wg_sync
+    import generator
+    storage.DB_PATH = os.path.join(directorio, "bench.db")
+    wg_sync.WG_BIN = stub
+    wg_sync.WG_SUDO = False
+    generator.WG_CONFIG_DIR = config.WG_CONFIG_DIR
+
+    import servers
+    servers._registry = servers.ServerRegistry(config.SERVIDORES)
+
+    import artifacts
+    artifacts._cache = artifacts.ArtifactCache(directorio=os.path.join(directorio, "artefactos"))
+
+
+def nueva_base(directorio, tamano):
+    """
+    Base vacía para una población: cierra la conexión anterior y reinicia los asignadores.
+    """
+    import storage
+    import ip_allocator
+    from servers import get_registry
+
+    conn = getattr(storage._local, "conn", None)
+    if conn is not None:
+        conn.close()
+        storage._local.conn = None
+    storage.DB_PATH = os.path.join(directorio, f"bench_{tamano}.db")
+    storage.ensure_storage()
+
+    ip_allocator._allocators.clear()
+    return get_registry()
+
+
+def poblar(tamano, registro):
+    """
+    Crea `tamano` clientes sintéticos en una sola transacción y escribe el dump
+    del `wg` falso de cada interfaz.
+    """
+    from storage import upsert_users
+
+    reservas = registro.reserve(tamano)
+    base = datetime.utcnow()
+    planes = ["Free (5 horas)", "15 días", "30 días"]
+    usuarios = {}
+    for i, (servidor, ip) in enumerate(reservas):
+        usuarios[f"cliente{i:06d}"] = {
+            "private_key": clave_falsa(i + 10_000_000),
+            "public_key": clave_falsa(i),
+            "ip": ip,
+            "interfaz": servidor.interfaz,
+            "vencimiento": (base + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S"),
+            "plan": planes[i % len(planes)],
+        }
+    upsert_users(usuarios)
+
+    dumps = {interfaz: ["priv\tpub\t51820\toff"] for interfaz in registro.interfaces()}
+    for d in usuarios.values():
+        dumps[d["interfaz"]].append(f"{d['public_key']}\t(none)\t(none)\t{d['ip']}/32\t0\t0\t0\toff")
+    for interfaz, lineas in dumps.items():
+        with open(os.path.join(os.environ["WG_STUB_DIR"], f"{interfaz}.dump"), "w") as f:
+            f.write("\n".join(lineas) + "\n")
+    return usuarios
+
+
+def bench_tamano(directorio, tamano, muestras, memoria):
+    import storage
+    import wgkeys
+    import wg_sync
+    from generator import generar_configuracion
+    from utils import get_next_ip
+    from qr_service import QRService, render_png
+    from artifacts import ArtifactCache
+    from scheduler import ExpiryScheduler
+
+    print(f"\n📦 {tamano} clientes")
+    registro = nueva_base(directorio, tamano)
+    inicio = time.perf_counter()
+    usuarios = poblar(tamano, registro)
+    print(f"   (población creada en {time.perf_counter() - inicio:.2f} s)")
+
+    nombres = list(usuarios)
+    pocas = max(min(muestras // 20, 20), 3)  # para operaciones que recorren toda la base
+    r = {}
+
+    r["load_users"] = medir("load_users", lambda i: storage.load_users(), pocas, memoria)
+
+    def guardar(i):
+        datos = dict(usuarios)
+        datos[nombres[i % len(nombres)]] = dict(datos[nombres[i % len(nombres)]], nota=i)
+        storage.save_users(datos)
+    r["save_users"] = medir("save_users", guardar, pocas, memoria)
+
+    r["get_user"] = medir("get_user", lambda i: storage.get_user(nombres[i % len(nombres)]), muestras, memoria)
+    r["find_user_by_ip"] = medir(
+        "find_user_by_ip", lambda i: storage.find_user_by_ip(usuarios[nombres[i % len(nombres)]]["ip"]), muestras, memoria
+    )
+
+    reservadas = []
+    r["get_next_ip"] = medir("get_next_ip", lambda i: reservadas.append(get_next_ip()), muestras, memoria)
+    registro.release((registro.for_ip(ip), ip) for ip in reservadas)
+
+    r["generate_keypair"] = medir("generate_keypair", lambda i: wgkeys.generate_keypair(), muestras, memoria)
+
+    creados = []
+    def crear(i):
+        resultado = generar_configuracion(f"bench{tamano}x{i}")
+        if resultado["status"] != "ok":
+            raise RuntimeError(resultado["error"])
+        creados.append(resultado)
+    r["generar_configuracion"] = medir("generar_configuracion", crear, min(muestras, 200), memoria)
+    registro.release((registro.for_ip(c["ip"]), c["ip"]) for c in creados)
+
+    servicio = QRService(cache=ArtifactCache(directorio=None), workers=1)
+    textos = [c["config_text"] for c in creados] or ["[Interface]\n"]
+    r["qr_render"] = medir("qr_render", lambda i: render_png(textos[i % len(textos)]), min(muestras, 50), memoria)
+    servicio.png(textos[0])
+    r["qr_cache_hit"] = medir("qr_cache_hit", lambda i: servicio.png(textos[0]), muestras, memoria)
+
+    r["reconcile"] = medir("reconcile", lambda i: wg_sync.reconcile_all(), pocas, memoria)
+
+    # Vencimientos: cola de prioridad completa y vencimiento real de `muestras` clientes
+    reloj = [time.time()]
+    planificador = ExpiryScheduler(reloj=lambda: reloj[0])
+    planificador.bot = FakeBot()
+    r["scheduler_load"] = medir("scheduler_load", lambda i: planificador.load(), 1, memoria)
+    a_vencer = nombres[:min(muestras, len(nombres))]
+    r["check_expired"] = medir("check_expired", lambda i: planificador._expire(a_vencer[i]), len(a_vencer), memoria)
+
+    return {"resultados": r, "rss_max_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def comparar(actual: dict, anterior: dict):
+    """Muestra la variación de p50 y ops/s respecto a un JSON anterior."""
+    print(f"\n📊 Comparación con {anterior.get('version', '?')}")
+    for tamano, datos in actual["tamanos"].items():
+        previos = anterior.get("tamanos", {}).get(tamano, {}).get("resultados", {})
+        for op, m in datos["resultados"].items():
+            p = previos.get(op)
+            if not p or not p.get("p50_ms") or not p.get("ops_s"):
+                continue
+            cambio = (m["p50_ms"] - p["p50_ms"]) / p["p50_ms"] * 100
+            marca = "🔺" if cambio > 10 else "🟢" if cambio < -10 else "  "
+            print(f"   {marca} {tamano:>6} {op:<24} p50 {p['p50_ms']:.3f} → {m['p50_ms']:.3f} ms ({cambio:+.0f}%)")
+
+
+def version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "desconocida"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks offline del bot WireGuard.")
+    parser.add_argument("-n", "--tamanos", type=int, nargs="+", default=list(TAMANOS), help="Tamaños de población")
+    parser.add_argument("-m", "--muestras", type=int, default=500, help="Llamadas por operación")
+    parser.add_argument("-o", "--salida", default="bench_results.json", help="Archivo JSON de resultados")
+    parser.add_argument("-i", "--interfaces", type=int, default=1, help="Interfaces WireGuard simuladas")
+    parser.add_argument("--memoria", action="store_true", help="Medir memoria pico por operación (más lento)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="wg_bench_")
+    try:
+        preparar_entorno(directorio, args.interfaces)
+        resultado = {
+            "version": version(),
+            "fecha": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "muestras": args.muestras,
+            "interfaces": args.interfaces,
+            "tamanos": {},
+        }
+        for tamano in args.tamanos:
+            resultado["tamanos"][str(tamano)] = bench_tamano(directorio, tamano, args.muestras, args.memoria)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    with open(args.salida, "w") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            comparar(resultado, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
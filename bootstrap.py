@@ -0,0 +1,150 @@
+# bootstrap.py
+
+import os
+import subprocess
+import time
+from contextlib import contextmanager
+
+from config import WAN_INTERFACE, BOOTSTRAP_CONFIGURAR_RED
+
+# Archivo propio de sysctl (no se toca /etc/sysctl.conf)
+SYSCTL_FILE = "/etc/sysctl.d/99-wireguard-bot.conf"
+IP_FORWARD = "/proc/sys/net/ipv4/ip_forward"
+
+
+class StartupTimer:
+    """
+    Mide cada paso del arranque para el informe de inicio.
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.pasos = []
+
+    @contextmanager
+    def paso(self, nombre: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.pasos.append((nombre, time.perf_counter() - t))
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.inicio
+        lineas = [f"⏱ Arranque en {total * 1000:.0f} ms"]
+        lineas += [f"   • {nombre}: {segundos * 1000:.1f} ms" for nombre, segundos in self.pasos]
+        return "\n".join(lineas)
+
+
+def firewall_rules(interfaces=None, wan=WAN_INTERFACE) -> dict:
+    """
+    Reglas necesarias por tabla, en el formato de `iptables-save`
+    (FORWARD para cada interfaz WireGuard administrada).
+    """
+    if interfaces is None:
+        from servers import get_registry
+        interfaces = get_registry().interfaces()
+    reglas = []
+    for wg in interfaces:
+        reglas += [f"-A FORWARD -i {wg} -j ACCEPT", f"-A FORWARD -o {wg} -j ACCEPT"]
+    return {
+        "nat": [f"-A POSTROUTING -o {wan} -j MASQUERADE"],
+        "filter": reglas,
+    }
+
+
+def missing_rules(guardado: str, reglas: dict) -> dict:
+    """
+    Compara la salida de `iptables-save` con las reglas y devuelve las que faltan.
+    """
+    presentes = {}
+    tabla = None
+    for linea in guardado.splitlines():
+        if linea.startswith("*"):
+            tabla = linea[1:].strip()
+        elif linea.startswith("-A") and tabla:
+            presentes.setdefault(tabla, set()).add(linea.strip())
+    faltan = {}
+    for tabla, lista in reglas.items():
+        pendientes = [r for r in lista if r not in presentes.get(tabla, set())]
+        if pendientes:
+            faltan[tabla] = pendientes
+    return faltan
+
+
+def restore_input(reglas: dict) -> str:
+    """Texto para `iptables-restore --noflush` con las reglas dadas."""
+    partes = []
+    for tabla, lista in reglas.items():
+        partes.append(f"*{tabla}")
+        partes.extend(lista)
+        partes.append("COMMIT")
+    return "\n".join(partes) + "\n"
+
+
+def ensure_firewall() -> int:
+    """
+    Agrega solo las reglas NAT/FORWARD que falten, en un único `iptables-restore`.
+    Devuelve cuántas reglas se agregaron.
+    """
+    guardado = subprocess.run(["iptables-save"], capture_output=True, text=True, check=True).stdout
+    faltan = missing_rules(guardado, firewall_rules())
+    if faltan:
+        subprocess.run(["iptables-restore", "--noflush"], input=restore_input(faltan), text=True, check=True)
+    return sum(len(r) for r in faltan.values())
+
+
+def ensure_ip_forwarding() -> bool:
+    """
+    Activa el reenvío IPv4 solo si está desactivado y lo deja persistido
+    en SYSCTL_FILE (sin volver a escribirlo en cada inicio).
+    Devuelve True si se cambió algo.
+    """
+    cambio = False
+    with open(IP_FORWARD) as f:
+        if f.read().strip() != "1":
+            subprocess.run(["sysctl", "-q", "-w", "net.ipv4.ip_forward=1"], check=True)
+            cambio = True
+
+    contenido = "net.ipv4.ip_forward=1\n"
+    try:
+        with open(SYSCTL_FILE) as f:
+            actual = f.read()
+    except FileNotFoundError:
+        actual = None
+    if actual != contenido:
+        os.makedirs(os.path.dirname(SYSCTL_FILE), exist_ok=True)
+        with open(SYSCTL_FILE, "w") as f:
+            f.write(contenido)
+        cambio = True
+    return cambio
+
+
+def bootstrap(timer: StartupTimer = None, configurar_red=BOOTSTRAP_CONFIGURAR_RED) -> StartupTimer:
+    """
+    Fase de preparación del servidor, idempotente: reenvío IP, reglas de
+    firewall y reparación de peers con una reconciliación por interfaz (en paralelo).
+    Los errores se informan pero no detienen el arranque del bot.
+    """
+    from wg_sync import reconcile_all  # importación local: solo se necesita aquí
+
+    timer = timer or StartupTimer()
+    pasos = [("reconciliar interfaces", reconcile_all)]
+    if configurar_red:
+        pasos = [("reenvío IP", ensure_ip_forwarding), ("firewall", ensure_firewall)] + pasos
+
+    for nombre, funcion in pasos:
+        with timer.paso(nombre):
+            try:
+                funcion()
+            except Exception as e:
+                print(f"⚠️ Error en el arranque ({nombre}): {e}")
+    return timer
+
+
+if __name__ == "__main__":
+    # Preparación manual: python bootstrap.py
+    from storage import ensure_storage
+
+    ensure_storage()
+    print(bootstrap().report())
@@ -0,0 +1,183 @@
+# bulk.py
+
+import io
+import os
+import csv
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from config import PLANES_PRECIOS, LOTE_WORKERS, LOTE_MAX_CLIENTES
+from storage import load_users, insert_users
+from ip_allocator import get_allocator
+from servers import get_registry
+from wgkeys import generate_keypair
+from generator import ruta_config
+from wgconf import render_config
+from qr_service import get_qr_service
+from scheduler import schedule_client
+from stats import get_stats
+from wg_sync import apply_by_interface, request_sync
+
+
+def calcular_vencimiento(plan: str, desde: datetime = None) -> str:
+    """
+    Fecha de vencimiento (UTC, '%Y-%m-%d %H:%M:%S') de un plan a partir de `desde`.
+    """
+    desde = desde or datetime.utcnow()
+    duracion = PLANES_PRECIOS[plan]
+    fecha = desde + timedelta(days=duracion.get("dias", 0), hours=duracion.get("horas", 0))
+    return fecha.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_lista(texto: str, plan_default: str = None) -> list:
+    """
+    Lee una lista de clientes en CSV o texto plano: una línea por cliente,
+    "nombre" o "nombre,plan". Las líneas vacías o que empiezan con # se ignoran.
+    Devuelve [(nombre, plan)].
+    """
+    entradas = []
+    for fila in csv.reader(io.StringIO(texto)):
+        campos = [c.strip() for c in fila]
+        if not campos or not campos[0] or campos[0].startswith("#"):
+            continue
+        plan = campos[1] if len(campos) > 1 and campos[1] else plan_default
+        entradas.append((campos[0], plan))
+    return entradas
+
+
+def validar_lista(entradas: list) -> list:
+    """
+    Devuelve los errores de la lista (vacía si todo es válido).
+    """
+    if not entradas:
+        return ["La lista está vacía."]
+    if len(entradas) > LOTE_MAX_CLIENTES:
+        return [f"Máximo {LOTE_MAX_CLIENTES} clientes por lote ({len(entradas)} recibidos)."]
+
+    errores = []
+    existentes = set(load_users())
+    vistos = set()
+    for nombre, plan in entradas:
+        if not nombre.isalnum():
+            errores.append(f"{nombre}: nombre inválido (solo letras y números).")
+        elif nombre in existentes or nombre in vistos:
+            errores.append(f"{nombre}: el nombre ya está en uso.")
+        elif plan not in PLANES_PRECIOS:
+            errores.append(f"{nombre}: plan desconocido ({plan}).")
+        vistos.add(nombre)
+    return errores
+
+
+def _keypair(_):
+    return generate_keypair()
+
+
+def generar_claves(cantidad: int, workers: int = LOTE_WORKERS) -> list:
+    """
+    Genera `cantidad` pares de claves repartidos en un pool de procesos.
+    """
+    if cantidad <= 1 or workers <= 1:
+        return [generate_keypair() for _ in range(cantidad)]
+    # forkserver, no fork: el bot ya tiene hilos y un lock tomado al hacer fork bloquearía al hijo
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+        return list(pool.map(_keypair, range(cantidad), chunksize=max(cantidad // (workers * 4), 1)))
+
+
+def provisionar_lote(entradas: list) -> dict:
+    """
+    Crea varios clientes de una vez: claves y QR en paralelo, IPs reservadas
+    en bloque, usuarios guardados en una sola transacción y peers enviados
+    en una sola llamada por interfaz (repartidos por ocupación).
+    Devuelve {"clientes": {nombre: datos}, "zip": bytes}.
+    Lanza ValueError si la lista no es válida.
+    """
+    errores = validar_lista(entradas)
+    if errores:
+        raise ValueError("\n".join(errores))
+
+    registro = get_registry()
+    reservas = registro.reserve(len(entradas))
+    clientes, textos = {}, []
+    try:
+        claves = generar_claves(len(entradas))
+        ahora = datetime.utcnow()
+
+        for (nombre, plan), (servidor, ip), (private_key, public_key) in zip(entradas, reservas, claves):
+            texto = render_config(private_key, ip)
+            clientes[nombre] = {
+                "private_key": private_key,
+                "public_key": public_key,
+                "ip": ip,
+                "interfaz": servidor.interfaz,
+                "conf_path": ruta_config(nombre, ip),
+                "vencimiento": calcular_vencimiento(plan, ahora),
+                "plan": plan
+            }
+            textos.append(texto)
+
+        pngs = get_qr_service().render_many(textos)
+
+        os.makedirs(os.path.dirname(next(iter(clientes.values()))["conf_path"]), exist_ok=True)
+        for datos, texto in zip(clientes.values(), textos):
+            with open(datos["conf_path"], "w") as f:
+                f.write(texto)
+
+        # Solo nombres libres: si alguien creó uno de ellos mientras tanto, no se pisa
+        existentes = insert_users(clientes)
+        if existentes:
+            raise ValueError("\n".join(f"{nombre}: el nombre ya está en uso." for nombre in existentes))
+    except Exception:
+        registro.release(reservas)
+        for datos in clientes.values():
+            if os.path.exists(datos["conf_path"]):
+                os.remove(datos["conf_path"])
+        raise
+
+    stats = get_stats()
+    for nombre, datos in clientes.items():
+        schedule_client(nombre, datos)
+        stats.on_create(nombre, datos)
+
+    sufijos = {s.interfaz: get_allocator(s.interfaz).sufijo for s in registro.servers}
+    try:
+        apply_by_interface({d["public_key"]: f"{d['ip']}{sufijos[d['interfaz']]}" for d in clientes.values()})
+    except Exception as e:
+        # Los clientes ya están guardados: la próxima sincronización los agrega
+        print(f"⚠️ No se pudieron agregar los peers del lote a las interfaces: {e}")
+        request_sync()
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for (nombre, datos), texto, png in zip(clientes.items(), textos, pngs):
+            zf.writestr(f"{nombre}.conf", texto)
+            zf.writestr(f"{nombre}_qr.png", png)
+
+    print(f"✅ Lote creado: {len(clientes)} clientes.")
+    return {"clientes": clientes, "zip": buffer.getvalue()}
+
+
+if __name__ == "__main__":
+    # Alta masiva desde la terminal: python bulk.py clientes.csv --plan "30 días" -o lote.zip
+    import argparse
+    from storage import ensure_storage
+
+    parser = argparse.ArgumentParser(description="Crea varios clientes WireGuard a partir de una lista.")
+    parser.add_argument("lista", help="Archivo CSV/texto con una línea 'nombre[,plan]' por cliente")
+    parser.add_argument("--plan", default=None, help="Plan para las líneas sin plan")
+    parser.add_argument("-o", "--salida", default="lote.zip", help="Archivo .zip de salida")
+    args = parser.parse_args()
+
+    ensure_storage()
+    with open(args.lista, "r", encoding="utf-8") as f:
+        entradas = parse_lista(f.read(), args.plan)
+
+    try:
+        resultado = provisionar_lote(entradas)
+    except ValueError as e:
+        raise SystemExit(f"❌ Lista inválida:\n{e}")
+
+    with open(args.salida, "wb") as f:
+        f.write(resultado["zip"])
+    print(f"📦 Configuraciones guardadas en {args.salida}")
@@ -0,0 +1,276 @@
+# client_handlers.py
+
+import math
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+from telebot.types import ReplyKeyboardMarkup, KeyboardButton
+from config import PORTAL_TASA, PORTAL_MAX_USUARIOS, PORTAL_CODIGO_HORAS, PORTAL_RENOVACION_HORAS
+from storage import find_user_by_telegram_id, update_user, get_state, set_state, transaction
+from artifacts import get_artifact_cache
+from qr_service import qr_image
+from wgconf import cached_config, conf_document, sent_key
+from outbox import TokenBucket
+from scheduler import parse_vencimiento
+from quota import get_quota_engine, cuota_plan
+from telemetry import formato_bytes
+from notifications import enviar_solicitud_renovacion
+from metrics import counter
+
+# Estado persistente: código de vinculación -> [nombre del cliente, expira (timestamp)]
+CLAVE_CODIGOS = "portal_codigos"
+
+MI_CONF = "📄 Mi configuración"
+MI_QR = "📲 Código QR"
+VENCE = "⏳ ¿Cuándo vence?"
+RENOVAR = "🔄 Solicitar renovación"
+
+
+def create_link_code(nombre: str, reloj=time.time) -> str:
+    """
+    Genera un código de un solo uso que vincula una cuenta de Telegram con
+    el cliente `nombre` (reemplaza al código anterior del mismo cliente).
+    """
+    codigo = secrets.token_urlsafe(9)
+    ahora = reloj()
+    with transaction():
+        codigos = {c: v for c, v in get_state(CLAVE_CODIGOS, {}).items() if v[1] > ahora and v[0] != nombre}
+        codigos[codigo] = [nombre, ahora + PORTAL_CODIGO_HORAS * 3600]
+        set_state(CLAVE_CODIGOS, codigos)
+    return codigo
+
+
+def bind(telegram_id: int, codigo: str, reloj=time.time) -> str:
+    """
+    Vincula la cuenta con el cliente del código y consume el código. Una
+    cuenta ve un solo cliente: se desvincula del anterior si lo había.
+    Devuelve el nombre del cliente; lanza ValueError si el código no sirve.
+    """
+    with transaction():
+        codigos = get_state(CLAVE_CODIGOS, {})
+        entrada = codigos.pop(codigo, None)
+        if entrada is None or entrada[1] <= reloj():
+            raise ValueError("⚠️ Código inválido o vencido. Pídele uno nuevo al administrador.")
+        set_state(CLAVE_CODIGOS, codigos)
+        nombre = entrada[0]
+
+        def desvincular(datos):
+            return datos if datos.pop("telegram_id", None) == telegram_id else None
+
+        def vincular(datos):
+            datos["telegram_id"] = telegram_id
+            return datos
+
+        anterior = find_user_by_telegram_id(telegram_id)
+        if anterior is not None and anterior[0] != nombre:
+            update_user(anterior[0], desvincular)
+        if update_user(nombre, vincular) is None:
+            raise ValueError("⚠️ El cliente de este código ya no existe.")
+    counter("portal_vinculaciones_total", "Cuentas de Telegram vinculadas a un cliente").inc()
+    return nombre
+
+
+class PortalLimiter:
+    """
+    Límite de consultas por cliente: una cubeta de tokens por cuenta de
+    Telegram. Solo se recuerdan las `max_usuarios` cuentas más recientes
+    (LRU), así miles de clientes no hacen crecer la memoria sin límite.
+    """
+
+    def __init__(self, tasa=PORTAL_TASA[0], capacidad=PORTAL_TASA[1], max_usuarios=PORTAL_MAX_USUARIOS, reloj=time.monotonic):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.max_usuarios = max_usuarios
+        self.reloj = reloj
+        self._cubetas = OrderedDict()  # telegram_id -> [TokenBucket, ya avisado]
+        self._lock = threading.Lock()
+
+    def check(self, user_id):
+        """
+        Toma un token de la cuenta. Devuelve (segundos de espera, avisar):
+        espera 0 = puede consultar; avisar solo es True en el primer rechazo
+        de cada racha (los siguientes se ignoran en silencio).
+        """
+        with self._lock:
+            entrada = self._cubetas.get(user_id)
+            if entrada is None:
+                entrada = self._cubetas[user_id] = [TokenBucket(self.tasa, self.capacidad, self.reloj), False]
+                if len(self._cubetas) > self.max_usuarios:
+                    self._cubetas.popitem(last=False)
+            else:
+                self._cubetas.move_to_end(user_id)
+            espera = entrada[0].espera()
+            avisar = bool(espera) and not entrada[1]
+            entrada[1] = bool(espera)
+        if espera:
+            counter("portal_limitadas_total", "Consultas del portal rechazadas por el límite").inc()
+        return espera, avisar
+
+
+_limiter = PortalLimiter()
+
+
+def get_portal_limiter() -> PortalLimiter:
+    return _limiter
+
+
+def _file_id_invalido(e: ApiTelegramException) -> bool:
+    # p. ej. 400 "wrong file identifier/HTTP URL specified" o "wrong remote file identifier"
+    return e.error_code == 400 and "file" in (e.description or "").lower()
+
+
+def send_cached(bot: TeleBot, chat_id: int, clave: str, crear, foto=False, **kwargs):
+    """
+    Envía un archivo reutilizando el file_id de Telegram de un envío
+    anterior (guardado en la caché de artefactos): el mismo .conf o QR no
+    se vuelve a generar ni a subir. crear() devuelve el archivo si hace falta.
+    """
+    enviar = bot.send_photo if foto else bot.send_document
+    cache = get_artifact_cache()
+    file_id = cache.get(clave)
+    if file_id is not None:
+        try:
+            return enviar(chat_id, file_id.decode(), **kwargs)
+        except ApiTelegramException as e:
+            if not _file_id_invalido(e):
+                raise  # 429, chat bloqueado...: volver a subir no ayuda
+            cache.discard(clave)  # file_id de otro bot o vencido: se vuelve a subir
+    mensaje = enviar(chat_id, crear(), **kwargs)
+    archivo = getattr(mensaje, "photo", None) if foto else getattr(mensaje, "document", None)
+    if foto and archivo:
+        archivo = archivo[-1]  # la foto de mayor resolución
+    if archivo is not None and getattr(archivo, "file_id", None):
+        cache.put(clave, archivo.file_id.encode())
+    return mensaje
+
+
+def status_text(nombre: str, datos: dict, reloj=time.time) -> str:
+    """Texto de "¿Cuándo vence?": vencimiento, tiempo restante y cuota de datos."""
+    restante = max(int(parse_vencimiento(datos["vencimiento"]) - reloj()), 0)
+    dias, resto = divmod(restante, 86400)
+    texto = (
+        f"👤 <b>{nombre}</b> — {datos.get('plan')}\n"
+        f"📅 Vence: <b>{datos['vencimiento'][:16]} UTC</b>\n"
+        f"🕒 Tiempo restante: <b>{dias} d {resto // 3600} h {resto % 3600 // 60} min</b>"
+    )
+    cuota = cuota_plan(datos.get("plan"))
+    if cuota is not None:
+        usado = get_quota_engine().usage(datos.get("public_key"))
+        texto += f"\n📶 Datos: {formato_bytes(usado)} de {formato_bytes(cuota)} ({min(usado * 100 / cuota, 100):.0f}%)"
+    if datos.get("suspendido"):
+        texto += "\n\n💤 Suspendida por inactividad: usa «Solicitar renovación» para que el administrador la reactive."
+    return texto
+
+
+def register_client_handlers(bot: TeleBot):
+    """
+    Portal de autoservicio para los clientes vinculados con /vincular: su
+    .conf, su QR y su vencimiento. Se registra después del panel de
+    administración (los handlers del administrador tienen prioridad).
+    """
+    limitador = get_portal_limiter()
+
+    def permitido(message) -> bool:
+        espera, avisar = limitador.check(message.from_user.id)
+        if espera and avisar:
+            bot.reply_to(message, f"⏳ Demasiadas consultas. Espera {math.ceil(espera)} s.")
+        return not espera
+
+    def cliente(message):
+        """(nombre, datos) del cliente vinculado al remitente (por índice), o None ya respondido."""
+        if not permitido(message):
+            return None
+        encontrado = find_user_by_telegram_id(message.from_user.id)
+        if encontrado is None:
+            bot.reply_to(message, "🔗 Tu cuenta no está vinculada a ninguna configuración. Pídele un enlace de acceso al administrador.")
+        return encontrado
+
+    def activo(message):
+        encontrado = cliente(message)
+        if encontrado is not None and encontrado[1].get("suspendido"):
+            bot.reply_to(message, "💤 Tu configuración está suspendida por inactividad. Usa «Solicitar renovación» para reactivarla.")
+            return None
+        return encontrado
+
+    @bot.message_handler(commands=['start'])
+    def start(message):
+        partes = message.text.split()
+        if len(partes) > 1:
+            # /start <código>: enlace generado con /vincular
+            if not permitido(message):
+                return
+            try:
+                nombre = bind(message.from_user.id, partes[1])
+            except ValueError as e:
+                return bot.reply_to(message, str(e))
+            return show_client_menu(bot, message.chat.id, f"✅ Cuenta vinculada a <b>{nombre}</b>.")
+        encontrado = cliente(message)
+        if encontrado is not None:
+            show_client_menu(bot, message.chat.id, f"👋 Hola, <b>{encontrado[0]}</b>.")
+
+    @bot.message_handler(commands=['config'])
+    @bot.message_handler(func=lambda m: m.text == MI_CONF)
+    def mi_configuracion(message):
+        encontrado = activo(message)
+        if encontrado is None:
+            return
+        nombre, datos = encontrado
+        config_text = cached_config(datos["private_key"], datos["ip"])
+        send_cached(bot, message.chat.id, sent_key("tg_conf", nombre, config_text),
+                    lambda: conf_document(nombre, config_text))
+
+    @bot.message_handler(commands=['qr'])
+    @bot.message_handler(func=lambda m: m.text == MI_QR)
+    def mi_qr(message):
+        encontrado = activo(message)
+        if encontrado is None:
+            return
+        config_text = cached_config(encontrado[1]["private_key"], encontrado[1]["ip"])
+        send_cached(bot, message.chat.id, sent_key("tg_qr", config_text), lambda: qr_image(config_text),
+                    foto=True, caption="📲 Escanea este código QR con WireGuard")
+
+    @bot.message_handler(commands=['vence'])
+    @bot.message_handler(func=lambda m: m.text == VENCE)
+    def cuando_vence(message):
+        encontrado = cliente(message)
+        if encontrado is not None:
+            bot.send_message(message.chat.id, status_text(*encontrado), parse_mode="HTML")
+
+    @bot.message_handler(commands=['renovacion'])
+    @bot.message_handler(func=lambda m: m.text == RENOVAR)
+    def solicitar_renovacion(message):
+        encontrado = cliente(message)
+        if encontrado is None:
+            return
+        nombre, datos = encontrado
+        ahora = int(time.time())
+
+        def marcar(datos):
+            if ahora - datos.get("renovacion_solicitada", 0) < PORTAL_RENOVACION_HORAS * 3600:
+                return None
+            datos["renovacion_solicitada"] = ahora
+            return datos
+
+        # Una solicitud por período: el resto no vuelve a molestar al administrador
+        if update_user(nombre, marcar) is None:
+            return bot.reply_to(message, "ℹ️ Ya enviaste una solicitud. El administrador te contactará.")
+        usuario = f"@{message.from_user.username}" if message.from_user.username else str(message.from_user.id)
+        enviar_solicitud_renovacion(nombre, datos, usuario)
+        bot.reply_to(message, "📨 Solicitud enviada al administrador.")
+
+
+def show_client_menu(bot: TeleBot, chat_id: int, saludo: str):
+    kb = ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.add(KeyboardButton(MI_CONF), KeyboardButton(MI_QR))
+    kb.add(KeyboardButton(VENCE), KeyboardButton(RENOVAR))
+
+    bot.send_message(
+        chat_id,
+        f"{saludo}\n\nElige una opción para consultar tu configuración de WireGuard:",
+        reply_markup=kb,
+        parse_mode="HTML"
+    )
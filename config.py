@@ -18,9 +18,102 @@ LISTEN_PORT = 51820
 # Alias para compatibilidad con scripts que usan WG_PORT
 WG_PORT = LISTEN_PORT  # ✅ Línea agregada para evitar error en utils.py
 
+# Interfaz WireGuard principal (para varias interfaces, ver SERVIDORES)
+WG_INTERFACE = "wg0"
+
+# Ejecutar los cambios en la interfaz (wg set) con sudo
+WG_SUDO = True
+
+# Espera (segundos) para agrupar cambios seguidos en una sola actualización de las interfaces
+WG_SYNC_DEBOUNCE_SEGUNDOS = 1.0
+
+# Espera máxima (segundos) desde el primer cambio pendiente: con cambios continuos
+# la actualización no se pospone más que esto
+WG_SYNC_MAX_ESPERA_SEGUNDOS = 5.0
+
+# Quitar de cada interfaz los peers que no estén registrados en la base de datos
+# (p. ej. agregados a mano). Con False solo se quitan los de clientes eliminados,
+# vencidos o suspendidos por el bot, y el resto se informa en el registro.
+WG_SYNC_ELIMINAR_DESCONOCIDOS = False
+
+# Tiempo (segundos) que se reutiliza la lectura de `wg show <interfaz> dump` entre consultas
+WG_DUMP_TTL_SEGUNDOS = 2.0
+
+# Interfaz de salida a Internet (regla NAT MASQUERADE)
+WAN_INTERFACE = "enX0"
+
+# Configurar reenvío IP y reglas de iptables al iniciar (requiere root)
+BOOTSTRAP_CONFIGURAR_RED = True
+
 # Carpeta donde se almacenan los archivos .conf generados
 WG_CONFIG_DIR = "/etc/wireguard/configs"
 
+# Códigos QR: procesos para altas masivas y borde (en módulos)
+QR_WORKERS = 4
+QR_BORDE = 1
+
+# Caché de artefactos (.conf, QR, .zip): límite en memoria y nivel opcional en disco (None = solo memoria).
+# Los .conf nunca se guardan en disco; los QR sí si se activa (llevan la clave privada: carpeta 0700)
+ARTEFACTOS_MEMORIA_BYTES = 32 * 1024 * 1024
+ARTEFACTOS_DIR = None  # ej. "data/artefactos"
+ARTEFACTOS_DISCO_BYTES = 256 * 1024 * 1024
+
+# Respaldos (/respaldo): tamaño máximo de cada parte enviada por Telegram.
+# Los bots solo descargan archivos de hasta 20 MB, así cada parte sirve también para /restaurar
+RESPALDO_PARTE_BYTES = 19 * 1024 * 1024
+
+# Altas masivas (/lote): procesos para generar claves y máximo de clientes por lote
+LOTE_WORKERS = 4
+LOTE_MAX_CLIENTES = 1000
+
+# Hilos que procesan las actualizaciones del bot y tamaño máximo de cada cola
+BOT_WORKERS = 4
+BOT_COLA_MAX = 100
+
+# Portal de clientes: consultas por segundo y ráfaga de cada cliente, cuántos clientes
+# se recuerdan para limitarlos, horas de validez del código de vinculación (/vincular)
+# y horas entre dos solicitudes de renovación del mismo cliente
+PORTAL_TASA = (0.2, 5)
+PORTAL_MAX_USUARIOS = 10000
+PORTAL_CODIGO_HORAS = 48
+PORTAL_RENOVACION_HORAS = 12
+
+# Clientes por página en los listados del panel
+LISTA_POR_PAGINA = 10
+
+# Cada cuántos segundos se guarda un snapshot de las estadísticas en el historial
+STATS_SNAPSHOT_SEGUNDOS = 3600
+
+# Telemetría de tráfico: cada cuánto se leen las interfaces y tras cuánto sin handshake un peer se considera inactivo
+TELEMETRIA_INTERVALO_SEGUNDOS = 60
+TELEMETRIA_INACTIVO_SEGUNDOS = 3 * 86400
+
+# Recuperación de IPs (/recuperar): cada cuánto se suspenden los clientes inactivos (None = solo a mano)
+# y tras cuántos segundos sin handshake por plan (None = nunca). Los que nunca se conectaron se cuentan desde el alta
+RECUPERAR_INTERVALO_SEGUNDOS = 3600
+RECUPERAR_INACTIVO_SEGUNDOS = {
+    "Free (5 horas)": 3600,
+    "15 días": 7 * 86400,
+    "30 días": 7 * 86400
+}
+# Planes que la ronda automática suspende aunque ya se hayan conectado; del resto (los pagos)
+# solo suspende a los que nunca se conectaron. Los demás, solo a mano con /recuperar si
+RECUPERAR_AUTOMATICO_PLANES = ("Free (5 horas)",)
+
+# Notificaciones: ventana para agrupar eventos en un resumen, límites de envío
+# (mensajes por segundo, ráfaga) para chats privados y grupos, y espera máxima entre reintentos
+NOTIF_VENTANA_SEGUNDOS = 10
+NOTIF_TASA_CHAT = (1.0, 3)
+NOTIF_TASA_GRUPO = (20 / 60, 3)
+NOTIF_BACKOFF_MAX_SEGUNDOS = 900
+
+# Endpoint local de métricas (formato Prometheus); None = desactivado
+METRICS_HOST = "127.0.0.1"
+METRICS_PUERTO = 9108
+
+# Intervalo del perfilador por muestreo (/perfil)
+PERFIL_INTERVALO_SEGUNDOS = 0.01
+
 # Archivo JSON con las configuraciones de clientes registradas
 CLIENTES_FILE = "clientes.json"
 
@@ -37,22 +130,58 @@ PLANES = [
     "30 días"
 ]
 
-# Definición de duración y precio interno de cada plan
+# Definición de duración, precio interno y cuota de datos (GB, None = sin límite) de cada plan
 # (Los precios no se muestran en el bot ya que el administrador gestiona todo)
 PLANES_PRECIOS = {
-    "Free (5 horas)": {"horas": 5, "precio_cup": 0, "precio_saldo": 0},
-    "15 días": {"dias": 15, "precio_cup": 500, "precio_saldo": 250},
-    "30 días": {"dias": 30, "precio_cup": 750, "precio_saldo": 375}
+    "Free (5 horas)": {"horas": 5, "precio_cup": 0, "precio_saldo": 0, "cuota_gb": 1},
+    "15 días": {"dias": 15, "precio_cup": 500, "precio_saldo": 250, "cuota_gb": 60},
+    "30 días": {"dias": 30, "precio_cup": 750, "precio_saldo": 375, "cuota_gb": 120}
 }
 
+# Cuotas (/cuota): qué hacer al agotarla ("limitar" la velocidad o "suspender" como en /recuperar),
+# velocidad de los limitados (KB/s por sentido) y fracciones de la cuota que generan aviso
+CUOTA_ACCION = "limitar"
+CUOTA_LIMITE_KBYTES = 64
+CUOTA_AVISOS = (0.8, 1.0)
+
 # Métodos de pago disponibles (no usados ahora, pero listos para futuro)
 METODOS_PAGO = ["CUP", "Saldo Móvil"]
 
 # Rango de IPs permitido para los clientes (usado en utils.py)
 WG_NETWORK_RANGE = "0.0.0.0/0"
 
+# Subred de la que se asignan las IPs de los clientes (.1 es el servidor)
+# Admite redes más grandes (ej. "10.9.0.0/16") o IPv6 ULA (ej. "fd09::/64")
+WG_SUBNET = "10.9.0.0/24"
+
 # Dominio o IP + puerto para el endpoint que aparece en el .conf
 SERVER_ENDPOINT = f"{SERVER_PUBLIC_IP}"
 
-# Grupo o canal para recibir logs de actividad (puedes activarlo luego)
+# Servidores DNS que usan los clientes (línea DNS del .conf)
+CLIENT_DNS = "1.1.1.1"
+
+# Interfaces WireGuard administradas por el bot (ver servers.py). Los clientes nuevos
+# se crean en la de menor ocupación; las subredes no deben solaparse.
+# "capacidad" limita los clientes de la interfaz (None = toda la subred).
+# La primera es la interfaz por defecto (la de los clientes ya existentes).
+SERVIDORES = [
+    {
+        "interfaz": WG_INTERFACE,
+        "clave_publica": SERVER_PUBLIC_KEY,
+        "endpoint": SERVER_ENDPOINT,
+        "puerto": LISTEN_PORT,
+        "subred": WG_SUBNET,
+        "capacidad": None,
+    },
+    # {
+    #     "interfaz": "wg1",
+    #     "clave_publica": "CLAVE_PUBLICA_DE_WG1",
+    #     "endpoint": SERVER_ENDPOINT,
+    #     "puerto": 51821,
+    #     "subred": "10.10.0.0/24",
+    #     "capacidad": 200,
+    # },
+]
+
+# Grupo o canal que también recibe las notificaciones (id negativo; None = desactivado)
 GRUPO_LOGS = None
@@ -0,0 +1,17 @@
+# conftest.py
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """Base SQLite vacía en una carpeta temporal (una por prueba)."""
+    anterior = getattr(storage._local, "conn", None)
+    storage._local.conn = None
+    monkeypatch.setattr(storage, "DB_PATH", str(tmp_path / "wireguard.db"))
+    storage.ensure_storage()
+    yield tmp_path
+    storage._local.conn.close()
+    storage._local.conn = anterior
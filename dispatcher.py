@@ -0,0 +1,141 @@
+# dispatcher.py
+
+import functools
+import queue
+import threading
+import time
+
+from telebot import TeleBot
+
+from config import ADMIN_ID, BOT_WORKERS, BOT_COLA_MAX
+from metrics import counter, histogram, medir, medido
+
+
+class KeyedWorkerPool:
+    """
+    Pool de hilos con una cola acotada por hilo.
+
+    Cada tarea lleva una clave (el id del usuario) y siempre va al mismo
+    hilo, así los pasos de un mismo administrador se procesan en orden
+    mientras los de otros usuarios avanzan en paralelo. Si una cola se
+    llena, put() bloquea al productor (el hilo de polling) en lugar de
+    acumular actualizaciones sin límite, o devuelve False con bloquear=False.
+
+    Las claves de `dedicadas` (los administradores) tienen cola e hilo
+    propios: nunca esperan detrás de las actualizaciones de los clientes.
+    """
+
+    def __init__(self, workers=BOT_WORKERS, max_cola=BOT_COLA_MAX, dedicadas=()):
+        self._colas = [queue.Queue(maxsize=max_cola) for _ in range(max(workers, 1))]
+        self._dedicadas = {clave: queue.Queue(maxsize=max_cola) for clave in dedicadas}
+        self._threads = []
+        nombres = [f"bot-worker-{i}" for i in range(len(self._colas))] + [f"bot-worker-{c}" for c in self._dedicadas]
+        for nombre, cola in zip(nombres, self._todas()):
+            t = threading.Thread(target=self._run, args=(cola,), name=nombre, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _todas(self):
+        return self._colas + list(self._dedicadas.values())
+
+    def put(self, clave, tarea, *args, bloquear=True) -> bool:
+        """Encola una tarea en la cola de su clave. Devuelve False si no bloquea y la cola está llena."""
+        cola = self._dedicadas.get(clave) or self._colas[hash(clave) % len(self._colas)]
+        try:
+            cola.put((tarea, args, time.perf_counter()), block=bloquear)
+        except queue.Full:
+            return False
+        return True
+
+    def pendientes(self) -> int:
+        return sum(c.qsize() for c in self._todas())
+
+    def join(self):
+        """Espera a que se procesen todas las tareas encoladas."""
+        for cola in self._todas():
+            cola.join()
+
+    @staticmethod
+    def _run(cola):
+        while True:
+            tarea, args, encolado = cola.get()
+            histogram("bot_cola_espera_segundos", "Tiempo de espera de las actualizaciones en cola").observe(
+                time.perf_counter() - encolado
+            )
+            try:
+                with medir("bot_update_segundos", "Duración del procesamiento de cada actualización"):
+                    tarea(*args)
+            except Exception as e:
+                print(f"❌ Error procesando actualización: {e}")
+            finally:
+                cola.task_done()
+
+
+def update_key(update):
+    """
+    Clave de orden de una actualización: el usuario que la envió
+    (o el id de la actualización si no tiene remitente).
+    """
+    for campo in ("message", "edited_message", "callback_query", "inline_query", "my_chat_member"):
+        obj = getattr(update, campo, None)
+        usuario = getattr(obj, "from_user", None)
+        if usuario is not None:
+            return usuario.id
+    return update.update_id
+
+
+class PooledTeleBot(TeleBot):
+    """
+    TeleBot cuyo hilo de polling solo recibe actualizaciones y las reparte
+    en un KeyedWorkerPool. Un handler lento (wg, QR, base de datos) ya no
+    detiene al resto de usuarios, y el orden por usuario se mantiene.
+
+    El administrador tiene su propio hilo; las actualizaciones de los
+    clientes (portal, ver client_handlers.py) se descartan si su cola está
+    llena, así una avalancha de consultas no frena el polling ni el panel.
+    """
+
+    def __init__(self, token, workers=BOT_WORKERS, max_cola=BOT_COLA_MAX, dedicadas=(ADMIN_ID,), **kwargs):
+        # Los handlers se ejecutan dentro del worker, no en el pool propio de TeleBot
+        kwargs["threaded"] = False
+        super().__init__(token, **kwargs)
+        self.dedicadas = set(dedicadas)
+        self.dispatch_pool = KeyedWorkerPool(workers, max_cola, dedicadas)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # El offset del próximo getUpdates se actualiza aquí, antes de procesar
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            clave = update_key(update)
+            if not self.dispatch_pool.put(clave, super().process_new_updates, [update],
+                                          bloquear=clave in self.dedicadas):
+                counter("bot_updates_descartadas_total", "Actualizaciones de clientes descartadas por cola llena").inc()
+
+    # Cada handler registrado se mide con su nombre de función
+    def _medir_handler(self, handler_dict):
+        funcion = handler_dict["function"]
+        handler_dict["function"] = medido(
+            "bot_handler_segundos", "Duración de cada handler del bot", handler=funcion.__name__
+        )(funcion)
+        return handler_dict
+
+    def add_message_handler(self, handler_dict):
+        super().add_message_handler(self._medir_handler(handler_dict))
+
+    def add_callback_query_handler(self, handler_dict):
+        super().add_callback_query_handler(self._medir_handler(handler_dict))
+
+
+def _medir_envio(metodo):
+    original = getattr(TeleBot, metodo)
+
+    @functools.wraps(original)
+    def envoltura(self, *args, **kwargs):
+        with medir("telegram_envio_segundos", "Duración de las llamadas salientes a Telegram", metodo=metodo):
+            return original(self, *args, **kwargs)
+    return envoltura
+
+
+for _metodo in ("send_message", "send_document", "send_photo", "edit_message_text", "answer_callback_query"):
+    setattr(PooledTeleBot, _metodo, _medir_envio(_metodo))
@@ -1,30 +1,28 @@
 # generator.py
 
-import os, subprocess
-from config import SERVER_PUBLIC_KEY, SERVER_PUBLIC_IP, LISTEN_PORT
-from utils import get_next_ip, guardar_archivo
+import os
+from config import WG_CONFIG_DIR
+from utils import get_next_ip, release_ip, guardar_archivo
+from wgconf import render_config
+from servers import interfaz_de
+from wgkeys import generate_keypair
+
+def ruta_config(nombre_cliente: str, ip_cliente: str) -> str:
+    """
+    Ruta del archivo .conf de un cliente.
+    """
+    nombre_archivo = f"{nombre_cliente}_{ip_cliente.replace('/', '')}.conf"
+    return os.path.join(WG_CONFIG_DIR, nombre_archivo)
 
 def generar_configuracion(nombre_cliente: str):
+    ip_cliente = None
     try:
-        private_key = subprocess.check_output(["wg", "genkey"]).decode().strip()
-        public_key = subprocess.check_output(["bash", "-c", f"echo {private_key} | wg pubkey"]).decode().strip()
+        private_key, public_key = generate_keypair()
         ip_cliente = get_next_ip()
 
-        config_text = f"""[Interface]
-PrivateKey = {private_key}
-Address = {ip_cliente}/32
-DNS = 1.1.1.1
-
-[Peer]
-PublicKey = {SERVER_PUBLIC_KEY}
-Endpoint = {SERVER_PUBLIC_IP}:{LISTEN_PORT}
-AllowedIPs = 0.0.0.0/0
-PersistentKeepalive = 25
-"""
+        config_text = render_config(private_key, ip_cliente)
 
-        # Nombre del archivo .conf
-        nombre_archivo = f"{nombre_cliente}_{ip_cliente.replace('/', '')}.conf"
-        ruta = os.path.join("/etc/wireguard/configs", nombre_archivo)
+        ruta = ruta_config(nombre_cliente, ip_cliente)
         guardar_archivo(ruta, config_text)
 
         return {
@@ -32,10 +30,13 @@ PersistentKeepalive = 25
             "private_key": private_key,
             "public_key": public_key,
             "ip": ip_cliente,
-            "conf_path": ruta
+            "interfaz": interfaz_de(ip_cliente),
+            "conf_path": ruta,
+            "config_text": config_text
         }
 
     except Exception as e:
+        release_ip(ip_cliente)
         return {
             "status": "error",
             "error": str(e)
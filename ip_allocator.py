@@ -0,0 +1,272 @@
+# ip_allocator.py
+
+import ipaddress
+import threading
+
+from storage import get_state, set_state, load_users, transaction, ip_offsets, ip_offsets_apply, ip_offsets_replace
+from servers import get_registry
+
+
+class IPAllocator:
+    """
+    Asignador de IPs para clientes dentro de una subred (IPv4 o IPv6).
+
+    Cada dirección se identifica por su desplazamiento dentro de la red.
+    Se guarda un cursor (primer desplazamiento que falta entregar), una pila
+    de desplazamientos liberados por debajo del cursor y los desplazamientos
+    ya ocupados por encima del cursor (que el cursor salta al llegar), así
+    reservar y liberar cuesta O(1) y la memoria crece con los clientes, no
+    con los huecos de la subred. Cada operación persiste solo lo que cambió.
+    """
+
+    # Desplazamiento 0 = dirección de red, 1 = servidor
+    PRIMER_CLIENTE = 2
+
+    # Tipos de fila en storage.ip_offsets
+    LIBRE = "libre"
+    OCUPADO = "ocupado"
+
+    def __init__(self, cidr: str, clave_estado: str = "ip_allocator", capacidad: int = None):
+        self.red = ipaddress.ip_network(cidr, strict=False)
+        self.clave_estado = clave_estado
+        self._lock = threading.Lock()
+        self._cursor = self.PRIMER_CLIENTE
+        self._libres = []
+        self._libres_set = set()
+        self._arriba = set()  # ocupados con desplazamiento >= cursor
+        # Cambios aún sin guardar (ver _persist)
+        self._cursor_guardado = None
+        self._agregados = {}
+        self._quitados = set()
+
+        # En IPv4 la última dirección es broadcast
+        self._limite = self.red.num_addresses - (1 if self.red.version == 4 else 0)
+        if capacidad is not None:
+            self._limite = min(self._limite, self.PRIMER_CLIENTE + capacidad)
+
+    @property
+    def sufijo(self) -> str:
+        """Prefijo de host para el .conf (/32 en IPv4, /128 en IPv6)."""
+        return "/32" if self.red.version == 4 else "/128"
+
+    @property
+    def capacidad(self) -> int:
+        return max(self._limite - self.PRIMER_CLIENTE, 0)
+
+    @property
+    def en_uso(self) -> int:
+        return self._cursor - self.PRIMER_CLIENTE - len(self._libres) + len(self._arriba)
+
+    def _ip(self, offset: int) -> str:
+        return str(self.red.network_address + offset)
+
+    def _offset(self, ip: str) -> int:
+        addr = ipaddress.ip_address(ip)
+        if addr not in self.red:
+            raise ValueError(f"❌ La IP {ip} no pertenece a la subred {self.red}.")
+        return int(addr) - int(self.red.network_address)
+
+    def _marcar(self, offset: int, tipo: str):
+        self._quitados.discard(offset)
+        self._agregados[offset] = tipo
+
+    def _desmarcar(self, offset: int):
+        self._agregados.pop(offset, None)
+        self._quitados.add(offset)
+
+    def _avanzar(self):
+        # El cursor salta los desplazamientos que ya estaban ocupados
+        while self._cursor in self._arriba:
+            self._arriba.discard(self._cursor)
+            self._desmarcar(self._cursor)
+            self._cursor += 1
+
+    def _persist(self):
+        if self._cursor != self._cursor_guardado:
+            set_state(self.clave_estado, {"red": str(self.red), "cursor": self._cursor})
+            self._cursor_guardado = self._cursor
+        if self._agregados or self._quitados:
+            ip_offsets_apply(self.clave_estado, self._agregados, self._quitados)
+        self._agregados, self._quitados = {}, set()
+
+    def _take(self) -> int:
+        if self._libres:
+            offset = self._libres.pop()
+            self._libres_set.discard(offset)
+            self._desmarcar(offset)
+            return offset
+        if self._cursor >= self._limite:
+            raise RuntimeError("🚫 No hay IPs disponibles. Todas las direcciones están en uso.")
+        offset = self._cursor
+        self._cursor += 1
+        self._avanzar()
+        return offset
+
+    def _free(self, offset: int):
+        if offset in self._arriba:
+            self._arriba.discard(offset)
+            self._desmarcar(offset)
+        elif self.PRIMER_CLIENTE <= offset < self._cursor and offset not in self._libres_set:
+            self._libres.append(offset)
+            self._libres_set.add(offset)
+            self._marcar(offset, self.LIBRE)
+
+    def reserve(self) -> str:
+        """
+        Reserva y devuelve la próxima IP libre.
+        """
+        with self._lock, transaction():
+            offset = self._take()
+            self._persist()
+        return self._ip(offset)
+
+    def reserve_many(self, cantidad: int) -> list:
+        """
+        Reserva varias IPs de una vez (una sola escritura del estado).
+        Si no alcanzan, no se reserva ninguna.
+        """
+        with self._lock:
+            if cantidad > self.capacidad - self.en_uso:
+                raise RuntimeError(f"🚫 Solo quedan {self.capacidad - self.en_uso} IPs libres.")
+            with transaction():
+                offsets = [self._take() for _ in range(cantidad)]
+                self._persist()
+        return [self._ip(o) for o in offsets]
+
+    def claim(self, ip: str) -> bool:
+        """
+        Reserva una IP concreta si está libre (p. ej. la anterior de un cliente
+        que se reactiva). Devuelve False si ya está en uso o no es de la subred.
+        """
+        try:
+            offset = self._offset(ip)
+        except ValueError:
+            return False
+        with self._lock:
+            if offset in self._libres_set:
+                self._libres.remove(offset)
+                self._libres_set.discard(offset)
+                self._desmarcar(offset)
+            elif self._cursor <= offset < self._limite and offset not in self._arriba:
+                # Las saltadas siguen libres: el cursor las entrega en orden
+                self._arriba.add(offset)
+                self._marcar(offset, self.OCUPADO)
+                self._avanzar()
+            else:
+                return False
+            with transaction():
+                self._persist()
+        return True
+
+    def release(self, ip: str):
+        """
+        Devuelve una IP al conjunto libre. Ignora IPs ajenas o ya liberadas.
+        """
+        try:
+            offset = self._offset(ip)
+        except ValueError:
+            return
+        with self._lock, transaction():
+            self._free(offset)
+            self._persist()
+
+    def release_many(self, ips):
+        """Libera varias IPs con una sola escritura del estado."""
+        with self._lock, transaction():
+            for ip in ips:
+                try:
+                    offset = self._offset(ip)
+                except ValueError:
+                    continue
+                self._free(offset)
+            self._persist()
+
+    def _usados(self, used_ips) -> set:
+        usados = set()
+        for ip in used_ips:
+            try:
+                offset = self._offset(ip)
+            except ValueError:
+                continue
+            if offset >= self.PRIMER_CLIENTE:
+                usados.add(offset)
+        return usados
+
+    def rebuild(self, used_ips):
+        """
+        Reconstruye el estado a partir de las IPs en uso: el cursor vuelve al
+        principio y salta las ocupadas, así no se materializa ningún hueco.
+        """
+        usados = self._usados(used_ips)
+        with self._lock, transaction():
+            self._cursor = self.PRIMER_CLIENTE
+            self._libres, self._libres_set = [], set()
+            self._arriba = usados
+            self._avanzar()
+            self._agregados, self._quitados = {}, set()  # se reescribe todo
+            ip_offsets_replace(self.clave_estado, {o: self.OCUPADO for o in self._arriba})
+            self._cursor_guardado = None
+            self._persist()
+
+    def load(self, used_ips):
+        """
+        Carga el estado persistido y lo valida contra las IPs en uso.
+        Si no coincide (subred distinta, caída a mitad de una alta...), se reconstruye.
+        """
+        used_ips = list(used_ips)
+        usados = self._usados(used_ips)
+        estado = get_state(self.clave_estado)
+
+        if estado and estado.get("red") == str(self.red) and "libres" not in estado:
+            cursor = estado["cursor"]
+            filas = ip_offsets(self.clave_estado)
+            # Se apilan en orden inverso para volver a entregar primero las más bajas
+            libres = sorted((o for o, tipo in filas.items() if tipo == self.LIBRE), reverse=True)
+            libres_set = set(libres)
+            arriba = {o for o, tipo in filas.items() if tipo == self.OCUPADO}
+            consistente = (
+                all(o not in libres_set for o in usados)
+                and all(o < cursor or o in arriba for o in usados)
+                and all(o < cursor for o in libres) and all(o >= cursor for o in arriba)
+                and cursor - self.PRIMER_CLIENTE - len(libres) + len(arriba) == len(usados)
+            )
+            if consistente:
+                with self._lock:
+                    self._cursor, self._libres, self._libres_set, self._arriba = cursor, libres, libres_set, arriba
+                    self._cursor_guardado = cursor
+                return
+
+        # Estado ausente, de otra subred, inconsistente o del formato anterior (lista completa)
+        self.rebuild(used_ips)
+
+
+_allocators = {}  # interfaz -> IPAllocator
+_allocator_lock = threading.Lock()
+
+
+def get_allocator(interfaz: str = None) -> IPAllocator:
+    """
+    Devuelve el asignador de una interfaz (None = la interfaz por defecto),
+    cargado desde sus clientes en la base de datos en el primer uso.
+    """
+    servidor = get_registry().get(interfaz)
+    with _allocator_lock:
+        allocator = _allocators.get(servidor.interfaz)
+        if allocator is None:
+            allocator = IPAllocator(servidor.subred, f"ip_allocator:{servidor.interfaz}", servidor.capacidad)
+            usuarios = load_users(servidor.interfaz).values()
+            allocator.load(data.get("ip") for data in usuarios if data.get("ip"))
+            _allocators[servidor.interfaz] = allocator
+    return allocator
+
+
+def reset_allocators():
+    """Descarta los asignadores: se vuelven a cargar desde la base en el próximo uso."""
+    with _allocator_lock:
+        _allocators.clear()
+
+
+def allocator_for_ip(ip: str):
+    """Asignador de la interfaz cuya subred contiene la IP, o None."""
+    servidor = get_registry().for_ip(ip)
+    return get_allocator(servidor.interfaz) if servidor else None
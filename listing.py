@@ -0,0 +1,175 @@
+# listing.py
+
+import html
+import ipaddress
+import math
+
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import LISTA_POR_PAGINA
+from storage import page_users, count_users, find_user_by_ip
+
+# Modos de listado (van en el callback_data de los botones)
+VER = "ver"
+ELIMINAR = "del"
+
+# Dirección de la paginación por clave (va en el callback_data)
+SIGUIENTE = "n"
+ANTERIOR = "p"
+
+# Telegram limita callback_data a 64 bytes (no caracteres); los prefijos de búsqueda se recortan
+MAX_CALLBACK = 64
+MAX_PREFIJO = 32  # bytes en UTF-8
+
+
+def es_ip(texto: str) -> bool:
+    try:
+        ipaddress.ip_address(texto)
+        return True
+    except ValueError:
+        return False
+
+
+def recortar_prefijo(prefijo: str) -> str:
+    """Recorta el prefijo a MAX_PREFIJO bytes en UTF-8 sin partir un carácter."""
+    return prefijo.encode()[:MAX_PREFIJO].decode("utf-8", "ignore")
+
+
+def callback_pagina(modo: str, pagina: int, prefijo: str = "", direccion: str = "", ancla: str = "") -> str:
+    """
+    Con `direccion`, la página se pide por clave: los nombres después (o
+    antes) de `ancla`, que ya empieza por el prefijo (solo viaja su largo).
+    Si el nombre no entra en los 64 bytes, se pide por número de página.
+    """
+    if direccion:
+        data = f"lst:{modo}:{pagina}:{direccion}:{len(prefijo)}:{ancla}"
+        if len(data.encode()) <= MAX_CALLBACK:
+            return data
+    return f"lst:{modo}:{pagina}::{recortar_prefijo(prefijo)}"
+
+
+def parse_callback_pagina(data: str):
+    """
+    'lst:ver:3:n:2:abc' -> ('ver', 3, 'ab', 'n', 'abc');
+    'lst:ver:3::ab' (o el formato anterior 'lst:ver:3:ab') -> ('ver', 3, 'ab', '', None)
+    """
+    partes = data.split(":", 4)
+    if len(partes) == 4:
+        partes.insert(3, "")
+    _, modo, pagina, direccion, resto = partes
+    if not direccion:
+        return modo, int(pagina), resto, "", None
+    largo, _, ancla = resto.partition(":")
+    return modo, int(pagina), ancla[:int(largo)], direccion, ancla
+
+
+def _linea(nombre: str, datos: dict) -> str:
+    nombre = html.escape(nombre)
+    if datos.get("suspendido"):
+        return f"💤 <b>{nombre}</b> — suspendido (IP anterior: {datos.get('ip_anterior')})\n⏳ Vence: {datos.get('vencimiento')}\n"
+    return f"🔸 <b>{nombre}</b> — IP: {datos.get('ip')}\n⏳ Vence: {datos.get('vencimiento')}\n"
+
+
+def render_page(modo: str = VER, pagina: int = 0, prefijo: str = "", direccion: str = "", ancla: str = None):
+    """
+    Devuelve (texto, teclado) de una página del listado de clientes.
+    Solo se leen de la base los clientes de esa página: los botones piden
+    la siguiente o la anterior por clave (el nombre del borde de la página).
+    """
+    prefijo = recortar_prefijo(prefijo)
+    total = count_users(prefijo)
+    if not total:
+        texto = f"ℹ️ No hay clientes que empiecen por <b>{html.escape(prefijo)}</b>." if prefijo else "ℹ️ No hay configuraciones activas."
+        return texto, None
+
+    paginas = math.ceil(total / LISTA_POR_PAGINA)
+    pagina = min(max(pagina, 0), paginas - 1)
+    # Se pide uno de más para saber si hay otra página en esa dirección
+    if direccion == ANTERIOR and ancla is not None:
+        filas = page_users(LISTA_POR_PAGINA + 1, prefijo, antes=ancla)
+        hay_mas = len(filas) > LISTA_POR_PAGINA
+        filas = filas[-LISTA_POR_PAGINA:]
+        if not hay_mas:
+            pagina = 0  # se llegó al principio
+    elif direccion == SIGUIENTE and ancla is not None:
+        filas = page_users(LISTA_POR_PAGINA + 1, prefijo, despues=ancla)
+        hay_mas = len(filas) > LISTA_POR_PAGINA
+        filas = filas[:LISTA_POR_PAGINA]
+    else:
+        filas = page_users(LISTA_POR_PAGINA + 1, prefijo, offset=pagina * LISTA_POR_PAGINA)
+        hay_mas = len(filas) > LISTA_POR_PAGINA
+        filas = filas[:LISTA_POR_PAGINA]
+    if not filas or (direccion == ANTERIOR and not hay_mas and len(filas) < LISTA_POR_PAGINA):
+        # La página cambió mientras tanto (altas o bajas): se vuelve al principio
+        pagina, direccion = 0, ""
+        filas = page_users(LISTA_POR_PAGINA + 1, prefijo)
+        hay_mas = len(filas) > LISTA_POR_PAGINA
+        filas = filas[:LISTA_POR_PAGINA]
+
+    titulo = "📋 Configuraciones activas" if modo == VER else "❌ Selecciona una configuración para eliminar"
+    filtro = f" (nombre: {html.escape(prefijo)}…)" if prefijo else ""
+    texto = f"<b>{titulo}</b>{filtro}\n👥 {total} clientes — página {pagina + 1}/{paginas}\n"
+
+    kb = InlineKeyboardMarkup()
+    if modo == VER:
+        texto += "".join(f"\n{_linea(nombre, datos)}" for nombre, datos in filas)
+    else:
+        for nombre, datos in filas:
+            if not datos.get("ip"):
+                continue  # suspendido: se elimina por nombre
+            kb.add(InlineKeyboardButton(f"🗑 {nombre} ({datos.get('ip')})", callback_data=f"del:{datos.get('ip')}"))
+
+    navegacion = []
+    if pagina > 0:
+        navegacion.append(InlineKeyboardButton(
+            "⬅️ Anterior", callback_data=callback_pagina(modo, pagina - 1, prefijo, ANTERIOR, filas[0][0])))
+    if hay_mas or direccion == ANTERIOR:
+        navegacion.append(InlineKeyboardButton(
+            "Siguiente ➡️", callback_data=callback_pagina(modo, pagina + 1, prefijo, SIGUIENTE, filas[-1][0])))
+    if navegacion:
+        kb.row(*navegacion)
+
+    return texto, kb
+
+
+def render_busqueda(consulta: str, modo: str = VER):
+    """
+    Busca por IP exacta (índice) o por prefijo de nombre y devuelve (texto, teclado).
+    """
+    consulta = consulta.strip()
+    if es_ip(consulta):
+        encontrado = find_user_by_ip(consulta)
+        if encontrado is None:
+            return f"ℹ️ Ningún cliente tiene la IP <b>{html.escape(consulta)}</b>.", None
+        nombre, datos = encontrado
+        kb = InlineKeyboardMarkup()
+        kb.add(InlineKeyboardButton(f"🗑 Eliminar {nombre}", callback_data=f"del:{datos.get('ip')}"))
+        return f"🔎 <b>Resultado:</b>\n\n{_linea(nombre, datos)}", kb
+    return render_page(modo, 0, consulta)
+
+
+def _callback_eliminar(datos: dict, version):
+    # IP, versión y el inicio de la clave pública (la IP puede pasar a otro cliente)
+    if version is None:
+        return f"delok:{datos.get('ip')}"
+    return f"delok:{datos.get('ip')},{version},{(datos.get('public_key') or '')[:8]}"
+
+
+def parse_callback_eliminar(data: str):
+    """'delok:ip[,versión,clave]' -> (ip, versión o None, inicio de la clave o '')."""
+    ip, _, resto = data.split(":", 1)[1].partition(",")
+    version, _, clave = resto.partition(",")
+    return ip, int(version) if version else None, clave
+
+
+def render_confirmacion(nombre: str, datos: dict, version: int = None):
+    """
+    Devuelve (texto, teclado) para confirmar la eliminación de un cliente.
+    Con `version`, el botón solo elimina esa versión del cliente (ver storage.compare_and_swap).
+    """
+    kb = InlineKeyboardMarkup()
+    kb.row(
+        InlineKeyboardButton("✅ Eliminar", callback_data=_callback_eliminar(datos, version)),
+        InlineKeyboardButton("🔙 Cancelar", callback_data=callback_pagina(ELIMINAR, 0))
+    )
+    return f"⚠️ ¿Eliminar la configuración <b>{html.escape(nombre)}</b>?\n\n{_linea(nombre, datos)}", kb
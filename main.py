@@ -1,24 +1,76 @@
 # main.py
 
-from telebot import TeleBot
-from config import TOKEN
-from admin_handlers import register_admin_handlers
-from utils import schedule_expiration_check
-from storage import ensure_storage
+from bootstrap import StartupTimer, bootstrap
 
-# Inicializar el bot con el token y modo HTML
-bot = TeleBot(TOKEN, parse_mode='HTML')
 
-# Asegurar que existan los archivos necesarios
-ensure_storage()
+def main():
+    # Medir el arranque desde el principio (incluye las importaciones)
+    arranque = StartupTimer()
 
-# Registrar comandos y flujos del panel de administración
-register_admin_handlers(bot)
+    with arranque.paso("importaciones"):
+        from dispatcher import PooledTeleBot
+        from config import TOKEN
+        from admin_handlers import register_admin_handlers
+        from client_handlers import register_client_handlers
+        from utils import schedule_expiration_check
+        from storage import ensure_storage
+        from servers import get_registry
+        from stats import start_stats
+        from telemetry import start_telemetry
+        from reclaim import start_reclaimer
+        from quota import start_quotas
+        from outbox import start_dispatcher
+        from metrics import start_metrics_server
 
-# Programar verificación automática de vencimientos
-schedule_expiration_check(bot)
+    # Inicializar el bot con el token y modo HTML
+    # (el polling reparte las actualizaciones en hilos; cada usuario mantiene su orden)
+    bot = PooledTeleBot(TOKEN, parse_mode='HTML')
 
-print("✅ Bot de WireGuard iniciado correctamente.")
+    # Asegurar que existan los archivos necesarios
+    with arranque.paso("base de datos"):
+        ensure_storage()
 
-# Iniciar el bot en modo polling continuo
-bot.infinity_polling()
+    # Cargar (o reconstruir) los asignadores de IPs de cada interfaz desde la base de datos
+    with arranque.paso("asignadores de IPs"):
+        get_registry().occupancy()
+
+    # Preparar el servidor (reenvío IP, firewall) y sincronizar las interfaces (una reconciliación por interfaz)
+    bootstrap(arranque)
+
+    # Registrar comandos y flujos del panel de administración
+    register_admin_handlers(bot)
+
+    # Portal de autoservicio de los clientes (después del panel: el administrador tiene prioridad)
+    register_client_handlers(bot)
+
+    # Iniciar la cola de notificaciones (reenvía lo pendiente de la ejecución anterior)
+    start_dispatcher(bot)
+
+    # Programar verificación automática de vencimientos
+    with arranque.paso("planificador"):
+        schedule_expiration_check(bot)
+
+    # Calcular las estadísticas una vez y guardar su historial periódicamente
+    with arranque.paso("estadísticas"):
+        start_stats()
+
+    # Muestrear el tráfico de cada peer en segundo plano (las cuotas usan los mismos dumps)
+    start_quotas()
+    start_telemetry()
+
+    # Suspender periódicamente a los clientes inactivos para liberar sus IPs
+    start_reclaimer()
+
+    # Exponer /metrics en HTTP local (Prometheus)
+    start_metrics_server()
+
+    print(arranque.report())
+    print("✅ Bot de WireGuard iniciado correctamente.")
+
+    # Iniciar el bot en modo polling continuo
+    bot.infinity_polling()
+
+
+# Los procesos de los pools (QR, claves) importan este módulo: solo se arranca al ejecutarlo
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# metrics.py
+
+import bisect
+import functools
+import sys
+import threading
+import time
+from collections import Counter as _Conteo
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_HOST, METRICS_PUERTO, PERFIL_INTERVALO_SEGUNDOS
+
+# Límites (segundos) de los histogramas de latencia
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _etiquetas(etiquetas: dict) -> tuple:
+    return tuple(sorted(etiquetas.items()))
+
+
+def _formato_etiquetas(clave: tuple, extra: str = "") -> str:
+    partes = [f'{k}="{v}"' for k, v in clave]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class Counter:
+    """Contador acumulado por combinación de etiquetas."""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = _etiquetas(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def valores(self) -> dict:
+        with self._lock:
+            return dict(self._valores)
+
+    def exponer(self):
+        for clave, valor in sorted(self.valores().items()):
+            yield f"{self.nombre}{_formato_etiquetas(clave)} {valor}"
+
+
+class Histogram:
+    """
+    Histograma de latencias con límites fijos (BUCKETS), compatible con Prometheus.
+    """
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, buckets=BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.buckets = tuple(buckets)
+        self._series = {}  # etiquetas -> [conteos por bucket..., +Inf], suma
+        self._lock = threading.Lock()
+
+    def observe(self, valor: float, **etiquetas):
+        clave = _etiquetas(etiquetas)
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def series(self) -> dict:
+        with self._lock:
+            return {clave: (list(conteos), suma) for clave, (conteos, suma) in self._series.items()}
+
+    def quantile(self, q: float, **etiquetas):
+        """Cuantil aproximado (límite superior del bucket donde cae)."""
+        datos = self.series().get(_etiquetas(etiquetas))
+        if not datos or not sum(datos[0]):
+            return None
+        conteos = datos[0]
+        objetivo = q * sum(conteos)
+        acumulado = 0
+        for i, c in enumerate(conteos):
+            acumulado += c
+            if acumulado >= objetivo:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+
+    def exponer(self):
+        for clave, (conteos, suma) in sorted(self.series().items()):
+            acumulado = 0
+            for limite, c in zip(self.buckets + ("+Inf",), conteos):
+                acumulado += c
+                le = 'le="%s"' % limite
+                yield f"{self.nombre}_bucket{_formato_etiquetas(clave, le)} {acumulado}"
+            yield f"{self.nombre}_sum{_formato_etiquetas(clave)} {suma:.6f}"
+            yield f"{self.nombre}_count{_formato_etiquetas(clave)} {acumulado}"
+
+
+class Registry:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _obtener(self, clase, nombre, ayuda):
+        with self._lock:
+            metrica = self._metricas.get(nombre)
+            if metrica is None:
+                metrica = self._metricas[nombre] = clase(nombre, ayuda)
+            return metrica
+
+    def counter(self, nombre: str, ayuda: str = "") -> Counter:
+        return self._obtener(Counter, nombre, ayuda)
+
+    def histogram(self, nombre: str, ayuda: str = "") -> Histogram:
+        return self._obtener(Histogram, nombre, ayuda)
+
+    def metricas(self) -> list:
+        with self._lock:
+            return [self._metricas[n] for n in sorted(self._metricas)]
+
+    def exponer(self) -> str:
+        """Texto en formato de exposición de Prometheus."""
+        lineas = []
+        for metrica in self.metricas():
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(nombre: str, ayuda: str = "") -> Counter:
+    return REGISTRY.counter(nombre, ayuda)
+
+
+def histogram(nombre: str, ayuda: str = "") -> Histogram:
+    return REGISTRY.histogram(nombre, ayuda)
+
+
+@contextmanager
+def medir(nombre: str, ayuda: str = "", **etiquetas):
+    """
+    Mide la duración del bloque en el histograma `nombre` y cuenta los
+    errores en `<nombre>_errores_total`.
+    """
+    t = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        counter(f"{nombre}_errores_total", f"Errores en {nombre}").inc(**etiquetas)
+        raise
+    finally:
+        histogram(nombre, ayuda).observe(time.perf_counter() - t, **etiquetas)
+
+
+def medido(nombre: str, ayuda: str = "", **etiquetas):
+    """Decorador equivalente a `with medir(...)` alrededor de la función."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir(nombre, ayuda, **etiquetas):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def resumen(limite: int = 25) -> str:
+    """
+    Resumen legible para el comando /metrics del bot (HTML).
+    """
+    lineas = ["📈 <b>Métricas</b>"]
+    for metrica in REGISTRY.metricas():
+        if isinstance(metrica, Histogram):
+            for clave, (conteos, suma) in sorted(metrica.series().items()):
+                total = sum(conteos)
+                etiquetas = dict(clave)
+                p50 = metrica.quantile(0.5, **etiquetas)
+                p99 = metrica.quantile(0.99, **etiquetas)
+                nombre = metrica.nombre + (f"[{','.join(str(v) for _, v in clave)}]" if clave else "")
+                lineas.append(
+                    f"• <code>{nombre}</code>: {total} × {suma / total * 1000:.1f} ms "
+                    f"(p50 ≤ {p50 * 1000:.0f} ms, p99 ≤ {p99 * 1000:.0f} ms)"
+                )
+        else:
+            for clave, valor in sorted(metrica.valores().items()):
+                nombre = metrica.nombre + (f"[{','.join(str(v) for _, v in clave)}]" if clave else "")
+                lineas.append(f"• <code>{nombre}</code>: {valor}")
+    if len(lineas) > limite + 1:
+        lineas = lineas[:limite + 1] + [f"… y {len(lineas) - limite - 1} más (ver /metrics HTTP)"]
+    return "\n".join(lineas) if len(lineas) > 1 else "ℹ️ Aún no hay métricas."
+
+
+# Servidor HTTP local
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = REGISTRY.exponer().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(host=METRICS_HOST, puerto=METRICS_PUERTO):
+    """
+    Inicia el endpoint HTTP /metrics en segundo plano (idempotente).
+    Con puerto None no se inicia.
+    """
+    global _server
+    if puerto is None or _server is not None:
+        return _server
+    _server = ThreadingHTTPServer((host, puerto), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+# Perfilador por muestreo
+
+# Un hilo cuya pila termina en estos módulos está esperando, no trabajando
+_ARCHIVOS_EN_ESPERA = ("threading.py", "queue.py", "selectors.py")
+
+
+class SamplingProfiler:
+    """
+    Cada `intervalo` segundos toma la pila de todos los hilos y cuenta en
+    qué función está cada uno. Se activa y desactiva en caliente; apagado
+    no cuesta nada.
+    """
+
+    def __init__(self, intervalo=PERFIL_INTERVALO_SEGUNDOS):
+        self.intervalo = intervalo
+        self._conteo = _Conteo()
+        self._muestras = 0
+        self._activo = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def activo(self) -> bool:
+        return self._activo.is_set()
+
+    def start(self):
+        with self._lock:
+            self._conteo.clear()
+            self._muestras = 0
+            self._activo.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._activo.clear()
+
+    def _run(self):
+        propio = threading.get_ident()
+        while True:
+            self._activo.wait()
+            time.sleep(self.intervalo)
+            pilas = sys._current_frames()
+            with self._lock:
+                self._muestras += 1
+                for ident, frame in pilas.items():
+                    if ident == propio:
+                        continue
+                    codigo = frame.f_code
+                    if codigo.co_filename.endswith(_ARCHIVOS_EN_ESPERA):
+                        continue  # hilo dormido esperando trabajo
+                    self._conteo[f"{codigo.co_filename.rsplit('/', 1)[-1]}:{codigo.co_name}:{frame.f_lineno}"] += 1
+
+    def top(self, limite: int = 15) -> list:
+        """[(ubicación, porcentaje de muestras)] de las funciones más vistas."""
+        with self._lock:
+            if not self._muestras:
+                return []
+            return [(lugar, n * 100 / self._muestras) for lugar, n in self._conteo.most_common(limite)]
+
+
+_profiler = SamplingProfiler()
+
+
+def get_profiler() -> SamplingProfiler:
+    return _profiler
@@ -1,46 +1,76 @@
 # notifications.py
 
-from datetime import datetime, timedelta
-from threading import Thread
-from time import sleep
-from config import ADMIN_ID, AVISOS_VENCIMIENTO_HORAS
-from storage import load_users
+import math
+from datetime import datetime
 from telebot import TeleBot
+from outbox import get_dispatcher, start_dispatcher
 
-def check_expirations(bot: TeleBot):
-    """
-    Verifica periódicamente si hay configuraciones que están por vencer
-    y notifica al administrador.
-    """
-    while True:
-        try:
-            users = load_users()
-            now = datetime.utcnow()
-            for name, data in users.items():
-                vencimiento = datetime.fromisoformat(data["vencimiento"])
-                restante = vencimiento - now
+def enviar_aviso(bot: TeleBot, name: str, vencimiento: str, restante_segundos: float):
+    """
+    Notifica al administrador que una configuración está por vencer.
+    Los avisos simultáneos se agrupan en un resumen (ver outbox.py).
+    """
+    fecha = datetime.strptime(vencimiento, "%Y-%m-%d %H:%M:%S")
+    horas = max(math.ceil(restante_segundos / 3600), 0)
+    get_dispatcher().notify(
+        "aviso",
+        f"⚠️ <b>Aviso de vencimiento</b>\n\n"
+        f"📛 Cliente: <b>{name}</b>\n"
+        f"🕒 Tiempo restante: <b>{horas} horas</b>\n"
+        f"📅 Vence: <b>{fecha.strftime('%Y-%m-%d %H:%M')} UTC</b>",
+        f"<b>{name}</b> — {horas} h (vence {fecha.strftime('%Y-%m-%d %H:%M')} UTC)"
+    )
+
+def enviar_vencido(bot: TeleBot, name: str, data: dict):
+    """
+    Notifica al administrador que una configuración venció y fue eliminada.
+    """
+    get_dispatcher().notify(
+        "vencido",
+        f"⛔️ Configuración vencida: <b>{name}</b>\n🧾 IP: {data.get('ip') or data.get('ip_anterior')}",
+        f"<b>{name}</b> — IP: {data.get('ip') or data.get('ip_anterior')}"
+    )
+
+def enviar_suspendidos(candidatos):
+    """
+    Notifica al administrador los clientes suspendidos por inactividad (ver reclaim.py).
+    """
+    for c in candidatos:
+        get_dispatcher().notify(
+            "suspendido",
+            f"💤 Suspendido por inactividad: <b>{c.nombre}</b>\n🧾 IP liberada: {c.ip}\n▶️ /reanudar {c.nombre}",
+            f"<b>{c.nombre}</b> — IP: {c.ip}"
+        )
 
-                for horas in AVISOS_VENCIMIENTO_HORAS:
-                    aviso = timedelta(hours=horas)
-                    margen = timedelta(minutes=5)
+def enviar_aviso_cuota(name: str, usado: int, cuota: int, accion: str):
+    """
+    Notifica al administrador que un cliente llegó a un aviso de su cuota de datos (ver quota.py).
+    """
+    from telemetry import formato_bytes  # importación local: telemetry depende de wg_sync
+    porcentaje = usado * 100 / cuota
+    consumo = f"{formato_bytes(usado)} de {formato_bytes(cuota)} ({porcentaje:.0f}%)"
+    if usado >= cuota:
+        texto = f"🚦 Cuota agotada: <b>{name}</b>\n📶 {consumo}\n{'🐢 Velocidad limitada' if accion == 'limitar' else '💤 Suspendido'}"
+    else:
+        texto = f"📶 Cuota casi agotada: <b>{name}</b>\n{consumo}"
+    get_dispatcher().notify("cuota", texto, f"<b>{name}</b> — {consumo}")
 
-                    if abs(restante - aviso) <= margen:
-                        bot.send_message(
-                            ADMIN_ID,
-                            f"⚠️ <b>Aviso de vencimiento</b>\n\n"
-                            f"📛 Cliente: <b>{name}</b>\n"
-                            f"🕒 Tiempo restante: <b>{int(restante.total_seconds() // 3600)} horas</b>\n"
-                            f"📅 Vence: <b>{vencimiento.strftime('%Y-%m-%d %H:%M')} UTC</b>",
-                            parse_mode="HTML"
-                        )
-        except Exception as e:
-            print(f"[ERROR] En notificación de vencimiento: {e}")
-        
-        sleep(300)  # Revisión cada 5 minutos
+def enviar_solicitud_renovacion(name: str, data: dict, usuario: str):
+    """
+    Notifica al administrador que un cliente pidió renovar desde el portal (ver client_handlers.py).
+    """
+    get_dispatcher().notify(
+        "renovacion",
+        f"🔄 Solicitud de renovación: <b>{name}</b> ({usuario})\n"
+        f"📆 Plan: {data.get('plan')} — vence {data.get('vencimiento')} UTC\n"
+        f"▶️ /renovar {name}",
+        f"<b>{name}</b> — {data.get('plan')} ({usuario})"
+    )
 
 def start_notifier(bot: TeleBot):
     """
-    Inicia el sistema de notificaciones automáticas en un hilo separado.
+    Inicia el sistema de notificaciones automáticas (cola de envío y planificador de vencimientos).
     """
-    t = Thread(target=check_expirations, args=(bot,), daemon=True)
-    t.start()
+    from scheduler import start_scheduler
+    start_dispatcher(bot)
+    return start_scheduler(bot)
@@ -0,0 +1,249 @@
+# outbox.py
+
+import html
+import re
+import threading
+import time
+
+from config import (
+    ADMIN_ID,
+    GRUPO_LOGS,
+    NOTIF_VENTANA_SEGUNDOS,
+    NOTIF_TASA_CHAT,
+    NOTIF_TASA_GRUPO,
+    NOTIF_BACKOFF_MAX_SEGUNDOS
+)
+from storage import (
+    outbox_event_add,
+    outbox_events,
+    outbox_events_flush,
+    outbox_pending,
+    outbox_delete,
+    outbox_retry,
+)
+
+# Límite de Telegram por mensaje (con margen para el HTML)
+MAX_CARACTERES = 4000
+
+# Títulos de los resúmenes por tipo de evento
+TITULOS = {
+    "aviso": "⚠️ <b>Avisos de vencimiento</b>",
+    "vencido": "⛔️ <b>Configuraciones vencidas</b>",
+    "suspendido": "💤 <b>Clientes suspendidos por inactividad</b>",
+    "cuota": "📶 <b>Avisos de cuota de datos</b>",
+    "renovacion": "🔄 <b>Solicitudes de renovación</b>",
+}
+
+
+class TokenBucket:
+    """
+    Cubeta de tokens: `tasa` mensajes por segundo con ráfagas de hasta `capacidad`.
+    """
+
+    def __init__(self, tasa: float, capacidad: float, reloj=time.monotonic):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.reloj = reloj
+        self._tokens = capacidad
+        self._ultimo = reloj()
+
+    def espera(self) -> float:
+        """Toma un token si hay (devuelve 0) o devuelve los segundos que faltan."""
+        ahora = self.reloj()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.tasa
+
+
+def texto_plano(texto: str) -> str:
+    """Quita las etiquetas HTML (para reenviar un mensaje que Telegram no pudo interpretar)."""
+    return html.unescape(re.sub(r"<[^>]+>", "", texto))
+
+
+def partir(lineas, maximo=MAX_CARACTERES):
+    """Agrupa líneas en mensajes de hasta `maximo` caracteres."""
+    mensajes, actual = [], ""
+    for linea in lineas:
+        if actual and len(actual) + len(linea) + 1 > maximo:
+            mensajes.append(actual)
+            actual = ""
+        actual = f"{actual}\n{linea}" if actual else linea
+    if actual:
+        mensajes.append(actual)
+    return mensajes
+
+
+class NotificationDispatcher:
+    """
+    Cola de salida de notificaciones para el administrador (y GRUPO_LOGS).
+
+    Los eventos que llegan dentro de `ventana` segundos se agrupan por tipo
+    en un solo resumen. Cada evento se guarda en la base apenas llega (se
+    agrupa al cerrar la ventana) y los mensajes solo se borran al
+    entregarse, así nada se pierde en un reinicio.
+    Cada chat tiene su cubeta de tokens; los errores 429 respetan el
+    retry_after de Telegram y el resto se reintenta con espera exponencial.
+    Un 400 (p. ej. HTML inválido) se reintenta una vez como texto plano.
+    """
+
+    def __init__(self, ventana=NOTIF_VENTANA_SEGUNDOS, destinos=None, reloj=time.monotonic, pared=time.time):
+        self.ventana = ventana
+        self.destinos = destinos if destinos is not None else [d for d in (ADMIN_ID, GRUPO_LOGS) if d]
+        self.reloj = reloj
+        self.pared = pared
+        self.bot = None
+        self._cierre = None         # momento en que se cierra la ventana actual
+        self._buckets = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def notify(self, tipo: str, texto: str, resumen: str = None):
+        """
+        Guarda un evento. `texto` se envía tal cual si llega solo;
+        `resumen` es su línea dentro de un resumen agrupado.
+        """
+        outbox_event_add(tipo, texto, resumen or texto)
+        with self._cond:
+            if self._cierre is None:
+                self._cierre = self.reloj() + self.ventana
+            self._cond.notify()
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Los grupos y canales tienen ids negativos y un límite más bajo
+            tasa, capacidad = NOTIF_TASA_GRUPO if chat_id < 0 else NOTIF_TASA_CHAT
+            bucket = self._buckets[chat_id] = TokenBucket(tasa, capacidad, self.reloj)
+        return bucket
+
+    def _agrupar(self, eventos):
+        """Convierte los eventos de una ventana en textos (uno por evento o resúmenes)."""
+        por_tipo = {}
+        for _, tipo, texto, resumen in eventos:
+            por_tipo.setdefault(tipo, []).append((texto, resumen))
+
+        textos = []
+        for tipo, lista in por_tipo.items():
+            if len(lista) == 1:
+                textos.append(lista[0][0])
+                continue
+            titulo = f"{TITULOS.get(tipo, '🔔 <b>Notificaciones</b>')} ({len(lista)})"
+            textos.extend(partir([titulo, ""] + [f"• {resumen}" for _, resumen in lista]))
+        return textos
+
+    def flush(self):
+        """
+        Cierra la ventana actual: agrupa los eventos guardados y los
+        reemplaza por sus mensajes en una sola transacción.
+        """
+        with self._cond:
+            self._cierre = None
+        eventos = outbox_events()
+        if eventos:
+            textos = self._agrupar(eventos)
+            outbox_events_flush(eventos[-1][0], [(chat_id, texto) for chat_id in self.destinos for texto in textos])
+
+    def _enviar(self, chat_id, texto, parse_mode="HTML"):
+        self.bot.send_message(chat_id, texto, parse_mode=parse_mode)
+
+    def _enviar_o_plano(self, chat_id, texto):
+        """Envía con HTML; si Telegram lo rechaza (400), lo registra y lo envía como texto plano."""
+        try:
+            self._enviar(chat_id, texto)
+        except Exception as e:
+            if getattr(e, "error_code", None) != 400:
+                raise
+            print(f"[ERROR] Telegram rechazó la notificación para {chat_id} ({e}), se envía sin formato:\n{texto}")
+            self._enviar(chat_id, texto_plano(texto), parse_mode=None)
+
+    def deliver(self) -> float:
+        """
+        Envía los mensajes pendientes que se pueden enviar ahora.
+        Devuelve cuántos segundos esperar hasta el próximo intento.
+        """
+        proximo = 60.0
+        bloqueados = set()
+        for mensaje_id, chat_id, texto, intentos, cuando in outbox_pending():
+            if chat_id in bloqueados:
+                continue  # se respeta el orden dentro de cada chat
+            espera = cuando - self.pared()
+            if espera <= 0:
+                espera = self._bucket(chat_id).espera()
+            if espera > 0:
+                bloqueados.add(chat_id)
+                proximo = min(proximo, espera)
+                continue
+
+            try:
+                self._enviar_o_plano(chat_id, texto)
+            except Exception as e:
+                if getattr(e, "error_code", None) in (400, 403):
+                    print(f"[ERROR] Notificación descartada para {chat_id}: {e}\n{texto}")
+                    outbox_delete(mensaje_id)
+                    continue
+                parametros = (getattr(e, "result_json", None) or {}).get("parameters", {})
+                retraso = parametros.get("retry_after") or min(2 ** intentos, NOTIF_BACKOFF_MAX_SEGUNDOS)
+                print(f"[ERROR] En notificación (intento {intentos + 1}, reintento en {retraso}s): {e}")
+                outbox_retry(mensaje_id, intentos + 1, self.pared() + retraso)
+                bloqueados.add(chat_id)
+                proximo = min(proximo, retraso)
+            else:
+                outbox_delete(mensaje_id)
+        return proximo
+
+    def start(self, bot):
+        """
+        Inicia el hilo de envío (solo una vez). Los mensajes guardados de una
+        ejecución anterior se envían al arrancar.
+        """
+        with self._cond:
+            self.bot = bot
+            if self._thread is not None:
+                return
+            if outbox_events():
+                # Eventos de la ejecución anterior que no llegaron a agruparse
+                self._cierre = self.reloj()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                cierre = self._cierre
+            if cierre is not None and cierre <= self.reloj():
+                try:
+                    self.flush()
+                except Exception as e:
+                    # Los eventos siguen guardados: se vuelve a intentar agruparlos en 5 s
+                    print(f"[ERROR] Al agrupar las notificaciones: {e}")
+                    with self._cond:
+                        if self._cierre is None:
+                            self._cierre = self.reloj() + 5.0
+
+            try:
+                espera = self.deliver()
+            except Exception as e:
+                print(f"[ERROR] En la cola de notificaciones: {e}")
+                espera = 5.0
+
+            with self._cond:
+                if self._cierre is not None:
+                    espera = min(espera, max(self._cierre - self.reloj(), 0))
+                if espera > 0:
+                    self._cond.wait(timeout=espera)
+
+
+_dispatcher = NotificationDispatcher()
+
+
+def get_dispatcher() -> NotificationDispatcher:
+    return _dispatcher
+
+
+def start_dispatcher(bot):
+    """Inicia el envío de notificaciones (idempotente)."""
+    _dispatcher.start(bot)
+    return _dispatcher
@@ -0,0 +1,125 @@
+# qr_service.py
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from config import QR_WORKERS, QR_BORDE
+from artifacts import ArtifactCache, content_key, get_artifact_cache
+from metrics import counter, medir
+
+
+def render_png(config_text: str) -> bytes:
+    """
+    Dibuja el QR de un .conf y devuelve el PNG en bytes (sin tocar el disco).
+    Usa la versión mínima que admite el texto y el borde QR_BORDE.
+    """
+    import qrcode  # importación local: qrcode/PIL solo se cargan al dibujar el primer QR
+
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=QR_BORDE
+    )
+    qr.add_data(config_text)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    bio = BytesIO()
+    img.save(bio, format="PNG")
+    return bio.getvalue()
+
+
+class QRService:
+    """
+    Renderizado de QR guardado en la caché de artefactos (ver artifacts.py),
+    con el hash del .conf como clave.
+
+    Reenviar el mismo .conf no vuelve a dibujar nada. Para altas masivas,
+    render_many() reparte los QR que faltan en un pool de procesos
+    (qrcode es Python puro, los hilos no aprovecharían varios núcleos).
+    """
+
+    def __init__(self, cache: ArtifactCache = None, workers=QR_WORKERS):
+        self.workers = workers
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def cache(self) -> ArtifactCache:
+        return self._cache if self._cache is not None else get_artifact_cache()
+
+    @staticmethod
+    def _clave(config_text: str) -> str:
+        return content_key("qr", QR_BORDE, config_text)
+
+    def _get(self, clave):
+        return self.cache.get(clave)
+
+    def _put(self, clave, png):
+        self.cache.put(clave, png)
+
+    def discard(self, config_text: str):
+        """Quita de la caché el QR de un .conf (cliente eliminado o suspendido)."""
+        self.cache.discard(self._clave(config_text))
+
+    def png(self, config_text: str) -> bytes:
+        """Devuelve el PNG del QR (desde la caché si ya se dibujó)."""
+        clave = self._clave(config_text)
+        png = self._get(clave)
+        if png is None:
+            counter("qr_cache_total", "Consultas a la caché de QR").inc(resultado="fallo")
+            with medir("qr_render_segundos", "Duración del dibujo de códigos QR", modo="uno"):
+                png = render_png(config_text)
+            self._put(clave, png)
+        else:
+            counter("qr_cache_total", "Consultas a la caché de QR").inc(resultado="acierto")
+        return png
+
+    def render_many(self, textos) -> list:
+        """
+        Devuelve los PNG de varios .conf, en el mismo orden.
+        Los que no están en caché se dibujan en paralelo.
+        """
+        textos = list(textos)
+        claves = [self._clave(t) for t in textos]
+        resultado = [self._get(c) for c in claves]
+        faltan = [i for i, png in enumerate(resultado) if png is None]
+        counter("qr_cache_total", "Consultas a la caché de QR").inc(len(faltan), resultado="fallo")
+        counter("qr_cache_total", "Consultas a la caché de QR").inc(len(textos) - len(faltan), resultado="acierto")
+
+        with medir("qr_render_segundos", "Duración del dibujo de códigos QR", modo="lote"):
+            if len(faltan) > 1 and self.workers > 1:
+                pool = self._get_pool()
+                pngs = pool.map(render_png, [textos[i] for i in faltan])
+            else:
+                pngs = map(render_png, [textos[i] for i in faltan])
+
+            for i, png in zip(faltan, pngs):
+                resultado[i] = png
+                self._put(claves[i], png)
+        return resultado
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # forkserver: hacer fork de este proceso, con hilos que pueden tener un lock tomado, bloquea al hijo
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+            return self._pool
+
+
+_service = QRService()
+
+
+def get_qr_service() -> QRService:
+    return _service
+
+
+def qr_image(config_text: str) -> BytesIO:
+    """
+    Devuelve el QR como archivo en memoria, listo para bot.send_photo.
+    """
+    bio = BytesIO(_service.png(config_text))
+    bio.name = "qr.png"
+    return bio
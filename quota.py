@@ -0,0 +1,259 @@
+# quota.py
+
+import ipaddress
+import subprocess
+import threading
+
+from config import PLANES_PRECIOS, CUOTA_ACCION, CUOTA_LIMITE_KBYTES, CUOTA_AVISOS, WG_SUDO
+from storage import find_user_by_public_key, get_state, set_state, get_states, set_states, delete_states
+from metrics import counter, medido
+
+# Estado persistente, una clave por peer: "cuota_uso:<public_key>" ->
+# [bytes usados, último rx, último tx, último aviso enviado, último handshake]
+CLAVE_USO = "cuota_uso"
+PREFIJO_USO = CLAVE_USO + ":"
+
+# Estado persistente: public_key -> IP de los clientes limitados (sobrevive a un reinicio)
+CLAVE_LIMITADOS = "cuota_limitados"
+
+# Cadena propia para limitar a los clientes que agotaron su cuota
+CADENA = "WGBOT_CUOTA"
+
+LIMITAR = "limitar"
+SUSPENDER = "suspender"
+
+
+def cuota_plan(plan: str):
+    """Bytes permitidos por el plan, o None si no tiene límite."""
+    gb = PLANES_PRECIOS.get(plan, {}).get("cuota_gb")
+    return None if gb is None else int(gb * 1024 ** 3)
+
+
+def limit_rules(ips, kbytes=CUOTA_LIMITE_KBYTES) -> list:
+    """
+    Reglas de la cadena CADENA que limitan cada IP a `kbytes` KB/s en
+    cada sentido (hashlimit lleva un contador por IP).
+    """
+    reglas = []
+    for ip in sorted(ips):
+        reglas.append(f"-A {CADENA} -s {ip} -m hashlimit --hashlimit-above {kbytes}kb/s "
+                      f"--hashlimit-mode srcip --hashlimit-name cuota_sube -j DROP")
+        reglas.append(f"-A {CADENA} -d {ip} -m hashlimit --hashlimit-above {kbytes}kb/s "
+                      f"--hashlimit-mode dstip --hashlimit-name cuota_baja -j DROP")
+    return reglas
+
+
+def restore_input(ips, saltar=False) -> str:
+    """
+    Texto para `iptables-restore --noflush`: declarar la cadena la vacía,
+    así todo el conjunto se reemplaza en una sola carga atómica.
+    Con saltar=True también agrega el salto desde FORWARD (al principio).
+    """
+    lineas = ["*filter", f":{CADENA} - [0:0]"]
+    if saltar:
+        lineas.append(f"-I FORWARD 1 -j {CADENA}")
+    lineas += limit_rules(ips)
+    lineas.append("COMMIT")
+    return "\n".join(lineas) + "\n"
+
+
+class QuotaEngine:
+    """
+    Cuotas de datos por plan (ver "cuota_gb" en PLANES_PRECIOS).
+
+    Se alimenta de los mismos dumps que la telemetría (observe() recibe
+    cada Snapshot) y acumula el uso de cada peer de forma incremental.
+    Los contadores de un peer vuelven a cero si se recrea la interfaz o el
+    peer (suspensión y reanudación, reconciliación): un contador menor que
+    el anterior, un handshake que retrocede o un peer que desapareció del
+    dump cuentan como tráfico desde cero. Los últimos contadores se guardan
+    con el uso, así tampoco se pierde el tráfico entre un reinicio del bot
+    y el siguiente dump.
+
+    En cada muestra solo se revisan (y se guardan) los peers cuyo uso
+    cambió. Los avisos salen por la cola de notificaciones del
+    administrador; los clientes que agotan la cuota se limitan (una sola
+    carga de iptables-restore con todas las reglas) o se suspenden en lote.
+    """
+
+    def __init__(self, accion=CUOTA_ACCION, avisos=CUOTA_AVISOS, aplicar=None, suspender=None):
+        self.accion = accion
+        self.avisos = sorted(avisos)
+        self.aplicar = aplicar or self._iptables_restore
+        self.suspender = suspender
+        self._uso = None
+        self._limitados = None  # public_key -> IP con reglas cargadas
+        self._ausentes = set()  # peers que faltaron en el último dump
+        self._saltos = set()  # familias (4/6) con el salto desde FORWARD ya verificado
+        self._lock = threading.Lock()
+
+    def _cargar(self):
+        if self._uso is not None:
+            return
+        self._uso = {c[len(PREFIJO_USO):]: list(e) for c, e in get_states(PREFIJO_USO).items()}
+        anterior = get_state(CLAVE_USO)
+        if anterior:
+            # Formato anterior (todo el uso en una sola clave): se separa una vez
+            for clave, e in anterior.items():
+                self._uso.setdefault(clave, list(e))
+            set_states({PREFIJO_USO + c: e for c, e in self._uso.items()})
+            delete_states([CLAVE_USO])
+        self._limitados = get_state(CLAVE_LIMITADOS, {})
+
+    def _guardar(self, claves):
+        set_states({PREFIJO_USO + c: self._uso[c] for c in claves if c in self._uso})
+
+    def observe(self, snapshot):
+        """Acumula el tráfico de un dump y aplica las cuotas (la llama la telemetría)."""
+        faltantes = getattr(snapshot, "faltantes", ())
+        cambiados = set()
+        with self._lock:
+            self._cargar()
+            if not faltantes:
+                # Peers quitados de wg: si vuelven, sus contadores empiezan de cero
+                for clave in set(self._uso) - set(snapshot.peers) - self._ausentes:
+                    self._ausentes.add(clave)
+                    self._uso[clave][1:3] = [0, 0]
+                    cambiados.add(clave)
+            for clave, peer in snapshot.peers.items():
+                self._ausentes.discard(clave)
+                entrada = self._uso.get(clave)
+                if entrada is None:
+                    # Primera vez que se ve: el tráfico anterior no se cuenta
+                    self._uso[clave] = [0, peer.rx_bytes, peer.tx_bytes, 0, peer.latest_handshake]
+                    cambiados.add(clave)
+                    continue
+                entrada.extend([0] * (5 - len(entrada)))
+                usado, rx, tx, _, handshake = entrada
+                if peer.rx_bytes < rx or peer.tx_bytes < tx or peer.latest_handshake < handshake:
+                    rx = tx = 0  # contadores reiniciados (peer o interfaz recreados)
+                delta = peer.rx_bytes - rx + peer.tx_bytes - tx
+                if delta or peer.latest_handshake != handshake:
+                    entrada[:3] = [usado + delta, peer.rx_bytes, peer.tx_bytes]
+                    entrada[4] = peer.latest_handshake
+                    cambiados.add(clave)
+            self._guardar(cambiados)
+        if cambiados:
+            self.enforce(cambiados)
+
+    def usage(self, public_key: str) -> int:
+        """Bytes usados por un peer desde su alta (o desde el último reinicio de su cuota)."""
+        with self._lock:
+            self._cargar()
+            return self._uso.get(public_key, [0])[0]
+
+    def reset(self, public_key: str):
+        """Pone en cero el uso de un peer (renovación o decisión del administrador)."""
+        with self._lock:
+            self._cargar()
+            entrada = self._uso.get(public_key)
+            if entrada is not None:
+                entrada[0] = entrada[3] = 0
+                self._guardar([public_key])
+        self.enforce([public_key])
+
+    @medido("cuota_segundos", "Duración de la aplicación de cuotas")
+    def enforce(self, claves):
+        """
+        Revisa el uso de los peers `claves` contra su plan: envía los avisos
+        nuevos y limita o suspende a los que se pasaron, todo en lote.
+        """
+        from notifications import enviar_aviso_cuota  # importación local: notifications depende de outbox
+
+        avisos, excedidos, olvidados = [], [], []
+        with self._lock:
+            self._cargar()
+            limitados = dict(self._limitados)
+            for clave in claves:
+                encontrado = find_user_by_public_key(clave)
+                if encontrado is None:
+                    # Peer de un cliente que ya no existe: se olvida
+                    self._uso.pop(clave, None)
+                    self._ausentes.discard(clave)
+                    limitados.pop(clave, None)
+                    olvidados.append(PREFIJO_USO + clave)
+                    continue
+                nombre, datos = encontrado
+                cuota = cuota_plan(datos.get("plan"))
+                entrada = self._uso.get(clave)
+                if cuota is None or entrada is None:
+                    limitados.pop(clave, None)
+                    continue
+                fraccion = entrada[0] / cuota
+                nivel = max((a for a in self.avisos if fraccion >= a), default=0)
+                if nivel > entrada[3]:
+                    entrada[3] = nivel
+                    avisos.append((clave, nombre, entrada[0], cuota))
+                if fraccion >= 1 and datos.get("ip"):
+                    excedidos.append((nombre, datos))
+                    limitados[clave] = datos["ip"]
+                else:
+                    limitados.pop(clave, None)
+            if avisos:
+                self._guardar([clave for clave, *_ in avisos])
+            if olvidados:
+                delete_states(olvidados)
+
+        for _, nombre, usado, cuota in avisos:
+            enviar_aviso_cuota(nombre, usado, cuota, self.accion)
+        if self.accion == SUSPENDER:
+            self._suspender(excedidos)
+        else:
+            self._limitar(limitados)
+
+    def _limitar(self, limitados):
+        """Carga las reglas solo si cambió el conjunto de IPs limitadas."""
+        if limitados == self._limitados:
+            return
+        ips = set(limitados.values())
+        if ips != set(self._limitados.values()):
+            self.aplicar(ips)
+            counter("cuota_cargas_total", "Cargas de reglas de limitación por cuota").inc()
+        self._limitados = limitados
+        set_state(CLAVE_LIMITADOS, limitados)
+
+    def _suspender(self, excedidos):
+        if not excedidos:
+            return
+        from reclaim import Candidato, get_reclaimer  # importación local: reclaim depende de wg_sync
+        from servers import interfaz_de
+
+        candidatos = [Candidato(n, d["ip"], d.get("interfaz") or interfaz_de(d["ip"]), d["public_key"], 0)
+                      for n, d in excedidos]
+        (self.suspender or get_reclaimer().suspend)(candidatos)
+
+    def limitados(self) -> set:
+        return set((self._limitados or {}).values())
+
+    def _iptables_restore(self, ips):
+        """
+        Reemplaza las reglas de la cadena con un único *tables-restore por
+        familia de IP. La cadena y el salto desde FORWARD solo se crean al
+        limitar la primera IP de esa familia.
+        """
+        sudo = ["sudo"] if WG_SUDO else []
+        for version, binario in ((4, "iptables"), (6, "ip6tables")):
+            propias = [ip for ip in ips if ipaddress.ip_address(ip).version == version]
+            saltar = False
+            if version not in self._saltos:
+                existe = subprocess.run(sudo + [binario, "-C", "FORWARD", "-j", CADENA], capture_output=True)
+                if existe.returncode != 0 and not propias:
+                    continue  # nunca se limitó esta familia: no hay nada que vaciar
+                saltar = existe.returncode != 0
+            subprocess.run(sudo + [f"{binario}-restore", "--noflush"], input=restore_input(propias, saltar),
+                           text=True, check=True, capture_output=True)
+            self._saltos.add(version)
+
+
+_engine = QuotaEngine()
+
+
+def get_quota_engine() -> QuotaEngine:
+    return _engine
+
+
+def start_quotas():
+    """Conecta las cuotas a los dumps de la telemetría (cada muestreo las aplica)."""
+    from telemetry import get_telemetry
+    get_telemetry().subscribe(_engine.observe)
+    return _engine
@@ -0,0 +1,256 @@
+# reclaim.py
+
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from config import PLANES_PRECIOS, RECUPERAR_INTERVALO_SEGUNDOS, RECUPERAR_INACTIVO_SEGUNDOS, RECUPERAR_AUTOMATICO_PLANES
+from storage import load_users, get_user, update_user, get_state, set_state, transaction
+from servers import get_registry, interfaz_de
+from ip_allocator import allocator_for_ip, get_allocator
+from wg_sync import for_each_interface, get_snapshot, apply_changes, request_sync
+from scheduler import parse_vencimiento
+from stats import get_stats
+from metrics import counter, medido
+
+# Estado persistente: último handshake visto por clave pública (sobrevive a reinicios de la interfaz)
+CLAVE_VISTOS = "recuperar_handshakes"
+
+
+class Candidato(NamedTuple):
+    """Cliente que superó el tiempo sin handshake de su plan."""
+    nombre: str
+    ip: str
+    interfaz: str
+    public_key: str
+    handshake: int  # último handshake visto, 0 = nunca
+
+
+def inicio_plan(datos: dict) -> float:
+    """Comienzo del plan (vencimiento menos la duración del plan), 0 si no se puede saber."""
+    plan = PLANES_PRECIOS.get(datos.get("plan"))
+    if plan is None or not datos.get("vencimiento"):
+        return 0
+    return parse_vencimiento(datos["vencimiento"]) - plan.get("dias", 0) * 86400 - plan.get("horas", 0) * 3600
+
+
+class IdleReclaimer:
+    """
+    Recupera las IPs de los clientes que no usan su configuración.
+
+    Cruza el último handshake de cada peer (`wg show <interfaz> dump`) con
+    los clientes guardados y marca a los que pasaron el umbral de su plan
+    sin conectarse (contando desde el alta o la última reactivación si
+    nunca se conectaron). Suspender quita el peer de la interfaz y
+    devuelve la IP al asignador, pero conserva el registro: resume() lo
+    reactiva, con la misma IP si sigue libre.
+
+    Los handshakes vistos se guardan en la base, así un reinicio de la
+    interfaz (que los pone en 0) no hace parecer inactivos a todos.
+
+    La ronda automática es más prudente que /recuperar: de los planes que
+    no están en `automaticos` (los pagos) solo toma a los que nunca se
+    conectaron, así un cliente que pagó no se encuentra sin túnel al volver.
+    """
+
+    def __init__(self, umbrales=RECUPERAR_INACTIVO_SEGUNDOS, reloj=time.time, leer=get_snapshot,
+                 automaticos=RECUPERAR_AUTOMATICO_PLANES):
+        self.umbrales = umbrales
+        self.automaticos = automaticos
+        self.reloj = reloj
+        self.leer = leer
+        self._vistos = None  # public_key -> último handshake
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _leer_handshakes(self) -> set:
+        """Actualiza los handshakes vistos y devuelve las interfaces que se pudieron leer."""
+        if self._vistos is None:
+            self._vistos = dict(get_state(CLAVE_VISTOS, {}))
+        leidas = set()
+        for interfaz, snap in for_each_interface(self.leer).items():
+            if isinstance(snap, Exception):
+                print(f"⚠️ No se pudo leer {interfaz}, se omiten sus clientes: {snap}")
+                continue
+            leidas.add(interfaz)
+            for clave, peer in snap.peers.items():
+                if peer.latest_handshake > self._vistos.get(clave, 0):
+                    self._vistos[clave] = peer.latest_handshake
+        return leidas
+
+    def scan(self, automatico=False) -> list:
+        """
+        Devuelve los [Candidato] a suspender, del más inactivo al menos.
+        Solo se evalúan los clientes de las interfaces que se pudieron leer.
+        Con automatico=True se omiten los de otros planes que ya se conectaron.
+        """
+        with self._lock:
+            leidas = self._leer_handshakes()
+            usuarios = load_users()
+            ahora = self.reloj()
+            claves = set()
+            candidatos = []
+            for nombre, datos in usuarios.items():
+                clave, ip = datos.get("public_key"), datos.get("ip")
+                claves.add(clave)
+                umbral = self.umbrales.get(datos.get("plan"))
+                if not clave or not ip or umbral is None:
+                    continue
+                interfaz = datos.get("interfaz") or interfaz_de(ip)
+                if interfaz not in leidas:
+                    continue
+                handshake = self._vistos.get(clave, 0)
+                if automatico and handshake and datos.get("plan") not in self.automaticos:
+                    continue
+                ultimo = max(handshake, inicio_plan(datos), datos.get("reanudado", 0))
+                if ahora - ultimo >= umbral:
+                    candidatos.append(Candidato(nombre, ip, interfaz, clave, handshake))
+
+            # Solo se recuerdan las claves de clientes existentes
+            self._vistos = {c: ts for c, ts in self._vistos.items() if c in claves}
+            set_state(CLAVE_VISTOS, self._vistos)
+        return sorted(candidatos, key=lambda c: c.handshake)
+
+    @medido("recuperar_segundos", "Duración de la recuperación de IPs", op="suspender")
+    def suspend(self, candidatos) -> list:
+        """
+        Suspende varios clientes de una vez: una transacción para los
+        registros, un `wg set` por interfaz y una escritura por asignador.
+        Se omiten los que cambiaron desde el escaneo. Devuelve los Candidato suspendidos.
+        """
+        ahora = int(self.reloj())
+        suspendidos = []
+        claves_privadas = {}
+        with transaction():
+            for candidato in candidatos:
+                def suspender(datos, ip=candidato.ip):
+                    if datos.get("ip") != ip or datos.get("suspendido"):
+                        return None
+                    datos["ip"] = None
+                    datos["ip_anterior"] = ip
+                    datos["suspendido"] = ahora
+                    return datos
+
+                datos = update_user(candidato.nombre, suspender)
+                if datos is not None:
+                    suspendidos.append(candidato)
+                    claves_privadas[candidato.nombre] = datos.get("private_key")
+        if not suspendidos:
+            return []
+
+        # Importación local: wgconf carga las plantillas y la caché de artefactos
+        from wgconf import discard_artifacts
+        for candidato in suspendidos:
+            discard_artifacts(candidato.nombre, claves_privadas[candidato.nombre], candidato.ip)
+            get_stats().on_suspend(candidato.nombre)
+
+        por_interfaz = {}
+        for candidato in suspendidos:
+            por_interfaz.setdefault(candidato.interfaz, []).append(candidato.public_key)
+        for interfaz, claves in por_interfaz.items():
+            try:
+                apply_changes({}, claves, interfaz)
+            except Exception as e:
+                # Un peer que quedó no molesta: la IP pasa al nuevo cliente y la reconciliación lo quita
+                print(f"⚠️ No se pudieron quitar los peers suspendidos de {interfaz}: {e}")
+                request_sync(claves)
+
+        registro = get_registry()
+        registro.release([(registro.for_ip(c.ip), c.ip) for c in suspendidos if registro.for_ip(c.ip)])
+        counter("clientes_suspendidos_total", "Clientes suspendidos por inactividad").inc(len(suspendidos))
+        return suspendidos
+
+    def run_once(self, automatico=False) -> list:
+        """Escanea y suspende a todos los candidatos. Devuelve los suspendidos."""
+        return self.suspend(self.scan(automatico))
+
+    @medido("recuperar_segundos", "Duración de la recuperación de IPs", op="reanudar")
+    def resume(self, nombre: str) -> dict:
+        """
+        Reactiva un cliente suspendido: recupera su IP anterior si sigue libre
+        (su .conf sigue sirviendo) o le asigna otra, y agrega el peer sin
+        esperar a la sincronización. Devuelve sus datos ("ip_cambiada" indica
+        si hay que reenviarle el .conf). Lanza ValueError si no está suspendido.
+        """
+        actual = get_user(nombre)
+        if actual is None:
+            raise ValueError("⚠️ Cliente no encontrado.")
+        if not actual.get("suspendido"):
+            raise ValueError("ℹ️ El cliente no está suspendido.")
+
+        # Importación local: utils y generator cargan QR y plantillas
+        from utils import get_next_ip, release_ip, guardar_archivo
+        from generator import ruta_config
+        from wgconf import render_config
+
+        anterior = actual.get("ip_anterior")
+        allocator = allocator_for_ip(anterior) if anterior else None
+        ip = anterior if allocator is not None and allocator.claim(anterior) else get_next_ip()
+        conf_anterior = actual.get("conf_path")
+
+        def reanudar(datos):
+            if not datos.get("suspendido"):
+                return None
+            datos.pop("suspendido")
+            datos.pop("ip_anterior", None)
+            datos["ip"] = ip
+            datos["interfaz"] = interfaz_de(ip)
+            datos["reanudado"] = int(self.reloj())
+            if ip != anterior:
+                datos["conf_path"] = ruta_config(nombre, ip)
+            return datos
+
+        datos = update_user(nombre, reanudar)
+        if datos is None:
+            release_ip(ip)
+            raise ValueError("ℹ️ El cliente ya no está suspendido.")
+
+        if ip != anterior:
+            # La IP está en el .conf: se regenera y se borra el de la IP anterior
+            guardar_archivo(datos["conf_path"], render_config(datos["private_key"], ip))
+            if conf_anterior and conf_anterior != datos["conf_path"] and os.path.exists(conf_anterior):
+                os.remove(conf_anterior)
+        try:
+            apply_changes({datos["public_key"]: f"{ip}{get_allocator(datos['interfaz']).sufijo}"}, [], datos["interfaz"])
+        except Exception as e:
+            # El cliente ya está activo en la base: la reconciliación agrega el peer
+            print(f"⚠️ No se pudo agregar el peer de {nombre} a {datos['interfaz']}: {e}")
+            request_sync()
+        get_stats().on_resume(nombre)
+        counter("clientes_reanudados_total", "Clientes reactivados tras una suspensión").inc()
+        return dict(datos, ip_cambiada=ip != anterior)
+
+    def start(self, intervalo=RECUPERAR_INTERVALO_SEGUNDOS, avisar=None):
+        """
+        Inicia la recuperación periódica (solo una vez). avisar(suspendidos)
+        se llama tras cada ronda que suspendió a alguien.
+        """
+        if not intervalo or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(intervalo, avisar), daemon=True)
+        self._thread.start()
+
+    def _run(self, intervalo, avisar):
+        while True:
+            time.sleep(intervalo)
+            try:
+                suspendidos = self.run_once(automatico=True)
+                if suspendidos and avisar is not None:
+                    avisar(suspendidos)
+            except Exception as e:
+                print(f"⚠️ Error al recuperar IPs de clientes inactivos: {e}")
+
+
+_reclaimer = IdleReclaimer()
+
+
+def get_reclaimer() -> IdleReclaimer:
+    return _reclaimer
+
+
+def start_reclaimer():
+    """Inicia la suspensión periódica de clientes inactivos, avisando al administrador."""
+    from notifications import enviar_suspendidos  # importación local: notifications depende de outbox
+    _reclaimer.start(avisar=enviar_suspendidos)
+    return _reclaimer
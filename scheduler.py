@@ -0,0 +1,236 @@
+# scheduler.py
+
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timezone
+
+from config import AVISOS_VENCIMIENTO_HORAS
+from storage import CAS_INTENTOS, load_users, get_user_version, update_user, pop_user
+from utils import delete_conf, release_ip
+from notifications import enviar_aviso, enviar_vencido
+from wg_sync import request_sync
+from wgconf import discard_artifacts
+
+# Evento de vencimiento real (los avisos usan las horas como identificador)
+VENCIDO = "vencido"
+
+
+def parse_vencimiento(texto: str) -> float:
+    """
+    Convierte la fecha guardada ('%Y-%m-%d %H:%M:%S', UTC) a timestamp.
+    """
+    try:
+        fecha = datetime.strptime(texto, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        fecha = datetime.fromisoformat(texto)
+    return fecha.replace(tzinfo=timezone.utc).timestamp()
+
+
+class ExpiryScheduler:
+    """
+    Planificador de avisos y vencimientos basado en una cola de prioridad.
+
+    Cada cliente aporta un evento por aviso de AVISOS_VENCIMIENTO_HORAS y
+    uno de vencimiento. El hilo duerme hasta el próximo evento y lo dispara
+    una sola vez; los avisos enviados quedan guardados en el registro del
+    cliente ("avisos_enviados") para no repetirlos tras un reinicio.
+    Altas y bajas actualizan la cola sin recorrer todos los clientes.
+    """
+
+    def __init__(self, reloj=time.time):
+        self.reloj = reloj
+        self.bot = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._vigentes = {}  # nombre -> vencimiento programado (invalida entradas viejas)
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, nombre: str, datos: dict):
+        """
+        Programa (o reprograma) los eventos de un cliente.
+        """
+        vencimiento = datos.get("vencimiento")
+        if not vencimiento:
+            return
+        ts = parse_vencimiento(vencimiento)
+        enviados = set(datos.get("avisos_enviados", []))
+
+        with self._cond:
+            self._vigentes[nombre] = vencimiento
+            for horas in sorted(AVISOS_VENCIMIENTO_HORAS, reverse=True):
+                if horas not in enviados:
+                    heapq.heappush(self._heap, (ts - horas * 3600, next(self._seq), nombre, vencimiento, horas))
+            heapq.heappush(self._heap, (ts, next(self._seq), nombre, vencimiento, VENCIDO))
+            self._cond.notify()
+
+    def cancel(self, nombre: str):
+        """
+        Anula los eventos pendientes de un cliente (se descartan al salir de la cola).
+        """
+        with self._cond:
+            self._vigentes.pop(nombre, None)
+
+    def load(self):
+        """
+        Llena la cola a partir de la base de datos (solo al iniciar).
+        """
+        for nombre, datos in load_users().items():
+            self.schedule(nombre, datos)
+
+    def reload(self):
+        """
+        Vacía la cola y la vuelve a llenar desde la base (tras restaurar un respaldo).
+        """
+        with self._cond:
+            self._heap.clear()
+            self._vigentes.clear()
+        self.load()
+
+    def pendientes(self) -> int:
+        with self._cond:
+            return len(self._vigentes)
+
+    def start(self, bot):
+        """
+        Inicia el hilo del planificador (solo una vez).
+        """
+        with self._cond:
+            self.bot = bot
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _pop_due(self):
+        """
+        Extrae el primer evento vencido (con self._cond tomado). Devuelve
+        (evento, None) o (None, segundos hasta el próximo; None si no hay ninguno).
+        """
+        while self._heap:
+            cuando, _, nombre, vencimiento, evento = self._heap[0]
+            if self._vigentes.get(nombre) != vencimiento:
+                heapq.heappop(self._heap)
+                continue
+            espera = cuando - self.reloj()
+            if espera > 0:
+                return None, espera
+            heapq.heappop(self._heap)
+            if evento == VENCIDO:
+                self._vigentes.pop(nombre, None)
+            return (cuando, nombre, vencimiento, evento), None
+        return None, None
+
+    def _next_due(self):
+        """
+        Espera hasta que venza el primer evento de la cola y lo extrae.
+        """
+        with self._cond:
+            while True:
+                evento, espera = self._pop_due()
+                if evento is not None:
+                    return evento
+                self._cond.wait(timeout=espera)
+
+    def _process(self, nombre, vencimiento, evento):
+        try:
+            if evento == VENCIDO:
+                self._expire(nombre, vencimiento)
+            else:
+                self._warn(nombre, vencimiento, evento)
+        except Exception as e:
+            print(f"❌ Error en el planificador de vencimientos ({nombre}): {e}")
+
+    def _run(self):
+        while True:
+            _, nombre, vencimiento, evento = self._next_due()
+            self._process(nombre, vencimiento, evento)
+
+    def run_pending(self) -> list:
+        """
+        Procesa en el hilo actual los eventos ya vencidos según self.reloj(),
+        sin el hilo del planificador (simulaciones con reloj virtual).
+        Devuelve [(cuando, nombre, evento)] en el orden en que se procesaron.
+        """
+        procesados = []
+        while True:
+            with self._cond:
+                evento, _ = self._pop_due()
+            if evento is None:
+                return procesados
+            cuando, nombre, vencimiento, tipo = evento
+            self._process(nombre, vencimiento, tipo)
+            procesados.append((cuando, nombre, tipo))
+
+    def _warn(self, nombre, vencimiento, horas):
+        def marcar(datos):
+            # Se evalúa sobre la última versión del cliente (puede haber cambiado en paralelo)
+            enviados = set(datos.get("avisos_enviados", []))
+            if datos.get("vencimiento") != vencimiento or horas in enviados:
+                return None
+            enviados.add(horas)
+            datos["avisos_enviados"] = sorted(enviados, reverse=True)
+            return datos
+
+        if update_user(nombre, marcar) is None:
+            return
+
+        restante = parse_vencimiento(vencimiento) - self.reloj()
+        # Si también venció un aviso más cercano (p. ej. tras estar apagado), solo se envía ese
+        omitir = any(h < horas and restante <= h * 3600 for h in AVISOS_VENCIMIENTO_HORAS)
+
+        if not omitir and self.bot is not None:
+            enviar_aviso(self.bot, nombre, vencimiento, restante)
+
+    def _expire(self, nombre, vencimiento=None):
+        # Solo se borra la versión leída; si alguien la modificó en el medio se
+        # vuelve a leer (si lo renovaron, ya tiene otro vencimiento en la cola)
+        for _ in range(CAS_INTENTOS):
+            actual = get_user_version(nombre)
+            if actual is None:
+                return
+            datos, version = actual
+            if vencimiento is not None and datos.get("vencimiento") != vencimiento:
+                return
+            if pop_user(nombre, version) is not None:
+                break
+        else:
+            return
+        delete_conf(nombre)
+        discard_artifacts(nombre, datos.get("private_key"), datos.get("ip"))
+        release_ip(datos.get("ip"))
+        from stats import get_stats  # importación local: stats depende de scheduler
+        get_stats().on_expire(nombre)
+        # Quita el peer de su interfaz (los vencimientos seguidos se agrupan en una sola llamada)
+        request_sync([datos.get("public_key")])
+        if self.bot is not None:
+            enviar_vencido(self.bot, nombre, datos)
+
+
+_scheduler = ExpiryScheduler()
+
+
+def get_scheduler() -> ExpiryScheduler:
+    return _scheduler
+
+
+def start_scheduler(bot):
+    """
+    Carga la cola desde la base de datos e inicia el hilo (idempotente).
+    """
+    if _scheduler._thread is None:
+        _scheduler.load()
+    _scheduler.start(bot)
+    return _scheduler
+
+
+def schedule_client(nombre: str, datos: dict):
+    """Añade los eventos de un cliente nuevo o renovado."""
+    _scheduler.schedule(nombre, datos)
+
+
+def cancel_client(nombre: str):
+    """Quita los eventos de un cliente eliminado."""
+    _scheduler.cancel(nombre)
@@ -0,0 +1,152 @@
+# servers.py
+
+import ipaddress
+from typing import NamedTuple, Optional
+
+from config import SERVIDORES
+
+
+class Server(NamedTuple):
+    """
+    Una interfaz WireGuard administrada por el bot (ver SERVIDORES en config.py).
+    """
+    interfaz: str
+    clave_publica: str
+    endpoint: str
+    puerto: int
+    subred: str
+    capacidad: Optional[int] = None  # máximo de clientes; None = toda la subred
+
+
+def parse_servers(lista) -> list:
+    """
+    Convierte SERVIDORES en [Server] y valida que las interfaces no se
+    repitan y que las subredes no se solapen (la IP identifica la interfaz).
+    """
+    servidores = [Server(**datos) for datos in lista]
+    if not servidores:
+        raise ValueError("❌ SERVIDORES está vacío: se necesita al menos una interfaz.")
+
+    redes = {}
+    for servidor in servidores:
+        if servidor.interfaz in redes:
+            raise ValueError(f"❌ Interfaz repetida en SERVIDORES: {servidor.interfaz}")
+        red = ipaddress.ip_network(servidor.subred, strict=False)
+        for interfaz, otra in redes.items():
+            if red.version == otra.version and red.overlaps(otra):
+                raise ValueError(f"❌ Las subredes de {interfaz} y {servidor.interfaz} se solapan.")
+        redes[servidor.interfaz] = red
+    return servidores
+
+
+class ServerRegistry:
+    """
+    Registro de interfaces/servidores. El primero es la interfaz por defecto
+    (la de los clientes creados antes de que existiera SERVIDORES).
+
+    Cada interfaz tiene su propio asignador de IPs y su parte de la base de
+    datos; los clientes nuevos van a la interfaz con menor ocupación.
+    """
+
+    def __init__(self, servidores=SERVIDORES):
+        self.servers = parse_servers(servidores)
+        self._por_interfaz = {s.interfaz: s for s in self.servers}
+        self._redes = [(ipaddress.ip_network(s.subred, strict=False), s) for s in self.servers]
+
+    @property
+    def default(self) -> Server:
+        return self.servers[0]
+
+    def interfaces(self) -> list:
+        return [s.interfaz for s in self.servers]
+
+    def get(self, interfaz: str = None) -> Server:
+        """Servidor de una interfaz (None = la interfaz por defecto)."""
+        if interfaz is None:
+            return self.default
+        try:
+            return self._por_interfaz[interfaz]
+        except KeyError:
+            raise ValueError(f"❌ Interfaz desconocida: {interfaz}") from None
+
+    def for_ip(self, ip: str) -> Optional[Server]:
+        """Servidor cuya subred contiene la IP (con o sin prefijo), o None."""
+        try:
+            addr = ipaddress.ip_address(ip.split("/", 1)[0])
+        except ValueError:
+            return None
+        for red, servidor in self._redes:
+            if addr in red:
+                return servidor
+        return None
+
+    def occupancy(self) -> dict:
+        """{interfaz: (IPs en uso, capacidad)}."""
+        from ip_allocator import get_allocator  # importación local: ip_allocator depende de servers
+        ocupacion = {}
+        for servidor in self.servers:
+            allocator = get_allocator(servidor.interfaz)
+            ocupacion[servidor.interfaz] = (allocator.en_uso, allocator.capacidad)
+        return ocupacion
+
+    def distribute(self, cantidad: int) -> dict:
+        """
+        Reparte `cantidad` clientes nuevos entre las interfaces, cada uno a la
+        de menor ocupación en ese momento. Devuelve {interfaz: cantidad}.
+        """
+        ocupacion = {i: list(v) for i, v in self.occupancy().items()}
+        reparto = {}
+        for _ in range(cantidad):
+            libres = [(en_uso / capacidad, i) for i, (en_uso, capacidad) in ocupacion.items() if en_uso < capacidad]
+            if not libres:
+                total = sum(c - u for u, c in self.occupancy().values())
+                raise RuntimeError(f"🚫 Solo quedan {total} IPs libres entre todas las interfaces.")
+            interfaz = min(libres)[1]
+            ocupacion[interfaz][0] += 1
+            reparto[interfaz] = reparto.get(interfaz, 0) + 1
+        return reparto
+
+    def reserve(self, cantidad: int = 1) -> list:
+        """
+        Reserva IPs para `cantidad` clientes nuevos repartidas por ocupación.
+        Devuelve [(Server, ip)] (una reserva por interfaz); si alguna falla no
+        queda nada reservado.
+        """
+        from ip_allocator import get_allocator
+
+        reservas = []
+        try:
+            for interfaz, n in self.distribute(cantidad).items():
+                ips = get_allocator(interfaz).reserve_many(n)
+                reservas.extend((self._por_interfaz[interfaz], ip) for ip in ips)
+        except Exception:
+            self.release(reservas)
+            raise
+        return reservas
+
+    def release(self, reservas):
+        """Devuelve las IPs de [(Server, ip)] a sus asignadores (una escritura por interfaz)."""
+        from ip_allocator import get_allocator
+
+        por_interfaz = {}
+        for servidor, ip in reservas:
+            por_interfaz.setdefault(servidor.interfaz, []).append(ip)
+        for interfaz, ips in por_interfaz.items():
+            get_allocator(interfaz).release_many(ips)
+
+
+_registry = None
+
+
+def get_registry() -> ServerRegistry:
+    """Registro global de servidores, creado desde config.SERVIDORES en el primer uso."""
+    global _registry
+    if _registry is None:
+        _registry = ServerRegistry()
+    return _registry
+
+
+def interfaz_de(ip: str) -> str:
+    """Interfaz a la que pertenece una IP de cliente (la por defecto si no cae en ninguna subred)."""
+    registro = get_registry()
+    return (registro.for_ip(ip) or registro.default).interfaz
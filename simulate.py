@@ -0,0 +1,491 @@
+# simulate.py
+
+"""
+Simulación offline del bot para pruebas de carga y de larga duración,
+sin Telegram, sin WireGuard y sin root.
+
+Reemplaza `wg` por interfaces en memoria con latencias de un `wg` real
+y Telegram por un bot que solo registra los envíos (con la latencia de
+la API). Un guion de actualizaciones del administrador (sintético o
+grabado) se entrega a los handlers registrados mientras un reloj
+virtual avanza días de altas, avisos, vencimientos y recuperación de
+IPs en minutos. El tráfico simulado alimenta la telemetría y las cuotas
+(sin iptables: las cargas de reglas solo se cuentan) y las notificaciones
+se entregan por la cola de salida. Al final informa latencia,
+rendimiento y corrección (vencimientos a tiempo, interfaces
+sincronizadas con la base, IPs sin duplicar). No cubre el portal de
+clientes ni los respaldos.
+
+    python simulate.py                            # 3 días, 200 altas por día
+    python simulate.py --dias 30 --altas 1000 -i 4
+    python simulate.py --guion sesion.jsonl -o sim.json
+
+Cada línea de un guion es {"t": segundos desde el inicio, "texto": "..."}
+o {"t": ..., "callback": "lst:ver:1:"}; "usuario" es opcional (ADMIN_ID).
+"""
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from datetime import datetime
+from types import SimpleNamespace
+
+from bench import preparar_entorno, percentil, version
+
+PLANES_SIMULADOS = (("Free (5 horas)", 0.5), ("15 días", 0.25), ("30 días", 0.25))
+
+
+class VirtualClock:
+    """Reloj que empieza en la hora real y solo avanza con advance()."""
+
+    def __init__(self, inicio=None):
+        self.inicio = time.time() if inicio is None else inicio
+        self.transcurrido = 0.0
+
+    def __call__(self) -> float:
+        return self.inicio + self.transcurrido
+
+    def advance(self, segundos: float):
+        self.transcurrido += segundos
+
+
+def virtual_datetime(reloj):
+    """Clase datetime cuyo utcnow() sigue al reloj virtual (para los módulos que fechan vencimientos)."""
+
+    class VirtualDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime.utcfromtimestamp(reloj())
+
+    return VirtualDatetime
+
+
+class FakeWireGuard:
+    """
+    Interfaces WireGuard en memoria que reemplazan a wg_sync.run_wg.
+
+    Atiende `show <if> dump` y `set <if> peer <k> allowed-ips <ips>|remove`
+    con una latencia fija más un costo por peer, como el `wg` real. Una
+    fracción de los peers (según su clave) "se conecta": tiene handshake
+    reciente y tráfico que crece con el reloj virtual.
+    """
+
+    def __init__(self, reloj, latencia_ms=2.0, por_peer_us=1.0, conectados=0.8):
+        self.reloj = reloj
+        self.latencia = latencia_ms / 1000
+        self.por_peer = por_peer_us / 1_000_000
+        self.conectados = conectados
+        self.interfaces = {}  # interfaz -> {public_key: (allowed_ips, alta)}
+        self.llamadas = Counter()
+        self.segundos = 0.0
+        self._lock = threading.Lock()
+
+    def _conectado(self, clave):
+        return zlib.crc32(clave.encode()) % 1000 < self.conectados * 1000
+
+    def _dump(self, peers):
+        ahora = int(self.reloj())
+        lineas = ["priv\tpub\t51820\toff"]
+        for clave, (ips, alta) in peers.items():
+            if self._conectado(clave):
+                trafico = int((ahora - alta) * 2000)
+                lineas.append(f"{clave}\t(none)\t203.0.113.7:51820\t{ips}\t{ahora - 30}\t{trafico}\t{trafico * 8}\t25")
+            else:
+                lineas.append(f"{clave}\t(none)\t(none)\t{ips}\t0\t0\t0\toff")
+        return "\n".join(lineas) + "\n"
+
+    def __call__(self, args, input_text=None, sudo=False):
+        comando, interfaz = args[0], args[1]
+        with self._lock:
+            peers = self.interfaces.setdefault(interfaz, {})
+            salida = ""
+            if comando == "show":
+                salida = self._dump(peers)
+            elif comando == "set":
+                i = 2
+                while i < len(args):
+                    clave = args[i + 1]
+                    if args[i + 2] == "remove":
+                        peers.pop(clave, None)
+                        i += 3
+                    else:
+                        alta = peers.get(clave, (None, self.reloj()))[1]
+                        peers[clave] = (args[i + 3], alta)
+                        i += 4
+            else:
+                raise RuntimeError(f"❌ wg simulado: comando no soportado: {comando}")
+            demora = self.latencia + self.por_peer * len(peers)
+            self.llamadas[comando] += 1
+            self.segundos += demora
+        time.sleep(demora)
+        return salida
+
+    def peers(self, interfaz) -> dict:
+        with self._lock:
+            return {k: ips for k, (ips, _) in self.interfaces.get(interfaz, {}).items()}
+
+
+def crear_bot(latencia_ms):
+    """
+    PooledTeleBot con los envíos a Telegram simulados: cada llamada espera
+    `latencia_ms` y se registra. Mide la latencia de cada actualización
+    (de la llegada al final del handler) por tipo.
+    """
+    from telebot import TeleBot
+    from dispatcher import PooledTeleBot, update_key
+
+    class SimBot(PooledTeleBot):
+        def __init__(self):
+            super().__init__("123456:SIMULACION")
+            self.latencia = latencia_ms / 1000
+            self.enviados = Counter()
+            self.latencias = {}   # tipo -> [segundos]
+            self.sin_respuesta = 0
+            self.errores = []
+            self._mensajes = 0
+            self._lock = threading.Lock()
+            self._local = threading.local()  # envíos de la actualización que atiende cada hilo
+
+        def _api(self, metodo):
+            time.sleep(self.latencia)
+            self._local.enviados = getattr(self._local, "enviados", 0) + 1
+            with self._lock:
+                self.enviados[metodo] += 1
+                self._mensajes += 1
+                return SimpleNamespace(message_id=self._mensajes)
+
+        def send_message(self, *args, **kwargs):
+            return self._api("send_message")
+
+        def send_document(self, *args, **kwargs):
+            return self._api("send_document")
+
+        def send_photo(self, *args, **kwargs):
+            return self._api("send_photo")
+
+        def reply_to(self, *args, **kwargs):
+            return self._api("send_message")
+
+        def edit_message_text(self, *args, **kwargs):
+            return self._api("edit_message_text")
+
+        def answer_callback_query(self, *args, **kwargs):
+            return self._api("answer_callback_query")
+
+        def process_new_updates(self, updates):
+            for update in updates:
+                self.dispatch_pool.put(update_key(update), self._atender, update, time.perf_counter())
+
+        def _atender(self, update, llegada):
+            # Se cuentan solo los envíos de este hilo: los de otras actualizaciones
+            # o de la cola de notificaciones no cuentan como respuesta
+            self._local.enviados = 0
+            try:
+                TeleBot.process_new_updates(self, [update])
+            except Exception as e:
+                self.errores.append(f"{tipo_actualizacion(update)}: {e}")
+            self.latencias.setdefault(tipo_actualizacion(update), []).append(time.perf_counter() - llegada)
+            if not self._local.enviados:
+                with self._lock:
+                    self.sin_respuesta += 1
+
+    return SimBot()
+
+
+def tipo_actualizacion(update) -> str:
+    """Tipo para agrupar latencias: comando, botón, respuesta a un paso o callback."""
+    if update.callback_query is not None:
+        return "callback:" + update.callback_query.data.split(":", 1)[0]
+    texto = update.message.text or ""
+    if texto.startswith("/"):
+        return texto.split()[0]
+    if texto[:1] and not texto[:1].isalnum():
+        return texto.split(" ", 1)[-1]  # botón del menú, sin el emoji
+    return "respuesta"
+
+
+def actualizacion(evento, update_id, usuario):
+    """Update de Telegram (el mismo JSON que devuelve getUpdates) para un evento del guion."""
+    from telebot.types import Update
+
+    remitente = {"id": usuario, "is_bot": False, "first_name": "admin"}
+    chat = {"id": usuario, "type": "private"}
+    mensaje = {"message_id": update_id, "date": int(time.time()), "chat": chat, "from": remitente,
+               "text": evento.get("texto", "")}
+    if "callback" in evento:
+        return Update.de_json({"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": remitente, "chat_instance": "sim",
+            "data": evento["callback"], "message": dict(mensaje, **{"from": {"id": 1, "is_bot": True, "first_name": "bot"}}),
+        }})
+    return Update.de_json({"update_id": update_id, "message": mensaje})
+
+
+def guion_sintetico(dias, altas_por_dia, semilla=1) -> list:
+    """
+    Guion de un administrador durante `dias`: altas repartidas al azar y,
+    tras cada una, a veces un reenvío del .conf, una baja, un listado,
+    una búsqueda o las estadísticas.
+    """
+    rnd = random.Random(semilla)
+    duracion = dias * 86400
+    planes, pesos = zip(*PLANES_SIMULADOS)
+    eventos = []
+    for i, t in enumerate(sorted(rnd.uniform(0, duracion) for _ in range(int(dias * altas_por_dia)))):
+        nombre = f"sim{i:06d}"
+        eventos += [
+            {"t": t, "texto": "📦 Crear configuración"},
+            {"t": t, "texto": nombre},
+            {"t": t, "texto": rnd.choices(planes, pesos)[0]},
+        ]
+        despues = min(t + rnd.uniform(60, 86400), duracion)
+        r = rnd.random()
+        if r < 0.2:
+            eventos.append({"t": despues, "texto": f"/conf {nombre}"})
+        elif r < 0.3:
+            eventos += [{"t": despues, "texto": "🗑 Eliminar configuración"}, {"t": despues, "texto": nombre}]
+        elif r < 0.35:
+            eventos += [{"t": despues, "texto": "📄 Ver configuraciones activas"},
+                        {"t": despues, "callback": "lst:ver:1:"}]
+        elif r < 0.4:
+            eventos += [{"t": despues, "texto": "🔎 Buscar cliente"}, {"t": despues, "texto": nombre[:6]}]
+        elif r < 0.45:
+            eventos.append({"t": despues, "texto": "📊 Ver estadísticas"})
+    # Orden estable: los pasos de un mismo flujo conservan su orden
+    return sorted(eventos, key=lambda e: e["t"])
+
+
+def cargar_guion(ruta) -> list:
+    with open(ruta) as f:
+        eventos = [json.loads(linea) for linea in f if linea.strip()]
+    return sorted(eventos, key=lambda e: e["t"])
+
+
+def resumen_latencias(tiempos) -> dict:
+    return {
+        "n": len(tiempos),
+        "p50_ms": round(percentil(tiempos, 50) * 1000, 3),
+        "p99_ms": round(percentil(tiempos, 99) * 1000, 3),
+        "max_ms": round(max(tiempos, default=0) * 1000, 3),
+    }
+
+
+def verificar(reloj, wg) -> dict:
+    """Comprobaciones de corrección sobre el estado final."""
+    import wg_sync
+    from storage import load_users
+    from servers import get_registry
+    from scheduler import parse_vencimiento
+
+    usuarios = load_users()
+    ips = [d["ip"] for d in usuarios.values() if d.get("ip")]
+    desincronizados = 0
+    for interfaz in get_registry().interfaces():
+        deseados, actuales = wg_sync.desired_peers(interfaz), wg.peers(interfaz)
+        desincronizados += len(set(deseados.items()) ^ set(actuales.items()))
+    en_uso = sum(u for u, _ in get_registry().occupancy().values())
+    return {
+        "clientes": len(usuarios),
+        "suspendidos": sum(1 for d in usuarios.values() if d.get("suspendido")),
+        "vencidos_sin_procesar": sum(1 for d in usuarios.values()
+                                     if d.get("vencimiento") and parse_vencimiento(d["vencimiento"]) <= reloj()),
+        "ips_duplicadas": len(ips) - len(set(ips)),
+        "asignador_descuadrado": en_uso - len(ips),
+        "peers_desincronizados": desincronizados,
+    }
+
+
+def simular(guion, dias, paso, interfaces, latencia_wg, latencia_telegram, recuperar_cada=3600) -> dict:
+    directorio = tempfile.mkdtemp(prefix="wg_sim_")
+    try:
+        preparar_entorno(directorio, interfaces)
+        reloj = VirtualClock()
+        wg = FakeWireGuard(reloj, latencia_wg)
+
+        import config
+        import wg_sync
+        import storage
+        import bulk
+        import scheduler
+        import stats
+        import reclaim
+        import admin_handlers
+        import quota
+        from outbox import get_dispatcher
+        from telemetry import get_telemetry
+
+        wg_sync.run_wg = wg
+        storage.ensure_storage()
+        for modulo in (admin_handlers, bulk):
+            modulo.datetime = virtual_datetime(reloj)
+        planificador = scheduler.get_scheduler()
+        planificador.reloj = reloj
+        stats.get_stats().reloj = reloj
+        recuperador = reclaim.get_reclaimer()
+        recuperador.reloj = reloj
+        # La caché de dumps es de tiempo real: en tiempo acelerado se leería un dump de horas atrás
+        recuperador.leer = lambda interfaz: wg_sync.get_snapshot(interfaz, max_edad=0)
+
+        bot = crear_bot(latencia_telegram)
+        admin_handlers.register_admin_handlers(bot)
+        planificador.bot = bot
+
+        # Telemetría y cuotas con el reloj virtual (se muestrean desde el bucle, sin hilos)
+        telemetria = get_telemetry()
+        telemetria.reloj = reloj
+        telemetria.leer = lambda: wg_sync.get_all_snapshots(max_edad=0)
+        cuotas = quota.start_quotas()
+        cargas_cuota = []
+        cuotas.aplicar = lambda ips: cargas_cuota.append(len(ips))
+        muestras = 0
+
+        # Notificaciones: la cola se agrupa y entrega desde el bucle, en tiempo virtual
+        notificador = get_dispatcher()
+        notificador.bot = bot
+        notificador.reloj = notificador.pared = reloj
+        entregadas = 0
+
+        eventos = deque(guion)
+        duracion = dias * 86400
+        retrasos, eventos_planificador, suspendidos = [], Counter(), 0
+        update_id = 0
+        inicio = time.perf_counter()
+        while reloj.transcurrido < duracion:
+            reloj.advance(min(paso, duracion - reloj.transcurrido))
+            lote = []
+            while eventos and eventos[0]["t"] <= reloj.transcurrido:
+                evento = eventos.popleft()
+                update_id += 1
+                lote.append(actualizacion(evento, update_id, evento.get("usuario", config.ADMIN_ID)))
+            if lote:
+                bot.process_new_updates(lote)
+                bot.dispatch_pool.join()
+
+            for cuando, _, tipo in planificador.run_pending():
+                if tipo == scheduler.VENCIDO:
+                    retrasos.append(reloj() - cuando)
+                    eventos_planificador["vencimiento"] += 1
+                else:
+                    # Un aviso puede quedar en el pasado desde el alta (plan más corto que el aviso)
+                    eventos_planificador["aviso"] += 1
+
+            if recuperar_cada and int(reloj.transcurrido) // recuperar_cada != int(reloj.transcurrido - paso) // recuperar_cada:
+                suspendidos += len(recuperador.run_once(automatico=True))
+
+            if int(reloj.transcurrido) // telemetria.intervalo != int(reloj.transcurrido - paso) // telemetria.intervalo:
+                telemetria.sample()
+                muestras += 1
+
+            if notificador._cierre is not None and notificador._cierre <= reloj():
+                notificador.flush()
+            pendientes = len(storage.outbox_pending())
+            if pendientes:
+                notificador.deliver()
+                entregadas += pendientes - len(storage.outbox_pending())
+        segundos = time.perf_counter() - inicio
+
+        # Dejar que la sincronización con retardo aplique lo último antes de comparar
+        time.sleep(config.WG_SYNC_MAX_ESPERA_SEGUNDOS + 0.5)
+        notificador.flush()
+        todas = [t for lista in bot.latencias.values() for t in lista]
+        return {
+            "dias": dias,
+            "paso_s": paso,
+            "segundos_reales": round(segundos, 3),
+            "aceleracion": round(duracion / segundos, 1) if segundos else None,
+            "actualizaciones": {
+                "total": len(todas),
+                "por_segundo": round(len(todas) / segundos, 2) if segundos else None,
+                "latencia": resumen_latencias(todas),
+                "por_tipo": {tipo: resumen_latencias(t) for tipo, t in sorted(bot.latencias.items())},
+                "sin_respuesta": bot.sin_respuesta,
+                "errores": bot.errores[:20],
+            },
+            "planificador": dict(eventos_planificador, retraso_max_vencimiento_s=round(max(retrasos, default=0), 3)),
+            "recuperacion": {"suspendidos": suspendidos},
+            "telemetria": {"muestras": muestras, "peers": len(telemetria._peers)},
+            "cuotas": {"cargas_reglas": len(cargas_cuota), "limitados": len(cuotas.limitados())},
+            "telegram": dict(bot.enviados),
+            "notificaciones": {"entregadas": entregadas, "en_cola": len(storage.outbox_pending())},
+            "wg": {"llamadas": dict(wg.llamadas), "segundos": round(wg.segundos, 3)},
+            "correccion": verificar(reloj, wg),
+        }
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def informe(r: dict) -> str:
+    a = r["actualizaciones"]
+    c = r["correccion"]
+    lineas = [
+        f"🧪 {r['dias']} días simulados en {r['segundos_reales']} s (x{r['aceleracion']})",
+        f"   actualizaciones: {a['total']} ({a['por_segundo']}/s)  "
+        f"p50 {a['latencia']['p50_ms']} ms  p99 {a['latencia']['p99_ms']} ms",
+    ]
+    for tipo, m in a["por_tipo"].items():
+        lineas.append(f"     {tipo:<30} n={m['n']:<6} p50 {m['p50_ms']:>9.3f} ms  p99 {m['p99_ms']:>9.3f} ms")
+    p = r["planificador"]
+    lineas.append(f"   planificador: {p.get('vencimiento', 0)} vencimientos, {p.get('aviso', 0)} avisos, "
+                  f"retraso máx {p['retraso_max_vencimiento_s']} s")
+    lineas.append(f"   recuperación: {r['recuperacion']['suspendidos']} suspendidos · "
+                  f"wg: {r['wg']['llamadas']} ({r['wg']['segundos']} s)")
+    lineas.append(f"   telemetría: {r['telemetria']['muestras']} muestras · cuotas: {r['cuotas']['cargas_reglas']} cargas de reglas, "
+                  f"{r['cuotas']['limitados']} limitados · notificaciones: {r['notificaciones']['entregadas']} entregadas, "
+                  f"{r['notificaciones']['en_cola']} en cola")
+    lineas.append("   sin cubrir: portal de clientes, respaldos")
+    errores = {
+        "sin respuesta": a["sin_respuesta"],
+        "errores en handlers": len(a["errores"]),
+        "vencidos sin procesar": c["vencidos_sin_procesar"],
+        "vencimientos tardíos": int(p["retraso_max_vencimiento_s"] > r["paso_s"]),
+        "IPs duplicadas": c["ips_duplicadas"],
+        "asignador descuadrado": abs(c["asignador_descuadrado"]),
+        "peers desincronizados": c["peers_desincronizados"],
+    }
+    fallos = {k: v for k, v in errores.items() if v}
+    lineas.append(f"   clientes al final: {c['clientes']} ({c['suspendidos']} suspendidos)")
+    lineas.append("   ✅ Sin errores de corrección" if not fallos else
+                  "   ❌ " + ", ".join(f"{k}: {v}" for k, v in fallos.items()))
+    return "\n".join(lineas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación offline del bot WireGuard (carga y larga duración).")
+    parser.add_argument("--dias", type=float, default=3, help="Días de tiempo virtual")
+    parser.add_argument("--altas", type=int, default=200, help="Altas por día del guion sintético")
+    parser.add_argument("--guion", help="Guion JSONL grabado (en lugar del sintético)")
+    parser.add_argument("--paso", type=float, default=60, help="Segundos virtuales por paso")
+    parser.add_argument("-i", "--interfaces", type=int, default=1, help="Interfaces WireGuard simuladas")
+    parser.add_argument("--latencia-wg", type=float, default=2.0, help="Latencia de cada llamada a wg (ms)")
+    parser.add_argument("--latencia-telegram", type=float, default=30.0, help="Latencia de la API de Telegram (ms)")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("-o", "--salida", default="sim_results.json", help="Archivo JSON de resultados")
+    args = parser.parse_args()
+
+    guion = cargar_guion(args.guion) if args.guion else guion_sintetico(args.dias, args.altas, args.semilla)
+    resultado = simular(guion, args.dias, args.paso, args.interfaces, args.latencia_wg, args.latencia_telegram)
+    resultado.update({
+        "version": version(),
+        "fecha": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "interfaces": args.interfaces,
+    })
+    print(informe(resultado))
+
+    with open(args.salida, "w") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Resultados guardados en {args.salida}")
+    c = resultado["correccion"]
+    return 1 if (resultado["actualizaciones"]["errores"] or c["vencidos_sin_procesar"] or c["ips_duplicadas"]
+                 or c["peers_desincronizados"] or c["asignador_descuadrado"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# stats.py
+
+import bisect
+import threading
+import time
+
+from config import PLANES_PRECIOS, STATS_SNAPSHOT_SEGUNDOS
+from storage import load_users, get_state, set_state, add_stats_snapshot
+from servers import get_registry
+from scheduler import parse_vencimiento
+
+
+class StatsTracker:
+    """
+    Estadísticas del panel mantenidas por eventos (alta, baja, vencimiento,
+    suspensión y reactivación).
+
+    Los contadores se calculan una sola vez al iniciar y luego solo se
+    ajustan, así el panel responde sin recorrer los clientes. Los
+    vencimientos próximos se cuentan con búsqueda binaria sobre una lista
+    ordenada de fechas. El total histórico de vencidos se guarda en la base.
+    """
+
+    def __init__(self, reloj=time.time):
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._clientes = {}      # nombre -> (plan, timestamp de vencimiento)
+        self._suspendidos = set()  # nombres de clientes suspendidos (siguen en _clientes)
+        self._planes = {}        # plan -> cantidad de clientes activos
+        self._vencimientos = []  # timestamps ordenados
+        self._ingresos = {"cup": 0, "saldo": 0}
+        self._vencidos = 0
+        self._thread = None
+
+    def load(self):
+        """
+        Calcula los contadores a partir de la base de datos (solo al iniciar).
+        """
+        with self._lock:
+            self._clientes.clear()
+            self._suspendidos.clear()
+            self._planes.clear()
+            self._vencimientos = []
+            self._ingresos = {"cup": 0, "saldo": 0}
+            self._vencidos = get_state("stats_vencidos", 0)
+        for nombre, datos in load_users().items():
+            self.on_create(nombre, datos)
+            if datos.get("suspendido"):
+                self.on_suspend(nombre)
+
+    def _ts(self, datos):
+        try:
+            return parse_vencimiento(datos["vencimiento"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _ajustar(self, plan, ts, signo):
+        self._planes[plan] = self._planes.get(plan, 0) + signo
+        if not self._planes[plan]:
+            del self._planes[plan]
+        precio = PLANES_PRECIOS.get(plan, {})
+        self._ingresos["cup"] += signo * precio.get("precio_cup", 0)
+        self._ingresos["saldo"] += signo * precio.get("precio_saldo", 0)
+        if ts is not None:
+            if signo > 0:
+                bisect.insort(self._vencimientos, ts)
+            else:
+                i = bisect.bisect_left(self._vencimientos, ts)
+                if i < len(self._vencimientos) and self._vencimientos[i] == ts:
+                    del self._vencimientos[i]
+
+    def on_create(self, nombre: str, datos: dict):
+        """Registra un cliente nuevo (o renovado)."""
+        with self._lock:
+            anterior = self._clientes.pop(nombre, None)
+            if anterior is not None:
+                self._ajustar(*anterior, -1)
+            actual = (datos.get("plan", "Desconocido"), self._ts(datos))
+            self._clientes[nombre] = actual
+            self._ajustar(*actual, +1)
+
+    def on_delete(self, nombre: str):
+        """Registra la eliminación manual de un cliente."""
+        with self._lock:
+            anterior = self._clientes.pop(nombre, None)
+            self._suspendidos.discard(nombre)
+            if anterior is not None:
+                self._ajustar(*anterior, -1)
+
+    def on_suspend(self, nombre: str):
+        """Registra la suspensión de un cliente (deja de contarse como activo)."""
+        with self._lock:
+            if nombre in self._clientes:
+                self._suspendidos.add(nombre)
+
+    def on_resume(self, nombre: str):
+        """Registra la reactivación de un cliente suspendido."""
+        with self._lock:
+            self._suspendidos.discard(nombre)
+
+    def on_expire(self, nombre: str):
+        """Registra el vencimiento de un cliente."""
+        self.on_delete(nombre)
+        with self._lock:
+            self._vencidos += 1
+            vencidos = self._vencidos
+        set_state("stats_vencidos", vencidos)
+
+    def _vencen_en(self, ahora, segundos):
+        return (bisect.bisect_right(self._vencimientos, ahora + segundos)
+                - bisect.bisect_right(self._vencimientos, ahora))
+
+    def snapshot(self) -> dict:
+        """
+        Estado actual de las estadísticas (no recorre los clientes).
+        """
+        ocupacion = get_registry().occupancy()
+        ahora = self.reloj()
+        with self._lock:
+            return {
+                "ts": int(ahora),
+                "activos": len(self._clientes) - len(self._suspendidos),
+                "suspendidos": len(self._suspendidos),
+                "vencidos": self._vencidos,
+                "planes": dict(self._planes),
+                "vencen_24h": self._vencen_en(ahora, 24 * 3600),
+                "vencen_7d": self._vencen_en(ahora, 7 * 24 * 3600),
+                "ingresos_cup": self._ingresos["cup"],
+                "ingresos_saldo": self._ingresos["saldo"],
+                "ips_en_uso": sum(en_uso for en_uso, _ in ocupacion.values()),
+                "ips_capacidad": sum(capacidad for _, capacidad in ocupacion.values()),
+                "interfaces": {i: list(v) for i, v in ocupacion.items()},
+            }
+
+    def start(self, intervalo=STATS_SNAPSHOT_SEGUNDOS):
+        """
+        Inicia el hilo que guarda un snapshot en el historial cada `intervalo` segundos.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(intervalo,), daemon=True)
+            self._thread.start()
+
+    def _run(self, intervalo):
+        while True:
+            time.sleep(intervalo)
+            try:
+                datos = self.snapshot()
+                add_stats_snapshot(datos["ts"], datos)
+            except Exception as e:
+                print(f"⚠️ Error al guardar el historial de estadísticas: {e}")
+
+
+_stats = StatsTracker()
+
+
+def get_stats() -> StatsTracker:
+    return _stats
+
+
+def start_stats():
+    """
+    Calcula los contadores desde la base de datos e inicia el historial (idempotente).
+    """
+    if _stats._thread is None:
+        _stats.load()
+    _stats.start()
+    return _stats
+
+
+def formato_panel(datos: dict) -> str:
+    """
+    Texto HTML del panel "📊 Ver estadísticas".
+    """
+    uso = datos["ips_en_uso"] / datos["ips_capacidad"] * 100 if datos["ips_capacidad"] else 0
+    texto = (
+        f"📊 <b>Estadísticas:</b>\n\n"
+        f"👥 Clientes activos: <b>{datos['activos']}</b>\n"
+        f"💤 Suspendidos: <b>{datos.get('suspendidos', 0)}</b>\n"
+        f"⛔️ Vencidos (histórico): <b>{datos['vencidos']}</b>\n"
+    )
+    for plan, count in sorted(datos["planes"].items()):
+        texto += f"🔹 {plan}: {count}\n"
+    texto += (
+        f"\n⏳ Vencen en 24 h: <b>{datos['vencen_24h']}</b>\n"
+        f"📅 Vencen en 7 días: <b>{datos['vencen_7d']}</b>\n"
+        f"\n💰 Ingresos proyectados: <b>{datos['ingresos_cup']} CUP</b> / <b>{datos['ingresos_saldo']} saldo</b>\n"
+        f"🌐 IPs en uso: <b>{datos['ips_en_uso']}/{datos['ips_capacidad']}</b> ({uso:.1f}%)"
+    )
+    interfaces = datos.get("interfaces", {})
+    if len(interfaces) > 1:
+        for interfaz, (en_uso, capacidad) in interfaces.items():
+            texto += f"\n   • {interfaz}: {en_uso}/{capacidad}"
+    return texto
@@ -2,56 +2,690 @@
 
 import os
 import json
+import sqlite3
+import threading
+from contextlib import contextmanager
 
-# Rutas de los archivos de almacenamiento
+from config import SERVIDORES
+from metrics import medido, counter
+
+# Base de datos SQLite (modo WAL) con los clientes y configuraciones
+DB_PATH = "data/wireguard.db"
+
+# Archivos JSON antiguos (solo se leen una vez para migrarlos a SQLite)
 FILES = {
     "users": "data/users.json",       # Datos de clientes registrados (nombre, fecha, plan, etc.)
     "configs": "data/configs.json",   # Configuraciones WireGuard activas (clave pública, IP, etc.)
 }
 
-def ensure_storage():
+# Cada tipo de registro vive en su propia tabla con columnas indexadas
+TABLES = {
+    "users": "users",
+    "configs": "configs",
+}
+
+# Reintentos de update_record cuando otro hilo modifica el mismo registro a la vez
+CAS_INTENTOS = 20
+
+# Columnas agregadas después de crear las tablas (se migran al conectar)
+_COLUMNAS_NUEVAS = {
+    "interfaz": "TEXT",
+    "version": "INTEGER NOT NULL DEFAULT 0",
+    "telegram_id": "INTEGER",
+}
+
+# Los registros sin "interfaz" (anteriores a SERVIDORES) son de la interfaz por defecto
+INTERFAZ_POR_DEFECTO = SERVIDORES[0]["interfaz"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {tabla} (
+    nombre      TEXT PRIMARY KEY,
+    ip          TEXT,
+    public_key  TEXT,
+    vencimiento TEXT,
+    datos       TEXT NOT NULL,
+    interfaz    TEXT,
+    version     INTEGER NOT NULL DEFAULT 0,
+    telegram_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS {tabla}_ip ON {tabla}(ip);
+CREATE INDEX IF NOT EXISTS {tabla}_public_key ON {tabla}(public_key);
+CREATE INDEX IF NOT EXISTS {tabla}_vencimiento ON {tabla}(vencimiento);
+"""
+
+_SCHEMA_ESTADO = """
+CREATE TABLE IF NOT EXISTS estado (
+    clave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats_historial (
+    ts    INTEGER PRIMARY KEY,
+    datos TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id  INTEGER NOT NULL,
+    texto    TEXT NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo  REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS outbox_eventos (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo    TEXT NOT NULL,
+    texto   TEXT NOT NULL,
+    resumen TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ip_offsets (
+    clave  TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    tipo   TEXT NOT NULL,
+    PRIMARY KEY (clave, offset)
+);
+"""
+
+_local = threading.local()
+
+
+def _connect():
     """
-    Crea el directorio 'data/' y los archivos .json vacíos si no existen.
+    Devuelve la conexión SQLite del hilo actual (una por hilo).
     """
-    os.makedirs("data", exist_ok=True)
-    for path in FILES.values():
-        if not os.path.exists(path):
-            with open(path, "w") as f:
-                json.dump({}, f, indent=4)
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _ensure_schema(conn)
+    return conn
+
+
+def _ensure_schema(conn):
+    for tabla in TABLES.values():
+        conn.executescript(_SCHEMA.format(tabla=tabla))
+        _ensure_columns(conn, tabla)
+    conn.executescript(_SCHEMA_ESTADO)
 
-def load_json(name):
+
+def _ensure_columns(conn, tabla):
     """
-    Carga un archivo JSON de los definidos en FILES.
+    Agrega las columnas nuevas a las tablas creadas con versiones anteriores
+    (los registros existentes quedan en la interfaz por defecto, versión 0).
     """
-    path = FILES.get(name)
-    if not path:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        columnas = {fila[1] for fila in conn.execute(f"PRAGMA table_info({tabla})")}
+        for columna, tipo in _COLUMNAS_NUEVAS.items():
+            if columna not in columnas:
+                conn.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}")
+        conn.execute(f"UPDATE {tabla} SET interfaz = ? WHERE interfaz IS NULL", (INTERFAZ_POR_DEFECTO,))
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {tabla}_interfaz ON {tabla}(interfaz)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {tabla}_telegram_id ON {tabla}(telegram_id)")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+def _table(name):
+    tabla = TABLES.get(name)
+    if not tabla:
         raise ValueError(f"[❌] Archivo no reconocido: {name}")
+    return tabla
+
+
+@contextmanager
+def transaction():
+    """
+    Abre una transacción de escritura (BEGIN IMMEDIATE) y la confirma al salir.
+    Las transacciones anidadas se integran en la exterior.
+    """
+    conn = _connect()
+    if getattr(_local, "depth", 0):
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+
+    _local.depth = 1
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(path, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+    finally:
+        _local.depth = 0
+
+
+# Toda escritura incrementa la versión del registro (ver compare_and_swap)
+_UPSERT = """
+INSERT INTO {tabla} (nombre, ip, public_key, vencimiento, datos, interfaz, telegram_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(nombre) DO UPDATE SET
+    ip = excluded.ip, public_key = excluded.public_key, vencimiento = excluded.vencimiento,
+    datos = excluded.datos, interfaz = excluded.interfaz, telegram_id = excluded.telegram_id,
+    version = version + 1
+"""
+
+_INSERT = """
+INSERT INTO {tabla} (nombre, ip, public_key, vencimiento, datos, interfaz, telegram_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(nombre) DO NOTHING
+"""
+
+_UPDATE_SI_VERSION = """
+UPDATE {tabla} SET ip = ?, public_key = ?, vencimiento = ?, datos = ?, interfaz = ?, telegram_id = ?,
+    version = version + 1
+WHERE nombre = ? AND version = ?
+"""
+
+
+def _row(nombre, datos):
+    return (
+        nombre,
+        datos.get("ip"),
+        datos.get("public_key"),
+        datos.get("vencimiento"),
+        json.dumps(datos, ensure_ascii=False),
+        datos.get("interfaz") or INTERFAZ_POR_DEFECTO,
+        datos.get("telegram_id"),
+    )
+
+
+def ensure_storage():
+    """
+    Crea el directorio 'data/', la base de datos y migra los .json antiguos si existen.
+    """
+    os.makedirs("data", exist_ok=True)
+    _connect()
+    migrate_from_json()
+
+
+def migrate_from_json():
+    """
+    Migración única: copia data/users.json y data/configs.json a SQLite.
+    Devuelve la cantidad de registros importados (0 si ya se había migrado).
+    """
+    if get_state("migrado_json"):
+        return 0
+
+    total = 0
+    with transaction():
+        for name, path in FILES.items():
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if isinstance(data, dict) and data:
+                upsert_many(name, data)
+                total += len(data)
+        set_state("migrado_json", True)
 
+    if total:
+        print(f"✅ Migrados {total} registros de JSON a {DB_PATH}.")
+    return total
+
+
+# Acceso genérico por tipo de registro
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="load")
+def load_json(name, interfaz=None):
+    """
+    Carga todos los registros de un tipo ("users" o "configs") como diccionario.
+    Con `interfaz` solo los de esa interfaz (usa el índice).
+    """
+    tabla = _table(name)
+    if interfaz is None:
+        rows = _connect().execute(f"SELECT nombre, datos FROM {tabla}").fetchall()
+    else:
+        rows = _connect().execute(f"SELECT nombre, datos FROM {tabla} WHERE interfaz = ?", (interfaz,)).fetchall()
+    return {nombre: json.loads(datos) for nombre, datos in rows}
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="save")
 def save_json(name, data):
     """
-    Guarda un diccionario en el archivo JSON correspondiente.
+    Reemplaza todos los registros de un tipo de forma atómica.
+    Solo se escriben los registros que cambiaron y se borran los que ya no están.
     """
-    path = FILES.get(name)
-    if not path:
-        raise ValueError(f"[❌] Archivo no reconocido: {name}")
-    with open(path, "w") as f:
-        json.dump(data, f, indent=4)
+    tabla = _table(name)
+    with transaction() as conn:
+        actuales = dict(conn.execute(f"SELECT nombre, datos FROM {tabla}").fetchall())
+        sobrantes = [(nombre,) for nombre in actuales if nombre not in data]
+        if sobrantes:
+            conn.executemany(f"DELETE FROM {tabla} WHERE nombre = ?", sobrantes)
+        cambios = {
+            nombre: datos for nombre, datos in data.items()
+            if actuales.get(nombre) != json.dumps(datos, ensure_ascii=False)
+        }
+        upsert_many(name, cambios)
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="get")
+def get_record(name, nombre):
+    """Devuelve un registro por nombre o None."""
+    tabla = _table(name)
+    row = _connect().execute(f"SELECT datos FROM {tabla} WHERE nombre = ?", (nombre,)).fetchone()
+    return json.loads(row[0]) if row else None
+
 
-# Funciones específicas para cada tipo de archivo
+def upsert_record(name, nombre, datos):
+    """Inserta o actualiza un único registro."""
+    upsert_many(name, {nombre: datos})
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="upsert")
+def upsert_many(name, data):
+    """Inserta o actualiza varios registros en una sola transacción."""
+    tabla = _table(name)
+    if not data:
+        return
+    with transaction() as conn:
+        conn.executemany(_UPSERT.format(tabla=tabla), [_row(nombre, datos) for nombre, datos in data.items()])
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="delete")
+def delete_record(name, nombre, version=None):
+    """
+    Elimina un registro. Con `version`, solo si nadie lo modificó desde esa lectura.
+    Devuelve True si se eliminó.
+    """
+    return pop_record(name, nombre, version) is not None
+
+
+def pop_record(name, nombre, version=None):
+    """
+    Elimina un registro y devuelve los datos que tenía (o None), de forma atómica.
+    Con `version`, solo lo elimina si sigue en esa versión.
+    """
+    tabla = _table(name)
+    with transaction() as conn:
+        row = conn.execute(f"SELECT datos, version FROM {tabla} WHERE nombre = ?", (nombre,)).fetchone()
+        if row is None or (version is not None and row[1] != version):
+            return None
+        conn.execute(f"DELETE FROM {tabla} WHERE nombre = ?", (nombre,))
+    return json.loads(row[0])
 
-def load_users():
-    """Carga los usuarios registrados"""
-    return load_json("users")
+
+# Escrituras concurrentes sin bloqueos globales: cada registro tiene una versión
+# que aumenta en cada escritura. Quien lee (datos, versión) solo puede escribir
+# si la versión no cambió; si otro se adelantó, vuelve a leer y reintenta.
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="get")
+def get_record_version(name, nombre):
+    """Devuelve (datos, versión) de un registro o None."""
+    tabla = _table(name)
+    row = _connect().execute(f"SELECT datos, version FROM {tabla} WHERE nombre = ?", (nombre,)).fetchone()
+    return (json.loads(row[0]), row[1]) if row else None
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="cas")
+def compare_and_swap(name, nombre, datos, version) -> bool:
+    """
+    Guarda `datos` solo si el registro sigue en `version` (None = solo si no existe).
+    Devuelve False si otro escritor lo cambió (o lo creó) antes.
+    """
+    tabla = _table(name)
+    fila = _row(nombre, datos)
+    with transaction() as conn:
+        if version is None:
+            cursor = conn.execute(_INSERT.format(tabla=tabla), fila)
+        else:
+            cursor = conn.execute(_UPDATE_SI_VERSION.format(tabla=tabla), fila[1:] + (nombre, version))
+        return cursor.rowcount == 1
+
+
+def update_record(name, nombre, funcion, intentos=CAS_INTENTOS):
+    """
+    Lectura-modificación-escritura de un registro sin bloquear a los demás:
+    funcion(datos) devuelve los datos nuevos, o None para no cambiar nada.
+    Si otro hilo escribió el registro en el medio, se vuelve a leer y a
+    aplicar funcion. Devuelve los datos guardados, o None si no existe o
+    funcion devolvió None.
+    """
+    for _ in range(intentos):
+        actual = get_record_version(name, nombre)
+        if actual is None:
+            return None
+        datos, version = actual
+        nuevos = funcion(datos)
+        if nuevos is None:
+            return None
+        if compare_and_swap(name, nombre, nuevos, version):
+            return nuevos
+    counter("storage_conflictos_total", "Escrituras abandonadas por conflictos de versión").inc(tabla=name)
+    raise RuntimeError(f"❌ Demasiadas escrituras simultáneas sobre {nombre}.")
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="insert")
+def insert_many(name, data) -> list:
+    """
+    Inserta varios registros nuevos en una sola transacción, todo o nada.
+    Devuelve los nombres que ya existían (lista vacía = se insertaron todos).
+    """
+    tabla = _table(name)
+    if not data:
+        return []
+    with transaction() as conn:
+        nombres = list(data)
+        existentes = []
+        for i in range(0, len(nombres), 500):
+            grupo = nombres[i:i + 500]
+            marcas = ",".join("?" * len(grupo))
+            existentes += [n for (n,) in conn.execute(f"SELECT nombre FROM {tabla} WHERE nombre IN ({marcas})", grupo)]
+        if existentes:
+            return sorted(existentes)
+        conn.executemany(_INSERT.format(tabla=tabla), [_row(nombre, datos) for nombre, datos in data.items()])
+    return []
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="find")
+def find_record(name, campo, valor):
+    """
+    Busca un registro por una columna indexada (ip, public_key o telegram_id).
+    Devuelve (nombre, datos) o None.
+    """
+    if campo not in ("ip", "public_key", "telegram_id"):
+        raise ValueError(f"[❌] Campo no indexado: {campo}")
+    tabla = _table(name)
+    row = _connect().execute(f"SELECT nombre, datos FROM {tabla} WHERE {campo} = ? LIMIT 1", (valor,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+
+def records_expiring_before(name, fecha):
+    """
+    Devuelve los registros con vencimiento anterior o igual a `fecha`
+    (texto '%Y-%m-%d %H:%M:%S'), usando el índice de vencimiento.
+    """
+    tabla = _table(name)
+    rows = _connect().execute(
+        f"SELECT nombre, datos FROM {tabla} WHERE vencimiento <= ? ORDER BY vencimiento", (fecha,)
+    ).fetchall()
+    return {nombre: json.loads(datos) for nombre, datos in rows}
+
+
+def _rango_prefijo(prefijo):
+    # nombre >= prefijo AND nombre < fin usa el índice de la clave primaria (LIKE no)
+    return prefijo, prefijo + "\U0010ffff"
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="page")
+def page_records(name, limit, prefijo="", despues=None, antes=None, offset=0):
+    """
+    Devuelve una página de registros ordenados por nombre: [(nombre, datos)].
+    Con `prefijo` solo se incluyen los nombres que empiezan así. Paginación
+    por clave: `despues` da los siguientes a ese nombre y `antes` los
+    anteriores (el índice salta directo, sin recorrer un OFFSET).
+    """
+    tabla = _table(name)
+    desde, hasta = _rango_prefijo(prefijo)
+    if antes is not None:
+        rows = _connect().execute(
+            f"SELECT nombre, datos FROM {tabla} WHERE nombre >= ? AND nombre < ? AND nombre < ? ORDER BY nombre DESC LIMIT ?",
+            (desde, hasta, antes, limit)
+        ).fetchall()
+        rows.reverse()
+    else:
+        rows = _connect().execute(
+            f"SELECT nombre, datos FROM {tabla} WHERE nombre >= ? AND nombre < ? AND nombre > ? ORDER BY nombre LIMIT ? OFFSET ?",
+            (desde, hasta, despues if despues is not None else "", limit, offset)
+        ).fetchall()
+    return [(nombre, json.loads(datos)) for nombre, datos in rows]
+
+
+def count_records(name, prefijo=""):
+    """Cantidad de registros (opcionalmente solo los que empiezan con `prefijo`)."""
+    tabla = _table(name)
+    desde, hasta = _rango_prefijo(prefijo)
+    return _connect().execute(
+        f"SELECT COUNT(*) FROM {tabla} WHERE nombre >= ? AND nombre < ?", (desde, hasta)
+    ).fetchone()[0]
+
+
+# Lecturas consistentes para respaldos (ver backup.py)
+
+@contextmanager
+def read_snapshot():
+    """
+    Conexión aparte con una transacción de solo lectura: todas las consultas
+    ven la base en el mismo instante. En modo WAL no bloquea a los escritores.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+    try:
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM estado").fetchone()  # la primera lectura fija el instante
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.close()
+
+
+def iter_snapshot(conn, name):
+    """Recorre (nombre, datos) de un tipo de registro dentro de read_snapshot(), sin cargarlos todos."""
+    tabla = _table(name)
+    for nombre, datos in conn.execute(f"SELECT nombre, datos FROM {tabla} ORDER BY nombre"):
+        yield nombre, json.loads(datos)
+
+
+def iter_snapshot_state(conn):
+    """Recorre (clave, valor) del estado interno dentro de read_snapshot()."""
+    for clave, valor in conn.execute("SELECT clave, valor FROM estado ORDER BY clave"):
+        yield clave, json.loads(valor)
+
+
+def iter_snapshot_history(conn, desde=0):
+    """Recorre los snapshots de estadísticas con ts >= desde dentro de read_snapshot()."""
+    for ts, datos in conn.execute("SELECT ts, datos FROM stats_historial WHERE ts >= ? ORDER BY ts", (desde,)):
+        yield ts, json.loads(datos)
+
+
+@medido("storage_segundos", "Duración de las operaciones de la base de datos", op="delete")
+def delete_many(name, nombres):
+    """Elimina varios registros en una sola transacción."""
+    tabla = _table(name)
+    with transaction() as conn:
+        conn.executemany(f"DELETE FROM {tabla} WHERE nombre = ?", [(n,) for n in nombres])
+
+
+# Estado interno persistente (clave/valor en JSON)
+
+def get_state(clave, default=None):
+    row = _connect().execute("SELECT valor FROM estado WHERE clave = ?", (clave,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+def set_state(clave, valor):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO estado (clave, valor) VALUES (?, ?)",
+            (clave, json.dumps(valor, ensure_ascii=False))
+        )
+
+
+def get_states(prefijo):
+    """Devuelve {clave: valor} de las claves de estado que empiezan con `prefijo`."""
+    rows = _connect().execute(
+        "SELECT clave, valor FROM estado WHERE clave >= ? AND clave < ?", _rango_prefijo(prefijo)
+    ).fetchall()
+    return {clave: json.loads(valor) for clave, valor in rows}
+
+
+def set_states(valores):
+    """Guarda varias claves de estado {clave: valor} en una sola transacción."""
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO estado (clave, valor) VALUES (?, ?)",
+            [(clave, json.dumps(valor, ensure_ascii=False)) for clave, valor in valores.items()]
+        )
+
+
+def delete_states(claves):
+    with transaction() as conn:
+        conn.executemany("DELETE FROM estado WHERE clave = ?", [(clave,) for clave in claves])
+
+
+# Historial de estadísticas (ver stats.py)
+
+def add_stats_snapshot(ts, datos):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO stats_historial (ts, datos) VALUES (?, ?)",
+            (ts, json.dumps(datos, ensure_ascii=False))
+        )
+
+
+def stats_history(desde=0):
+    """Devuelve los snapshots con ts >= desde, del más antiguo al más reciente."""
+    rows = _connect().execute(
+        "SELECT datos FROM stats_historial WHERE ts >= ? ORDER BY ts", (desde,)
+    ).fetchall()
+    return [json.loads(datos) for (datos,) in rows]
+
+
+# Desplazamientos de los asignadores de IPs (ver ip_allocator.py): una fila por
+# desplazamiento, así cada reserva o liberación escribe solo lo que cambió
+
+def ip_offsets(clave):
+    """Devuelve {desplazamiento: tipo} del asignador `clave`."""
+    return dict(_connect().execute("SELECT offset, tipo FROM ip_offsets WHERE clave = ?", (clave,)).fetchall())
+
+
+def ip_offsets_apply(clave, agregados, quitados):
+    """Guarda {desplazamiento: tipo} y borra los desplazamientos de `quitados`."""
+    with transaction() as conn:
+        conn.executemany("DELETE FROM ip_offsets WHERE clave = ? AND offset = ?", [(clave, o) for o in quitados])
+        conn.executemany(
+            "INSERT OR REPLACE INTO ip_offsets (clave, offset, tipo) VALUES (?, ?, ?)",
+            [(clave, o, tipo) for o, tipo in agregados.items()]
+        )
+
+
+def ip_offsets_replace(clave, filas):
+    """Reemplaza todos los desplazamientos del asignador por {desplazamiento: tipo}."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM ip_offsets WHERE clave = ?", (clave,))
+        conn.executemany(
+            "INSERT INTO ip_offsets (clave, offset, tipo) VALUES (?, ?, ?)",
+            [(clave, o, tipo) for o, tipo in filas.items()]
+        )
+
+
+# Mensajes pendientes de envío (ver outbox.py)
+
+def outbox_add_many(mensajes):
+    """Guarda [(chat_id, texto)] en una sola transacción."""
+    with transaction() as conn:
+        conn.executemany("INSERT INTO outbox (chat_id, texto) VALUES (?, ?)", mensajes)
+
+
+def outbox_event_add(tipo, texto, resumen):
+    """Guarda un evento aún sin agrupar (ver NotificationDispatcher.notify)."""
+    with transaction() as conn:
+        conn.execute("INSERT INTO outbox_eventos (tipo, texto, resumen) VALUES (?, ?, ?)", (tipo, texto, resumen))
+
+
+def outbox_events():
+    """Devuelve [(id, tipo, texto, resumen)] de los eventos sin agrupar, en orden de llegada."""
+    return _connect().execute("SELECT id, tipo, texto, resumen FROM outbox_eventos ORDER BY id").fetchall()
+
+
+def outbox_events_flush(hasta_id, mensajes):
+    """Reemplaza los eventos hasta `hasta_id` por los mensajes [(chat_id, texto)] ya agrupados."""
+    with transaction() as conn:
+        conn.executemany("INSERT INTO outbox (chat_id, texto) VALUES (?, ?)", mensajes)
+        conn.execute("DELETE FROM outbox_eventos WHERE id <= ?", (hasta_id,))
+
+
+def outbox_pending():
+    """Devuelve [(id, chat_id, texto, intentos, proximo)] en orden de llegada."""
+    return _connect().execute(
+        "SELECT id, chat_id, texto, intentos, proximo FROM outbox ORDER BY id"
+    ).fetchall()
+
+
+def outbox_delete(mensaje_id):
+    with transaction() as conn:
+        conn.execute("DELETE FROM outbox WHERE id = ?", (mensaje_id,))
+
+
+def outbox_retry(mensaje_id, intentos, proximo):
+    with transaction() as conn:
+        conn.execute("UPDATE outbox SET intentos = ?, proximo = ? WHERE id = ?", (intentos, proximo, mensaje_id))
+
+
+# Funciones específicas para cada tipo de registro
+
+def load_users(interfaz=None):
+    """Carga los usuarios registrados (todos o solo los de una interfaz)"""
+    return load_json("users", interfaz)
 
 def save_users(data):
     """Guarda los usuarios registrados"""
     save_json("users", data)
 
+def get_user(nombre):
+    """Devuelve un usuario por nombre o None"""
+    return get_record("users", nombre)
+
+def upsert_user(nombre, datos):
+    """Inserta o actualiza un único usuario"""
+    upsert_record("users", nombre, datos)
+
+def upsert_users(data):
+    """Inserta o actualiza varios usuarios en una sola transacción"""
+    upsert_many("users", data)
+
+def delete_user(nombre, version=None):
+    """Elimina un usuario por nombre (opcionalmente solo si sigue en `version`)"""
+    return delete_record("users", nombre, version)
+
+def pop_user(nombre, version=None):
+    """Elimina un usuario y devuelve sus datos (o None)"""
+    return pop_record("users", nombre, version)
+
+def get_user_version(nombre):
+    """Devuelve (datos, versión) de un usuario o None"""
+    return get_record_version("users", nombre)
+
+def insert_user(nombre, datos):
+    """Crea un usuario solo si el nombre está libre. Devuelve False si ya existía"""
+    return compare_and_swap("users", nombre, datos, None)
+
+def insert_users(data):
+    """Crea varios usuarios nuevos (todo o nada). Devuelve los nombres que ya existían"""
+    return insert_many("users", data)
+
+def update_user(nombre, funcion):
+    """Modifica un usuario con funcion(datos) sin perder escrituras simultáneas"""
+    return update_record("users", nombre, funcion)
+
+def find_user_by_ip(ip):
+    """Busca un usuario por IP (índice)"""
+    return find_record("users", "ip", ip)
+
+def find_user_by_public_key(public_key):
+    """Busca un usuario por clave pública (índice)"""
+    return find_record("users", "public_key", public_key)
+
+def find_user_by_telegram_id(telegram_id):
+    """Busca el usuario vinculado a una cuenta de Telegram (índice)"""
+    return find_record("users", "telegram_id", telegram_id)
+
+def page_users(limit, prefijo="", despues=None, antes=None, offset=0):
+    """Página de usuarios ordenados por nombre (ver page_records)"""
+    return page_records("users", limit, prefijo, despues, antes, offset)
+
+def count_users(prefijo=""):
+    """Cantidad de usuarios (por prefijo de nombre)"""
+    return count_records("users", prefijo)
+
 def load_configs():
     """Carga las configuraciones activas de WireGuard"""
     return load_json("configs")
@@ -62,13 +696,16 @@ def save_configs(data):
 
 def get_next_available_ip():
     """
-    Devuelve la próxima IP disponible para asignar a un nuevo cliente (evitando duplicados).
-    Rango: 10.9.0.2 hasta 10.9.0.254
+    Reserva la próxima IP disponible para un nuevo cliente (ver ip_allocator.py).
     """
-    configs = load_configs()
-    used_ips = {conf['ip'] for conf in configs.values()}
-    for i in range(2, 255):
-        ip = f"10.9.0.{i}"
-        if ip not in used_ips:
-            return ip
-    return None  # Si no hay IPs disponibles
+    from ip_allocator import get_allocator  # importación local: ip_allocator depende de storage
+    try:
+        return get_allocator().reserve()
+    except RuntimeError:
+        return None  # Si no hay IPs disponibles
+
+
+if __name__ == "__main__":
+    # Migración manual: python storage.py
+    ensure_storage()
+    print(f"📦 Usuarios en {DB_PATH}: {len(load_users())}")
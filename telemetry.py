@@ -0,0 +1,218 @@
+# telemetry.py
+
+import threading
+import time
+from array import array
+
+from config import TELEMETRIA_INTERVALO_SEGUNDOS, TELEMETRIA_INACTIVO_SEGUNDOS
+from wg_sync import get_all_snapshots
+
+# Resoluciones de las series: (segundos por casilla, casillas)
+MINUTOS = (60, 60)         # última hora
+HORAS = (3600, 48)         # últimos 2 días
+DIAS = (86400, 30)         # últimos 30 días
+RESOLUCIONES = (MINUTOS, HORAS, DIAS)
+
+
+class RingSeries:
+    """
+    Serie de tráfico de tamaño fijo (rx/tx por casilla) sobre arrays de 64 bits.
+    Las casillas viejas se reutilizan al avanzar el tiempo, así la memoria no crece.
+    """
+
+    __slots__ = ("paso", "rx", "tx", "_ultimo")
+
+    def __init__(self, paso: int, casillas: int):
+        self.paso = paso
+        self.rx = array("Q", bytes(8 * casillas))
+        self.tx = array("Q", bytes(8 * casillas))
+        self._ultimo = None  # número de casilla (ts // paso) más reciente
+
+    def _avanzar(self, casilla: int):
+        n = len(self.rx)
+        if self._ultimo is None or casilla - self._ultimo >= n:
+            for i in range(n):
+                self.rx[i] = self.tx[i] = 0
+        else:
+            for c in range(self._ultimo + 1, casilla + 1):
+                self.rx[c % n] = self.tx[c % n] = 0
+        self._ultimo = casilla
+
+    def add(self, ts: float, rx: int, tx: int):
+        casilla = int(ts // self.paso)
+        if self._ultimo is None or casilla > self._ultimo:
+            self._avanzar(casilla)
+        elif self._ultimo - casilla >= len(self.rx):
+            return  # demasiado vieja para esta serie
+        i = casilla % len(self.rx)
+        self.rx[i] += rx
+        self.tx[i] += tx
+
+    def total(self, ahora: float, segundos: int):
+        """Suma (rx, tx) de las casillas que caen en los últimos `segundos`."""
+        if self._ultimo is None:
+            return 0, 0
+        n = len(self.rx)
+        actual = int(ahora // self.paso)
+        desde = max(actual - max(segundos // self.paso, 1) + 1, self._ultimo - n + 1)
+        rx = tx = 0
+        for c in range(desde, min(actual, self._ultimo) + 1):
+            rx += self.rx[c % n]
+            tx += self.tx[c % n]
+        return rx, tx
+
+
+class PeerUsage:
+    """
+    Uso de un peer: últimos contadores vistos, último handshake y series por resolución.
+    """
+
+    __slots__ = ("rx", "tx", "handshake", "interfaz", "series")
+
+    def __init__(self):
+        self.rx = None
+        self.tx = None
+        self.handshake = 0
+        self.interfaz = None
+        self.series = tuple(RingSeries(paso, casillas) for paso, casillas in RESOLUCIONES)
+
+    def total(self, ahora: float, segundos: int):
+        """Tráfico en la ventana, usando la resolución más fina que la cubre."""
+        for serie in self.series:
+            if segundos <= serie.paso * len(serie.rx):
+                return serie.total(ahora, segundos)
+        return self.series[-1].total(ahora, segundos)
+
+
+class TelemetrySampler:
+    """
+    Muestrea `wg show <interfaz> dump` de todas las interfaces (en paralelo)
+    cada `intervalo` segundos y acumula los incrementos de rx/tx de cada
+    peer en series de minuto, hora y día.
+
+    Un reinicio de contadores (interfaz recreada) se toma como tráfico
+    desde cero. Los peers que desaparecen de la interfaz se descartan,
+    así la memoria depende solo de la cantidad de peers activos (salvo los
+    de una interfaz que no se pudo leer, que se conservan hasta la próxima).
+    """
+
+    def __init__(self, intervalo=TELEMETRIA_INTERVALO_SEGUNDOS, reloj=time.time, leer=get_all_snapshots):
+        self.intervalo = intervalo
+        self.reloj = reloj
+        self.leer = leer
+        self._peers = {}  # public_key -> PeerUsage
+        self._observadores = []  # funciones que reciben cada Snapshot (p. ej. las cuotas)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def sample(self, snapshot=None):
+        """
+        Toma una muestra (normalmente la llama el hilo).
+        """
+        snapshot = snapshot if snapshot is not None else self.leer()
+        ahora = self.reloj()
+        with self._lock:
+            faltantes = getattr(snapshot, "faltantes", ())
+            for clave in set(self._peers) - set(snapshot.peers):
+                if self._peers[clave].interfaz not in faltantes:
+                    del self._peers[clave]
+            origen = getattr(snapshot, "origen", {})
+            for clave, peer in snapshot.peers.items():
+                uso = self._peers.get(clave)
+                if uso is None:
+                    uso = self._peers[clave] = PeerUsage()
+                if uso.rx is not None:
+                    drx = peer.rx_bytes - uso.rx if peer.rx_bytes >= uso.rx else peer.rx_bytes
+                    dtx = peer.tx_bytes - uso.tx if peer.tx_bytes >= uso.tx else peer.tx_bytes
+                    if drx or dtx:
+                        for serie in uso.series:
+                            serie.add(ahora, drx, dtx)
+                uso.rx, uso.tx, uso.handshake = peer.rx_bytes, peer.tx_bytes, peer.latest_handshake
+                uso.interfaz = origen.get(clave, uso.interfaz)
+        for observador in self._observadores:
+            try:
+                observador(snapshot)
+            except Exception as e:
+                print(f"⚠️ Error al procesar la muestra de tráfico: {e}")
+
+    def subscribe(self, funcion):
+        """Registra funcion(snapshot), que se llama tras cada muestra (un solo dump para todos)."""
+        self._observadores.append(funcion)
+
+    def usage(self, public_key: str, segundos: int):
+        """(rx, tx) de un peer en los últimos `segundos`, o None si no se conoce."""
+        with self._lock:
+            uso = self._peers.get(public_key)
+            return None if uso is None else uso.total(self.reloj(), segundos)
+
+    def handshake(self, public_key: str):
+        with self._lock:
+            uso = self._peers.get(public_key)
+            return None if uso is None else uso.handshake
+
+    def top_talkers(self, segundos: int, limite: int = 10):
+        """
+        Devuelve [(public_key, rx, tx)] de los peers con más tráfico en la ventana.
+        """
+        ahora = self.reloj()
+        with self._lock:
+            totales = [(clave, *uso.total(ahora, segundos)) for clave, uso in self._peers.items()]
+        totales = [t for t in totales if t[1] or t[2]]
+        totales.sort(key=lambda t: t[1] + t[2], reverse=True)
+        return totales[:limite]
+
+    def idle_peers(self, segundos=TELEMETRIA_INACTIVO_SEGUNDOS):
+        """
+        Devuelve [(public_key, último_handshake)] de los peers sin handshake
+        en los últimos `segundos` (0 = nunca se conectó), del más antiguo al más reciente.
+        """
+        limite = self.reloj() - segundos
+        with self._lock:
+            inactivos = [(clave, uso.handshake) for clave, uso in self._peers.items() if uso.handshake < limite]
+        return sorted(inactivos, key=lambda t: t[1])
+
+    def start(self):
+        """
+        Inicia el hilo de muestreo (solo una vez).
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"⚠️ Error al muestrear el tráfico de las interfaces: {e}")
+            time.sleep(self.intervalo)
+
+
+_sampler = TelemetrySampler()
+
+
+def get_telemetry() -> TelemetrySampler:
+    return _sampler
+
+
+def start_telemetry():
+    """Inicia el muestreo de tráfico (idempotente)."""
+    _sampler.start()
+    return _sampler
+
+
+def formato_bytes(n: int) -> str:
+    for unidad in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.0f} {unidad}" if unidad == "B" else f"{n:.1f} {unidad}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def formato_handshake(ts: int, ahora: float = None) -> str:
+    if not ts:
+        return "nunca"
+    horas = ((ahora or time.time()) - ts) / 3600
+    return f"hace {horas:.0f} h" if horas < 48 else f"hace {horas / 24:.0f} días"
@@ -0,0 +1,102 @@
+# test_backup.py
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import backup
+import storage
+
+
+@pytest.fixture
+def respaldos(base, monkeypatch):
+    """Carpeta de .conf temporal, nombres de archivo distintos y sin recarga de interfaces."""
+    configs = base / "configs"
+    configs.mkdir()
+    monkeypatch.setattr(backup, "WG_CONFIG_DIR", str(configs))
+    monkeypatch.setattr(backup, "_recargar", lambda bajas=(): None)
+
+    reloj = [datetime(2026, 1, 1)]
+
+    class Fecha(datetime):
+        @classmethod
+        def utcnow(cls):
+            reloj[0] += timedelta(seconds=1)
+            return reloj[0]
+
+    monkeypatch.setattr(backup, "datetime", Fecha)
+    partes = {}
+
+    def crear(incremental=False):
+        manifiesto = backup.create_backup(lambda nombre, datos: partes.__setitem__(nombre, datos), incremental)
+        return [(n, d) for n, d in partes.items() if n.startswith(manifiesto["archivo"])]
+
+    return configs, crear
+
+
+def _cliente(ip):
+    return {"ip": ip, "public_key": f"clave-{ip}", "vencimiento": "2030-01-01 00:00:00"}
+
+
+def test_completo_e_incremental_sobre_una_base_existente(respaldos):
+    configs, crear = respaldos
+    storage.insert_users({"ana": _cliente("10.9.0.2"), "beto": _cliente("10.9.0.3")})
+    (configs / "ana.conf").write_text("ana v1")
+    completo = crear()
+
+    storage.insert_user("caro", _cliente("10.9.0.4"))
+    storage.pop_user("beto")
+    incremental = crear(incremental=True)
+
+    # La base cambió después del último respaldo
+    storage.insert_user("dani", _cliente("10.9.0.5"))
+    storage.pop_user("ana")
+    (configs / "ana.conf").write_text("ana modificado")
+
+    resultado = backup.restore_backup(completo + incremental)
+    assert resultado["clientes"] == 2
+    assert sorted(storage.load_users()) == ["ana", "caro"]
+    assert (configs / "ana.conf").read_text() == "ana v1"
+    # La base ya no sigue la cadena: el próximo incremental será completo
+    assert storage.get_state("respaldo_ultimo") is None
+
+
+@pytest.mark.parametrize("cadena", ["sin_completo", "falta_un_incremental"])
+def test_cadena_rota_no_escribe_nada(respaldos, cadena):
+    configs, crear = respaldos
+    storage.insert_user("ana", _cliente("10.9.0.2"))
+    (configs / "ana.conf").write_text("ana v1")
+    completo = crear()
+    storage.insert_user("beto", _cliente("10.9.0.3"))
+    primero = crear(incremental=True)
+    storage.insert_user("caro", _cliente("10.9.0.4"))
+    segundo = crear(incremental=True)
+
+    storage.insert_user("dani", _cliente("10.9.0.5"))
+    (configs / "ana.conf").write_text("ana actual")
+    antes = storage.load_users()
+
+    partes = primero + segundo if cadena == "sin_completo" else completo + segundo
+    with pytest.raises(ValueError):
+        backup.restore_backup(partes)
+    assert storage.load_users() == antes
+    assert (configs / "ana.conf").read_text() == "ana actual"
+
+
+def test_error_en_la_base_no_escribe_archivos(respaldos, monkeypatch):
+    configs, crear = respaldos
+    storage.insert_user("ana", _cliente("10.9.0.2"))
+    storage.add_stats_snapshot(1, {"clientes": 1})  # con historial, para llegar a add_stats_snapshot
+    (configs / "ana.conf").write_text("ana v1")
+    completo = crear()
+    storage.insert_user("beto", _cliente("10.9.0.3"))
+    (configs / "ana.conf").write_text("ana actual")
+
+    def falla(*args):
+        raise RuntimeError("disco lleno")
+
+    monkeypatch.setattr(backup, "add_stats_snapshot", falla)
+    with pytest.raises(RuntimeError):
+        backup.restore_backup(completo)
+    assert sorted(storage.load_users()) == ["ana", "beto"]  # la transacción se deshizo
+    assert (configs / "ana.conf").read_text() == "ana actual"
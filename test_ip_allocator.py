@@ -0,0 +1,108 @@
+# test_ip_allocator.py
+
+import pytest
+
+import storage
+from ip_allocator import IPAllocator
+
+CLAVE = "ip_allocator:prueba"
+
+
+def _nuevo(cidr="10.9.0.0/24", capacidad=None):
+    allocator = IPAllocator(cidr, CLAVE, capacidad)
+    allocator.load([])
+    return allocator
+
+
+def _estado(allocator):
+    return allocator._cursor, list(allocator._libres), set(allocator._arriba), allocator.en_uso
+
+
+def test_reservar_liberar_y_reservar(base):
+    allocator = _nuevo()
+    ips = [allocator.reserve() for _ in range(3)]
+    assert ips == ["10.9.0.2", "10.9.0.3", "10.9.0.4"]
+
+    allocator.release("10.9.0.3")
+    allocator.release("10.9.0.3")  # ya liberada: se ignora
+    assert allocator.en_uso == 2
+    assert storage.ip_offsets(CLAVE) == {3: IPAllocator.LIBRE}
+
+    assert allocator.reserve() == "10.9.0.3"  # primero las liberadas
+    assert allocator.reserve() == "10.9.0.5"
+    assert storage.ip_offsets(CLAVE) == {}
+    assert storage.get_state(CLAVE) == {"red": "10.9.0.0/24", "cursor": 6}
+
+
+def test_sin_ips_disponibles(base):
+    allocator = _nuevo(capacidad=2)
+    allocator.reserve_many(2)
+    with pytest.raises(RuntimeError):
+        allocator.reserve()
+
+
+def test_claim_por_encima_del_cursor(base):
+    allocator = _nuevo()
+    allocator.reserve()                              # .2
+    assert allocator.claim("10.9.0.5")
+    assert not allocator.claim("10.9.0.5")           # ya en uso
+    assert not allocator.claim("192.168.1.5")        # otra subred
+    assert allocator._arriba == {5}
+    assert allocator.en_uso == 2
+    assert storage.ip_offsets(CLAVE) == {5: IPAllocator.OCUPADO}
+
+    # Las saltadas se entregan en orden y el cursor salta la reclamada
+    assert [allocator.reserve() for _ in range(3)] == ["10.9.0.3", "10.9.0.4", "10.9.0.6"]
+    assert allocator._arriba == set()
+    assert storage.ip_offsets(CLAVE) == {}
+
+    allocator.release("10.9.0.4")
+    assert allocator.claim("10.9.0.4")               # liberada: se vuelve a tomar
+    assert allocator.en_uso == 5
+
+
+def test_recarga_restaura_el_mismo_estado(base):
+    allocator = _nuevo()
+    usados = allocator.reserve_many(6)
+    allocator.release_many([usados[1], usados[4]])
+    allocator.claim("10.9.0.40")
+    en_uso = [ip for ip in usados if ip not in (usados[1], usados[4])] + ["10.9.0.40"]
+
+    recargado = IPAllocator("10.9.0.0/24", CLAVE)
+    recargado.load(en_uso)
+    assert _estado(recargado) == (allocator._cursor, sorted(allocator._libres, reverse=True),
+                                  allocator._arriba, allocator.en_uso)
+    assert recargado.reserve() == "10.9.0.3"  # la más baja de las liberadas
+
+
+def test_estado_inconsistente_reconstruye(base):
+    allocator = _nuevo()
+    allocator.reserve_many(3)
+    # Un alta que no llegó a guardarse: el cliente tiene una IP que el estado da por libre
+    allocator.release("10.9.0.3")
+
+    recargado = IPAllocator("10.9.0.0/24", CLAVE)
+    recargado.load(["10.9.0.2", "10.9.0.3", "10.9.0.4", "10.9.0.60"])
+    assert recargado._cursor == 5
+    assert recargado._libres == []
+    assert recargado._arriba == {60}
+    assert recargado.en_uso == 4
+    assert storage.ip_offsets(CLAVE) == {60: IPAllocator.OCUPADO}
+    assert recargado.reserve() == "10.9.0.5"
+
+
+def test_formato_anterior_reconstruye(base):
+    storage.set_state(CLAVE, {"red": "10.9.0.0/24", "cursor": 5, "libres": [3]})
+    allocator = IPAllocator("10.9.0.0/24", CLAVE)
+    allocator.load(["10.9.0.2", "10.9.0.4"])
+    assert allocator.en_uso == 2
+    assert allocator.reserve() == "10.9.0.3"
+    assert "libres" not in storage.get_state(CLAVE)
+
+
+def test_reconstruir_no_recorre_los_huecos(base):
+    allocator = IPAllocator("fd00::/64", CLAVE)
+    allocator.load(["fd00::2", "fd00::ffff:ffff:ffff"])
+    assert allocator._libres == []
+    assert allocator.en_uso == 2
+    assert allocator.reserve() == "fd00::3"
@@ -0,0 +1,117 @@
+# test_quota.py
+
+import pytest
+
+import notifications
+import quota
+import storage
+from wg_sync import Peer, Snapshot
+
+PLAN = "Free (5 horas)"
+GB = 1024 ** 3
+
+
+@pytest.fixture
+def motor(base, monkeypatch):
+    """Motor de cuotas con las cargas de reglas y los avisos registrados (sin iptables)."""
+    avisos, cargas = [], []
+    monkeypatch.setattr(notifications, "enviar_aviso_cuota", lambda nombre, usado, cuota, accion: avisos.append(nombre))
+    storage.insert_users({
+        "ana": {"ip": "10.9.0.2", "public_key": "K1", "plan": PLAN, "vencimiento": "2030-01-01 00:00:00"},
+        "beto": {"ip": "10.9.0.3", "public_key": "K2", "plan": PLAN, "vencimiento": "2030-01-01 00:00:00"},
+    })
+    engine = quota.QuotaEngine(accion=quota.LIMITAR, avisos=(0.8, 1.0), aplicar=lambda ips: cargas.append(set(ips)))
+    return engine, avisos, cargas
+
+
+def _dump(*peers, faltantes=()):
+    """peers: (clave, handshake, rx, tx)."""
+    return Snapshot([Peer(k, None, (), hs, rx, tx, 0) for k, hs, rx, tx in peers], faltantes=faltantes)
+
+
+def test_acumula_contadores_crecientes(motor):
+    engine, avisos, cargas = motor
+    engine.observe(_dump(("K1", 100, 500, 500)))  # primera vez: no cuenta lo anterior
+    engine.observe(_dump(("K1", 100, 800, 900)))
+    engine.observe(_dump(("K1", 220, 1000, 1000)))
+    assert engine.usage("K1") == 1000
+    assert avisos == [] and cargas == []  # nada que limitar: iptables no se toca
+
+
+def test_contador_menor_es_un_reinicio(motor):
+    engine, _, _ = motor
+    engine.observe(_dump(("K1", 100, 1000, 1000)))
+    engine.observe(_dump(("K1", 100, 3000, 2000)))   # +3000
+    engine.observe(_dump(("K1", 100, 200, 100)))     # interfaz recreada: +300
+    assert engine.usage("K1") == 3300
+
+
+def test_handshake_que_retrocede_es_un_reinicio(motor):
+    engine, _, _ = motor
+    engine.observe(_dump(("K1", 500, 1000, 1000)))
+    # Peer recreado: sus contadores volvieron a cero y ya superaron los anteriores
+    engine.observe(_dump(("K1", 400, 1500, 1200)))
+    assert engine.usage("K1") == 2700
+
+
+def test_peer_que_vuelve_tras_suspenderse(motor):
+    engine, _, _ = motor
+    engine.observe(_dump(("K1", 100, 1000, 1000), ("K2", 100, 0, 0)))
+    engine.observe(_dump(("K2", 100, 0, 0)))                          # K1 quitado de la interfaz
+    engine.observe(_dump(("K1", 900, 1200, 1300), ("K2", 100, 0, 0)))  # reanudado: todo es nuevo
+    assert engine.usage("K1") == 2500
+
+
+def test_interfaz_sin_leer_no_reinicia(motor):
+    engine, _, _ = motor
+    engine.observe(_dump(("K1", 100, 1000, 1000)))
+    engine.observe(_dump(faltantes={"wg0"}))
+    engine.observe(_dump(("K1", 100, 1500, 1000)))
+    assert engine.usage("K1") == 500
+
+
+def test_avisos_y_limite(motor):
+    engine, avisos, cargas = motor
+    engine.observe(_dump(("K1", 100, 0, 0), ("K2", 100, 0, 0)))
+    engine.observe(_dump(("K1", 100, int(0.85 * GB), 0), ("K2", 100, 10, 0)))
+    assert avisos == ["ana"] and cargas == []
+    engine.observe(_dump(("K1", 100, GB, 0), ("K2", 100, 20, 0)))
+    assert avisos == ["ana", "ana"]
+    assert cargas == [{"10.9.0.2"}]
+    assert engine.limitados() == {"10.9.0.2"}
+
+    # Más tráfico del ya limitado: el conjunto no cambia y no se recargan las reglas
+    engine.observe(_dump(("K1", 100, GB + 100, 0), ("K2", 100, 30, 0)))
+    assert len(cargas) == 1
+
+    # Renovación: se pone en cero y se quita el límite
+    engine.reset("K1")
+    assert cargas[-1] == set()
+    assert engine.limitados() == set()
+
+
+def test_el_limite_sobrevive_a_un_reinicio(motor):
+    engine, _, cargas = motor
+    engine.observe(_dump(("K1", 100, 0, 0)))
+    engine.observe(_dump(("K1", 100, GB, 0)))
+    nuevo = quota.QuotaEngine(accion=quota.LIMITAR, aplicar=lambda ips: cargas.append(set(ips)))
+    assert nuevo.usage("K1") == GB
+    assert nuevo.limitados() == {"10.9.0.2"}
+
+
+def test_solo_se_revisan_los_peers_que_cambiaron(motor, monkeypatch):
+    engine, _, _ = motor
+    engine.observe(_dump(("K1", 100, 0, 0), ("K2", 100, 0, 0)))
+    consultados = []
+    buscar = quota.find_user_by_public_key
+    monkeypatch.setattr(quota, "find_user_by_public_key", lambda clave: consultados.append(clave) or buscar(clave))
+    engine.observe(_dump(("K1", 100, 50, 0), ("K2", 100, 0, 0)))
+    assert consultados == ["K1"]
+
+
+def test_se_olvidan_los_clientes_eliminados(motor):
+    engine, _, _ = motor
+    engine.observe(_dump(("K1", 100, 0, 0), ("K2", 100, 0, 0)))
+    storage.pop_user("beto")
+    engine.observe(_dump(("K1", 100, 0, 0)))
+    assert "cuota_uso:K2" not in storage.get_states("cuota_uso:")
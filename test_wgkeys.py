@@ -0,0 +1,77 @@
+# test_wgkeys.py
+
+import base64
+import shutil
+import subprocess
+
+import pytest
+
+import wgkeys
+
+# Vectores del RFC 7748 (sección 5.2): escalar, coordenada u, resultado
+VECTORES = [
+    ("a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4",
+     "e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c",
+     "c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552"),
+    ("4b66e9d4d1b4673c5ad22691957d6af5c11b6421e0ea01d42ca4169e7918ba0d",
+     "e5210f12786811d3f4b7959d0538ae2c31dbe7106fc03c3efc4cd549c715a493",
+     "95cbde9476e8907d7aade45cb4b873f88b595a68799fa152e6f8f7647aac7957"),
+]
+
+# Intercambio Diffie-Hellman del RFC 7748 (sección 6.1): (privada, pública)
+ALICE = ("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a",
+         "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a")
+BOB = ("5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb",
+       "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f")
+SECRETO = "4a5d9d5ba4ce2de1728e3bf480350f25e07e21c947d19e3376f09b3c1e161742"
+
+
+def _b64(hexa):
+    return base64.b64encode(bytes.fromhex(hexa)).decode()
+
+
+@pytest.mark.parametrize("escalar,u,esperado", VECTORES)
+def test_x25519_vectores_rfc7748(escalar, u, esperado):
+    assert wgkeys.x25519(bytes.fromhex(escalar), bytes.fromhex(u)).hex() == esperado
+
+
+def test_x25519_iterado():
+    k = u = (9).to_bytes(32, "little")
+    k, u = wgkeys.x25519(k, u), k
+    assert k.hex() == "422c8e7a6227d7bca1350b3e2bb7279f7897b87bb6854b783c60e80311ae3079"
+
+
+@pytest.mark.parametrize("privada,publica", [ALICE, BOB])
+def test_clave_publica_rfc7748(privada, publica):
+    assert wgkeys.public_key_from_private(_b64(privada)) == _b64(publica)
+
+
+@pytest.mark.parametrize("privada,publica", [ALICE, BOB])
+def test_clave_publica_sin_cryptography(monkeypatch, privada, publica):
+    monkeypatch.setattr(wgkeys, "X25519PrivateKey", None)
+    assert wgkeys.public_key_from_private(_b64(privada)) == _b64(publica)
+
+
+def test_secreto_compartido():
+    secreto = wgkeys.x25519(bytes.fromhex(ALICE[0]), bytes.fromhex(BOB[1]))
+    assert secreto.hex() == SECRETO
+    assert wgkeys.x25519(bytes.fromhex(BOB[0]), bytes.fromhex(ALICE[1])) == secreto
+
+
+def test_generate_keypair_formato():
+    privada, publica = wgkeys.generate_keypair()
+    raw = base64.b64decode(privada)
+    assert len(privada) == len(publica) == 44
+    assert raw[0] & 7 == 0 and raw[31] & 0xC0 == 0x40  # ya "clamped", como `wg genkey`
+    assert wgkeys.public_key_from_private(privada) == publica
+
+
+@pytest.mark.skipif(shutil.which("wg") is None, reason="wg no está instalado")
+@pytest.mark.parametrize("sin_cryptography", [False, True])
+def test_igual_que_wg_pubkey(monkeypatch, sin_cryptography):
+    if sin_cryptography:
+        monkeypatch.setattr(wgkeys, "X25519PrivateKey", None)
+    for _ in range(20):
+        privada = wgkeys.generate_private_key()
+        esperado = subprocess.run(["wg", "pubkey"], input=privada.encode(), capture_output=True, check=True).stdout
+        assert (wgkeys.public_key_from_private(privada) + "\n").encode() == esperado
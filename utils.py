@@ -3,19 +3,14 @@
 import os
 import json
 import subprocess
-import qrcode
-from datetime import datetime
-from threading import Timer
 
-from config import (
-    WG_CONFIG_DIR,
-    SERVER_PUBLIC_KEY,
-    SERVER_ENDPOINT,
-    WG_PORT,
-    WG_NETWORK_RANGE,
-    ADMIN_ID
-)
-from storage import load_users, save_users
+from config import WG_CONFIG_DIR
+from storage import load_users
+from wgkeys import generate_keypair
+from ip_allocator import allocator_for_ip
+from servers import get_registry, interfaz_de
+from qr_service import qr_image
+from wgconf import render_config
 
 
 def get_used_ips():
@@ -28,15 +23,19 @@ def get_used_ips():
 
 def get_next_ip():
     """
-    Busca la próxima IP disponible dentro del rango 10.9.0.2 - 10.9.0.254.
+    Reserva la próxima IP disponible en la interfaz con menor ocupación
+    (ver servers.py). Si la IP no llega a guardarse, debe devolverse con release_ip().
     """
-    used_ips = get_used_ips()
-    base_ip = "10.9.0."
-    for i in range(2, 255):
-        ip = f"{base_ip}{i}"
-        if ip not in used_ips:
-            return ip
-    raise RuntimeError("🚫 No hay IPs disponibles. Todas las direcciones están en uso.")
+    return get_registry().reserve()[0][1]
+
+
+def release_ip(ip: str):
+    """
+    Devuelve una IP al asignador (al eliminar o vencer un cliente).
+    """
+    allocator = allocator_for_ip(ip) if ip else None
+    if allocator is not None:
+        allocator.release(ip)
 
 
 def generate_keys():
@@ -44,19 +43,8 @@ def generate_keys():
     Genera claves privada y pública para WireGuard.
     """
     try:
-        private_key = subprocess.check_output(['wg', 'genkey']).decode().strip()
-        public_key = subprocess.run(
-            ['wg', 'pubkey'],
-            input=private_key.encode(),
-            capture_output=True,
-            check=True
-        ).stdout.decode().strip()
-
-        if not private_key or not public_key:
-            raise ValueError("Error al generar claves WireGuard.")
-        return private_key, public_key
-
-    except subprocess.CalledProcessError as e:
+        return generate_keypair()
+    except (ValueError, subprocess.CalledProcessError) as e:
         raise RuntimeError(f"❌ Error generando claves: {e}")
 
 
@@ -64,21 +52,12 @@ def generate_wg_config(client_name: str, vencimiento: str) -> dict:
     """
     Genera el archivo .conf de un cliente y devuelve su info.
     """
+    ip = None
     try:
         ip = get_next_ip()
         private_key, public_key = generate_keys()
 
-        config_text = f"""[Interface]
-PrivateKey = {private_key}
-Address = {ip}/32
-DNS = 1.1.1.1
-
-[Peer]
-PublicKey = {SERVER_PUBLIC_KEY}
-Endpoint = {SERVER_ENDPOINT}:{WG_PORT}
-AllowedIPs = {WG_NETWORK_RANGE}
-PersistentKeepalive = 25
-"""
+        config_text = render_config(private_key, ip)
 
         os.makedirs(WG_CONFIG_DIR, exist_ok=True)
         conf_path = os.path.join(WG_CONFIG_DIR, f"{client_name}.conf")
@@ -88,27 +67,27 @@ PersistentKeepalive = 25
 
         return {
             "ip": ip,
+            "interfaz": interfaz_de(ip),
             "private_key": private_key,
             "public_key": public_key,
-            "conf_path": conf_path
+            "conf_path": conf_path,
+            "config_text": config_text
         }
 
     except Exception as e:
+        release_ip(ip)
         raise RuntimeError(f"⚠️ No se pudo generar la configuración: {e}")
 
 
 def generate_qr_code(conf_path: str):
     """
-    Genera y guarda un QR desde un archivo .conf.
+    Genera el QR de un archivo .conf en memoria (ver qr_service.py).
+    Si ya se tiene el texto del .conf, es mejor usar qr_image() directamente.
     """
     try:
         with open(conf_path, "r") as f:
             config_text = f.read()
-
-        qr = qrcode.make(config_text)
-        qr_path = conf_path.replace(".conf", "_qr.png")
-        qr.save(qr_path)
-        return qr_path
+        return qr_image(config_text)
     except Exception as e:
         raise RuntimeError(f"❌ Error al generar el QR: {e}")
 
@@ -136,30 +115,8 @@ def guardar_archivo(ruta: str, contenido: str):
 
 def schedule_expiration_check(bot):
     """
-    Revisa cada 60 minutos si hay configuraciones vencidas.
-    Si lo están, las elimina y notifica al administrador.
-    """
-    def check_expired():
-        users = load_users()
-        now = datetime.utcnow()
-        activos = {}
-
-        for nombre, datos in users.items():
-            vencimiento = datetime.strptime(datos["vencimiento"], "%Y-%m-%d %H:%M:%S")
-            if vencimiento > now:
-                activos[nombre] = datos
-            else:
-                delete_conf(nombre)
-                try:
-                    bot.send_message(
-                        ADMIN_ID,
-                        f"⛔️ Configuración vencida: <b>{nombre}</b>\n🧾 IP: {datos['ip']}",
-                        parse_mode="HTML"
-                    )
-                except:
-                    pass
-
-        save_users(activos)
-        Timer(3600, check_expired).start()  # Repetir cada 60 minutos
-
-    check_expired()
+    Inicia el planificador de vencimientos (ver scheduler.py).
+    Los avisos y vencimientos se disparan en su momento exacto, sin revisiones periódicas.
+    """
+    from scheduler import start_scheduler  # importación local: scheduler depende de utils
+    return start_scheduler(bot)
@@ -0,0 +1,378 @@
+# wg_sync.py
+
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from config import (
+    WG_INTERFACE,
+    WG_SUDO,
+    WG_SYNC_DEBOUNCE_SEGUNDOS,
+    WG_SYNC_MAX_ESPERA_SEGUNDOS,
+    WG_SYNC_ELIMINAR_DESCONOCIDOS,
+    WG_DUMP_TTL_SEGUNDOS
+)
+from storage import load_users, get_state, set_state, transaction
+from ip_allocator import get_allocator
+from servers import get_registry
+from metrics import medir
+
+WG_BIN = shutil.which("wg") or "wg"
+
+# Límite de peers por invocación de `wg set` (para no exceder ARG_MAX)
+MAX_PEERS_POR_LLAMADA = 2000
+
+# Estado persistente: claves públicas de clientes quitados por el bot cuyo
+# peer falta sacar de su interfaz (sobreviven a un reinicio)
+CLAVE_BAJAS = "wg_bajas_pendientes"
+
+
+def run_wg(args, input_text=None, sudo=False):
+    """
+    Ejecuta `wg` con los argumentos dados y devuelve stdout.
+    Lanza RuntimeError si el comando falla.
+    """
+    cmd = (["sudo"] if sudo else []) + [WG_BIN] + list(args)
+    with medir("wg_comando_segundos", "Duración de las llamadas a wg", comando=args[0]):
+        result = subprocess.run(cmd, input=input_text, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"❌ Error ejecutando {' '.join(cmd[:3])}: {result.stderr.strip()}")
+    return result.stdout
+
+
+class Peer(NamedTuple):
+    """
+    Un peer de `wg show <interfaz> dump`.
+    """
+    public_key: str
+    endpoint: Optional[str]
+    allowed_ips: tuple
+    latest_handshake: int      # timestamp UNIX, 0 = nunca
+    rx_bytes: int
+    tx_bytes: int
+    persistent_keepalive: int  # segundos, 0 = desactivado
+
+
+def _host(ip: str) -> str:
+    """'10.9.0.2/32' -> '10.9.0.2'."""
+    return ip.split("/", 1)[0]
+
+
+class Snapshot:
+    """
+    Estado de la interfaz en un momento dado, indexado por clave pública y por IP.
+
+    En el estado combinado (get_all_snapshots), `origen` indica la interfaz
+    de cada peer y `faltantes` las interfaces que no se pudieron leer: sus
+    peers no aparecen, pero no por eso dejaron de existir.
+    """
+
+    def __init__(self, peers, tomado=None, origen=None, faltantes=frozenset()):
+        self.peers = {p.public_key: p for p in peers}
+        self.by_ip = {_host(ip): p for p in self.peers.values() for ip in p.allowed_ips}
+        self.tomado = time.monotonic() if tomado is None else tomado
+        self.origen = origen or {}
+        self.faltantes = frozenset(faltantes)
+
+    def peer(self, public_key: str) -> Optional[Peer]:
+        return self.peers.get(public_key)
+
+    def peer_by_ip(self, ip: str) -> Optional[Peer]:
+        """Acepta la IP con o sin prefijo ('10.9.0.2' o '10.9.0.2/32')."""
+        return self.by_ip.get(_host(ip))
+
+    def ips(self) -> set:
+        return set(self.by_ip)
+
+    def __len__(self):
+        return len(self.peers)
+
+
+def parse_dump(texto: str) -> Snapshot:
+    """
+    Convierte la salida de `wg show <interfaz> dump` en un Snapshot.
+    La primera línea describe la interfaz; cada una de las demás es un peer
+    (campos separados por tabuladores).
+    """
+    peers = []
+    for line in texto.strip().splitlines()[1:]:
+        parts = line.split("\t")
+        if len(parts) < 8:
+            continue
+        clave, _psk, endpoint, allowed, handshake, rx, tx, keepalive = parts[:8]
+        peers.append(Peer(
+            public_key=clave,
+            endpoint=None if endpoint == "(none)" else endpoint,
+            allowed_ips=() if allowed == "(none)" else tuple(allowed.split(",")),
+            latest_handshake=int(handshake),
+            rx_bytes=int(rx),
+            tx_bytes=int(tx),
+            persistent_keepalive=0 if keepalive == "off" else int(keepalive),
+        ))
+    return Snapshot(peers)
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()  # solo protege los dos dicts, nunca se toma durante un `wg show`
+_lecturas = {}  # interfaz -> Lock de su lectura en curso
+
+
+def _vigente(interface, max_edad, desde=None):
+    """Dump en caché si sirve: con menos de `max_edad` segundos o tomado después de `desde`."""
+    with _snapshots_lock:
+        snap = _snapshots.get(interface)
+    if snap is None:
+        return None
+    if time.monotonic() - snap.tomado < max_edad or (desde is not None and snap.tomado >= desde):
+        return snap
+    return None
+
+
+def get_snapshot(interface=WG_INTERFACE, max_edad=WG_DUMP_TTL_SEGUNDOS) -> Snapshot:
+    """
+    Devuelve el estado de la interfaz, reutilizando el último dump si tiene
+    menos de `max_edad` segundos (max_edad=0 fuerza una lectura nueva).
+    Cada interfaz tiene su propio lock: las llamadas concurrentes sobre la
+    misma interfaz comparten un solo `wg show` (quien espera usa el dump
+    que se tomó mientras esperaba) y las demás interfaces no se bloquean.
+    """
+    snap = _vigente(interface, max_edad)
+    if snap is not None:
+        return snap
+    pedido = time.monotonic()
+    with _snapshots_lock:
+        lectura = _lecturas.setdefault(interface, threading.Lock())
+    with lectura:
+        snap = _vigente(interface, max_edad, desde=pedido)
+        if snap is None:
+            snap = parse_dump(run_wg(["show", interface, "dump"]))
+            with _snapshots_lock:
+                _snapshots[interface] = snap
+        return snap
+
+
+def invalidate_snapshot(interface=WG_INTERFACE):
+    """Descarta el dump en caché (tras modificar la interfaz)."""
+    with _snapshots_lock:
+        _snapshots.pop(interface, None)
+
+
+def for_each_interface(funcion) -> dict:
+    """
+    Ejecuta funcion(interfaz) para todas las interfaces a la vez (un hilo por
+    interfaz). Devuelve {interfaz: resultado}; si falla, el resultado es la excepción.
+    """
+    interfaces = get_registry().interfaces()
+    if len(interfaces) == 1:
+        try:
+            return {interfaces[0]: funcion(interfaces[0])}
+        except Exception as e:
+            return {interfaces[0]: e}
+
+    with ThreadPoolExecutor(max_workers=len(interfaces)) as pool:
+        futuros = {i: pool.submit(funcion, i) for i in interfaces}
+    resultados = {}
+    for interfaz, futuro in futuros.items():
+        try:
+            resultados[interfaz] = futuro.result()
+        except Exception as e:
+            resultados[interfaz] = e
+    return resultados
+
+
+def get_all_snapshots(max_edad=WG_DUMP_TTL_SEGUNDOS) -> Snapshot:
+    """
+    Estado combinado de todas las interfaces (los dumps se leen en paralelo).
+    Si una interfaz no se puede leer se usa su último dump, si lo hay; si
+    no, queda en `faltantes` del resultado.
+    """
+    peers, origen, faltantes = [], {}, set()
+    for interfaz, snap in for_each_interface(lambda i: get_snapshot(i, max_edad)).items():
+        if isinstance(snap, Exception):
+            print(f"⚠️ No se pudo leer {interfaz}: {snap}")
+            with _snapshots_lock:
+                snap = _snapshots.get(interfaz)
+            if snap is None:
+                faltantes.add(interfaz)
+                continue
+        peers.extend(snap.peers.values())
+        origen.update(dict.fromkeys(snap.peers, interfaz))
+    return Snapshot(peers, origen=origen, faltantes=faltantes)
+
+
+def current_peers(interface=WG_INTERFACE, max_edad=0):
+    """
+    Devuelve {public_key: allowed_ips} de los peers activos en la interfaz (un solo dump).
+    """
+    return {k: ",".join(p.allowed_ips) for k, p in get_snapshot(interface, max_edad).peers.items()}
+
+
+def desired_peers(interface=WG_INTERFACE):
+    """
+    Devuelve {public_key: allowed_ips} según los clientes guardados de la interfaz.
+    """
+    sufijo = get_allocator(interface).sufijo
+    peers = {}
+    for datos in load_users(interface).values():
+        pubkey, ip = datos.get("public_key"), datos.get("ip")
+        if pubkey and ip and not datos.get("expirado", False):
+            peers[pubkey] = f"{ip}{sufijo}"
+    return peers
+
+
+def diff_peers(deseados: dict, actuales: dict, eliminar_desconocidos=WG_SYNC_ELIMINAR_DESCONOCIDOS, quitar=()):
+    """
+    Calcula (altas, bajas): altas = {public_key: allowed_ips}, bajas = [public_key].
+    Sin `eliminar_desconocidos`, solo se dan de baja los peers de `quitar`.
+    """
+    altas = {k: ips for k, ips in deseados.items() if actuales.get(k) != ips}
+    bajas = [k for k in actuales if k not in deseados and (eliminar_desconocidos or k in quitar)]
+    return altas, bajas
+
+
+def apply_changes(altas: dict, bajas: list, interface=WG_INTERFACE):
+    """
+    Aplica todas las altas y bajas con una sola llamada a `wg set`
+    (varias solo si se supera MAX_PEERS_POR_LLAMADA).
+    """
+    clausulas = [["peer", k, "allowed-ips", ips] for k, ips in altas.items()]
+    clausulas += [["peer", k, "remove"] for k in bajas]
+
+    try:
+        for i in range(0, len(clausulas), MAX_PEERS_POR_LLAMADA):
+            args = ["set", interface]
+            for clausula in clausulas[i:i + MAX_PEERS_POR_LLAMADA]:
+                args.extend(clausula)
+            run_wg(args, sudo=WG_SUDO)
+    finally:
+        if clausulas:
+            invalidate_snapshot(interface)
+
+
+def reconcile(interface=WG_INTERFACE, quitar=None):
+    """
+    Sincroniza la interfaz con la base de datos: un dump, un diff y un `wg set`.
+    `quitar` son las claves de clientes quitados por el bot (por defecto, las pendientes).
+    Devuelve (altas, bajas) aplicadas.
+    """
+    if quitar is None:
+        quitar = set(get_state(CLAVE_BAJAS, []))
+    deseados, actuales = desired_peers(interface), current_peers(interface)
+    altas, bajas = diff_peers(deseados, actuales, quitar=quitar)
+    if altas or bajas:
+        apply_changes(altas, bajas, interface)
+        print(f"🔄 {interface}: {len(altas)} peers agregados/actualizados, {len(bajas)} eliminados.")
+    desconocidos = len(actuales) - len(bajas) - sum(1 for k in actuales if k in deseados)
+    if desconocidos and _desconocidos.get(interface) != desconocidos:
+        print(f"ℹ️ {interface}: se conservan {desconocidos} peers no registrados en la base "
+              f"(se quitarían con WG_SYNC_ELIMINAR_DESCONOCIDOS = True).")
+    _desconocidos[interface] = desconocidos
+    return altas, bajas
+
+
+_desconocidos = {}  # interfaz -> peers no registrados ya informados
+
+
+def reconcile_all() -> dict:
+    """
+    Reconcilia todas las interfaces en paralelo. Un error en una interfaz no
+    detiene a las demás. Devuelve {interfaz: (altas, bajas) o excepción}.
+    """
+    pendientes = set(get_state(CLAVE_BAJAS, []))
+    resultados = for_each_interface(lambda interfaz: reconcile(interfaz, pendientes))
+    errores = False
+    for interfaz, resultado in resultados.items():
+        if isinstance(resultado, Exception):
+            errores = True
+            print(f"⚠️ Error al sincronizar {interfaz}: {resultado}")
+    if pendientes and not errores:
+        # Ya no están en ninguna interfaz (se conservan las que llegaron mientras tanto)
+        with transaction():
+            set_state(CLAVE_BAJAS, sorted(set(get_state(CLAVE_BAJAS, [])) - pendientes))
+    return resultados
+
+
+def apply_by_interface(altas: dict):
+    """
+    Como apply_changes (solo altas), pero reparte los peers entre las interfaces
+    según la subred de cada IP: una llamada a `wg set` por interfaz afectada.
+    """
+    registro = get_registry()
+    por_interfaz = {}
+    for clave, ips in altas.items():
+        servidor = registro.for_ip(ips) or registro.default
+        por_interfaz.setdefault(servidor.interfaz, {})[clave] = ips
+    for interfaz, grupo in por_interfaz.items():
+        apply_changes(grupo, [], interfaz)
+
+
+class SyncQueue:
+    """
+    Cola con retardo: varias solicitudes seguidas se agrupan en una sola
+    reconciliación. Con solicitudes continuas, la reconciliación no se
+    pospone más de `max_espera` segundos desde la primera pendiente.
+    """
+
+    def __init__(self, espera=WG_SYNC_DEBOUNCE_SEGUNDOS, accion=reconcile_all, max_espera=WG_SYNC_MAX_ESPERA_SEGUNDOS):
+        self.espera = espera
+        self.max_espera = max_espera
+        self.accion = accion
+        self._cond = threading.Condition()
+        self._pendiente_desde = None
+        self._primera = None
+        self._thread = None
+
+    def request(self):
+        """Marca que hay cambios pendientes; se aplican tras `espera` segundos sin nuevos cambios."""
+        with self._cond:
+            self._pendiente_desde = time.monotonic()
+            if self._primera is None:
+                self._primera = self._pendiente_desde
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pendiente_desde is None:
+                    self._cond.wait()
+                # Esperar a que pase el intervalo sin nuevas solicitudes (o la espera máxima)
+                while True:
+                    limite = min(self._pendiente_desde + self.espera, self._primera + self.max_espera)
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(timeout=restante)
+                self._pendiente_desde = self._primera = None
+            try:
+                self.accion()
+            except Exception as e:
+                print(f"⚠️ Error al sincronizar las interfaces: {e}")
+
+
+_queue = SyncQueue()
+
+
+def queue_removals(claves):
+    """
+    Anota las claves públicas de clientes que el bot quitó: la próxima
+    reconciliación saca sus peers aunque no se eliminen los desconocidos.
+    """
+    claves = {c for c in claves if c}
+    if claves:
+        with transaction():
+            set_state(CLAVE_BAJAS, sorted(set(get_state(CLAVE_BAJAS, [])) | claves))
+
+
+def request_sync(bajas=()):
+    """
+    Programa una sincronización de las interfaces (agrupa los cambios de los
+    próximos segundos). `bajas`: ver queue_removals.
+    """
+    queue_removals(bajas)
+    _queue.request()
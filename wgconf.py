@@ -0,0 +1,83 @@
+# wgconf.py
+
+from functools import lru_cache
+from io import BytesIO
+
+from config import WG_NETWORK_RANGE, CLIENT_DNS
+from ip_allocator import get_allocator
+from servers import Server, get_registry
+from artifacts import content_key, get_artifact_cache
+
+_INTERFACE = "[Interface]\nPrivateKey = {}\nAddress = {}\nDNS = " + CLIENT_DNS + "\n\n"
+
+
+@lru_cache(maxsize=None)
+def peer_block(servidor: Server) -> str:
+    """
+    Bloque [Peer] de un servidor: igual para todos sus clientes, se arma una sola vez.
+    """
+    return (
+        "[Peer]\n"
+        f"PublicKey = {servidor.clave_publica}\n"
+        f"Endpoint = {servidor.endpoint}:{servidor.puerto}\n"
+        f"AllowedIPs = {WG_NETWORK_RANGE}\n"
+        "PersistentKeepalive = 25\n"
+    )
+
+
+def _servidor(ip: str) -> Server:
+    registro = get_registry()
+    return registro.for_ip(ip) or registro.default
+
+
+def render_config(private_key: str, ip: str) -> str:
+    """
+    Devuelve el texto del .conf de un cliente (única plantilla del proyecto).
+    El servidor ([Peer]) es el de la interfaz cuya subred contiene la IP.
+    """
+    servidor = _servidor(ip)
+    sufijo = get_allocator(servidor.interfaz).sufijo
+    return _INTERFACE.format(private_key, f"{ip}{sufijo}") + peer_block(servidor)
+
+
+def _clave_config(private_key: str, ip: str) -> str:
+    return content_key("conf", private_key, ip, _INTERFACE, peer_block(_servidor(ip)))
+
+
+def cached_config(private_key: str, ip: str) -> str:
+    """
+    Igual que render_config, pero guardado en la caché de artefactos (solo
+    en memoria): los reenvíos del mismo cliente no vuelven a renderizar.
+    """
+    return get_artifact_cache().get_or_create(
+        _clave_config(private_key, ip), lambda: render_config(private_key, ip).encode()
+    ).decode()
+
+
+def sent_key(tipo: str, *partes) -> str:
+    """Clave del file_id de Telegram de un archivo ya enviado ("tg_conf", "tg_qr")."""
+    return content_key(tipo, *partes)
+
+
+def discard_artifacts(nombre: str, private_key: str, ip: str):
+    """
+    Quita de la caché el .conf, el QR y los file_id enviados de un cliente
+    con esa IP (al eliminarlo, al vencer, al suspenderlo o al cambiarle la IP).
+    """
+    from qr_service import get_qr_service  # importación local: qr_service carga el pool de procesos
+
+    if not private_key or not ip:
+        return
+    config_text = render_config(private_key, ip)
+    cache = get_artifact_cache()
+    cache.discard(_clave_config(private_key, ip))
+    cache.discard(sent_key("tg_conf", nombre, config_text))
+    cache.discard(sent_key("tg_qr", config_text))
+    get_qr_service().discard(config_text)
+
+
+def conf_document(nombre: str, config_text: str) -> BytesIO:
+    """Devuelve el .conf como archivo en memoria, listo para bot.send_document."""
+    bio = BytesIO(config_text.encode())
+    bio.name = f"{nombre}.conf"
+    return bio
@@ -0,0 +1,149 @@
+# wgkeys.py
+
+import os
+import base64
+import shutil
+import subprocess
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except ImportError:  # dependencia opcional: sin ella se usa la implementación de este módulo
+    X25519PrivateKey = None
+
+# Generación de claves WireGuard (Curve25519 / X25519, RFC 7748) sin procesos externos.
+# `wg genkey` / `wg pubkey` quedan como respaldo y como referencia para verificar.
+
+WG_BIN = shutil.which("wg") or "wg"
+
+_P = 2 ** 255 - 19
+_A24 = 121665
+
+
+def _decode_scalar(k: bytes) -> int:
+    k = bytearray(k)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return int.from_bytes(k, "little")
+
+
+def _decode_u(u: bytes) -> int:
+    u = bytearray(u)
+    u[31] &= 127
+    return int.from_bytes(u, "little")
+
+
+def x25519(scalar: bytes, u: bytes) -> bytes:
+    """
+    Multiplicación escalar X25519 (escalera de Montgomery del RFC 7748).
+
+    No es de tiempo constante: los enteros de Python tardan según su valor
+    y el intercambio condicional es una rama. Sirve para generar claves en
+    el propio servidor (nadie puede medir los tiempos), pero si está
+    instalado `cryptography` public_key_from_private usa su X25519.
+    """
+    k = _decode_scalar(scalar)
+    x1 = _decode_u(u)
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+
+    for t in reversed(range(255)):
+        k_t = (k >> t) & 1
+        swap ^= k_t
+        if swap:
+            x2, x3 = x3, x2
+            z2, z3 = z3, z2
+        swap = k_t
+
+        a = (x2 + z2) % _P
+        aa = a * a % _P
+        b = (x2 - z2) % _P
+        bb = b * b % _P
+        e = (aa - bb) % _P
+        c = (x3 + z3) % _P
+        d = (x3 - z3) % _P
+        da = d * a % _P
+        cb = c * b % _P
+        x3 = (da + cb) % _P
+        x3 = x3 * x3 % _P
+        z3 = (da - cb) % _P
+        z3 = x1 * (z3 * z3 % _P) % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e % _P) % _P
+
+    if swap:
+        x2, x3 = x3, x2
+        z2, z3 = z3, z2
+
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+_BASE_POINT = (9).to_bytes(32, "little")
+
+
+def generate_private_key() -> str:
+    """
+    Genera una clave privada en base64, igual que `wg genkey` (ya "clamped").
+    """
+    k = bytearray(os.urandom(32))
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return base64.b64encode(bytes(k)).decode()
+
+
+def public_key_from_private(private_key: str) -> str:
+    """
+    Calcula la clave pública a partir de la privada, igual que `wg pubkey`.
+    """
+    raw = base64.b64decode(private_key.strip())
+    if len(raw) != 32:
+        raise ValueError("❌ La clave privada debe tener 32 bytes.")
+    if X25519PrivateKey is not None:
+        publica = X25519PrivateKey.from_private_bytes(raw).public_key()
+        return base64.b64encode(publica.public_bytes(Encoding.Raw, PublicFormat.Raw)).decode()
+    return base64.b64encode(x25519(raw, _BASE_POINT)).decode()
+
+
+def generate_keypair_wg():
+    """
+    Respaldo: genera el par de claves con el binario `wg` (sin pasar por bash).
+    """
+    private_key = subprocess.check_output([WG_BIN, "genkey"]).decode().strip()
+    public_key = subprocess.run(
+        [WG_BIN, "pubkey"],
+        input=private_key.encode(),
+        capture_output=True,
+        check=True
+    ).stdout.decode().strip()
+    return private_key, public_key
+
+
+def generate_keypair(usar_wg: bool = False):
+    """
+    Devuelve (clave_privada, clave_pública) en base64.
+    Por defecto se calcula en el propio proceso; con usar_wg=True se usa `wg`.
+    """
+    if usar_wg:
+        private_key, public_key = generate_keypair_wg()
+    else:
+        private_key = generate_private_key()
+        public_key = public_key_from_private(private_key)
+
+    if len(private_key) != 44 or len(public_key) != 44:
+        raise ValueError("❌ Las claves deben tener exactamente 44 caracteres base64.")
+    return private_key, public_key
+
+
+def verificar_con_wg(private_key: str) -> bool:
+    """
+    Comprueba que la clave pública calculada aquí coincide byte a byte con `wg pubkey`.
+    """
+    esperado = subprocess.run(
+        [WG_BIN, "pubkey"],
+        input=private_key.encode(),
+        capture_output=True,
+        check=True
+    ).stdout.decode().strip()
+    return public_key_from_private(private_key) == esperado